@@ -0,0 +1,112 @@
+"""
+Compares the requests per second served by the sync query endpoints and by
+the async ones, with many concurrent clients. Start the backend twice, the
+second time with DATABASE_ASYNC=true:
+
+    $ uvicorn molar.backend.main:app --port 8000
+    $ DATABASE_ASYNC=true uvicorn molar.backend.main:app --port 8001
+    $ python benchmarks/query_load.py http://localhost:8000 http://localhost:8001 \\
+        --database-name db --email user@example.com --password pwd
+
+The sync endpoints wait on the database from the threads of the thread pool
+of the server, 40 by default, while the async ones wait on the event loop.
+The database needs the compchem schema. The queries only read from it.
+"""
+# std
+import asyncio
+import time
+
+# external
+import click
+import httpx
+
+QUERY = {
+    "types": ["molecule.smiles"],
+    "order_by": {"type": "molecule.smiles"},
+    "limit": 10,
+}
+
+
+async def client_loop(client, url, headers, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            out = await client.post(url, headers=headers, json=QUERY)
+        except httpx.TransportError as err:
+            errors.append(type(err).__name__)
+            continue
+        if out.status_code != 200:
+            errors.append(out.status_code)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(server, database_name, email, password, n_clients, duration):
+    limits = httpx.Limits(max_connections=n_clients)
+    async with httpx.AsyncClient(base_url=server, limits=limits, timeout=60) as client:
+        out = await client.post(
+            f"/api/v1/login/access-token?database_name={database_name}",
+            data={"username": email, "password": password},
+        )
+        out.raise_for_status()
+        headers = {"Authorization": f"Bearer {out.json()['access_token']}"}
+        url = f"/api/v1/query/{database_name}"
+
+        # a short warm up, so the pools are filled
+        await asyncio.gather(
+            *[
+                client_loop(client, url, headers, time.perf_counter() + 2, [], [])
+                for _ in range(n_clients)
+            ]
+        )
+
+        latencies, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[
+                client_loop(client, url, headers, start + duration, latencies, errors)
+                for _ in range(n_clients)
+            ]
+        )
+        elapsed = time.perf_counter() - start
+
+    # requests failing, e.g. on the timeout of the connection pool, are counted
+    # apart from the throughput
+    if len(latencies) == 0:
+        return 0.0, len(errors), float("nan"), float("nan")
+    latencies.sort()
+    return (
+        len(latencies) / elapsed,
+        len(errors),
+        1000 * latencies[len(latencies) // 2],
+        1000 * latencies[int(len(latencies) * 0.99)],
+    )
+
+
+@click.command()
+@click.argument("sync_server")
+@click.argument("async_server")
+@click.option("--database-name", required=True)
+@click.option("--email", required=True)
+@click.option("--password", required=True)
+@click.option("--n-clients", default=500, help="Number of concurrent clients")
+@click.option("--duration", default=30, help="Duration of each run in seconds")
+def main(
+    sync_server, async_server, database_name, email, password, n_clients, duration
+):
+    results = {}
+    for name, server in [("sync", sync_server), ("async", async_server)]:
+        results[name] = asyncio.run(
+            run(server, database_name, email, password, n_clients, duration)
+        )
+
+    click.echo(f"{n_clients} clients")
+    click.echo(f"{'':6} {'req/s':>9} {'errors':>7} {'median':>11} {'p99':>11}")
+    for name, (throughput, errors, median, p99) in results.items():
+        click.echo(
+            f"{name:6} {throughput:9.1f} {errors:7d} {median:9.1f}ms {p99:9.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,21 @@
 # external
 from fastapi import APIRouter
 
+from ...core.config import settings
 from .endpoints import alembic, database, eventstore, login, query, user, utils
 
 api_router = APIRouter()
+if settings.DATABASE_ASYNC:
+    # matched before the sync endpoints of the same path, which document them
+    api_router.include_router(
+        eventstore.async_router,
+        prefix="/eventstore",
+        tags=["eventstore"],
+        include_in_schema=False,
+    )
+    api_router.include_router(
+        query.async_router, prefix="/query", tags=["query"], include_in_schema=False
+    )
 api_router.include_router(login.router, tags=["login"])
 api_router.include_router(utils.router, prefix="/utils", tags=["utils"])
 api_router.include_router(database.router, prefix="/database", tags=["database"])
@@ -4,9 +4,10 @@ from typing import List, Optional
 # external
 from alembic import command
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.orm import Session
 
 # molar
-from molar.backend import alembic_utils, schemas
+from molar.backend import alembic_utils, database, schemas
 from molar.backend.api import deps
 
 router = APIRouter()
@@ -28,17 +29,31 @@ def get_alembic_revision():
 def alembic_ugprade(
     database_name: str,
     revision: str,
+    db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_superuser),
 ):
+    # The transaction used to authenticate the user would otherwise block
+    # the migrations altering the tables it has read.
+    db.close()
     alembic_config = alembic_utils.get_alembic_config(database_name)
     command.upgrade(alembic_config, revision)
 
+    # the models and the cached queries are reflected again on the next request
+    database.close_database(database_name)
+
 
 @router.post("/downgrade")
 def alembic_downgrade(
     database_name: str,
     revision: str,
+    db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_superuser),
 ):
+    # The transaction used to authenticate the user would otherwise block
+    # the migrations altering the tables it has read.
+    db.close()
     alembic_config = alembic_utils.get_alembic_config(database_name)
     command.downgrade(alembic_config, revision)
+
+    # the models and the cached queries are reflected again on the next request
+    database.close_database(database_name)
@@ -49,10 +49,17 @@ def get_database_requests(
     return out
 
 
+@router.get("/registry", response_model=schemas.DatabaseRegistryStats)
+def get_database_registry_stats(
+    current_user=Depends(deps.get_main_current_active_superuser),
+):
+    return database.DATABASE_REGISTRY.stats()
+
+
 @router.get("/information", response_model=List[schemas.DatabaseInformation])
 def get_database_information(
-    db: Session = Depends(deps.get_db),
-    current_user=Depends(deps.get_current_active_user),
+    db: Session = Depends(deps.get_read_db),
+    current_user=Depends(deps.get_read_current_active_user),
 ):
     results = db.execute(INFORMATION_QUERY).all()
     column_names = [
@@ -92,6 +99,7 @@ def approve_database(
             superuser_email=db_obj.superuser_email,
             superuser_hashed_password=db_obj.superuser_password,
             revisions=db_obj.alembic_revisions,
+            generated_apply=settings.EVENTSTORE_GENERATED_APPLY,
         )
     except alembic.util.exc.CommandError as err:
         raise HTTPException(
@@ -1,29 +1,158 @@
 # std
 from datetime import datetime
-from typing import List
+import json
+from tempfile import SpooledTemporaryFile
+import time
+from typing import AsyncIterator, Iterator, List, Optional
+from uuid import UUID
 
 # external
-from fastapi import APIRouter, Depends, HTTPException
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 import sqlalchemy
 from sqlalchemy.orm import Session
 
 # molar
 from molar.backend import schemas
 from molar.backend.api import deps
+from molar.backend.core.config import settings
+from molar.backend.database.replicas import set_lsn_header
+from molar.backend.utils import json_default
 
 router = APIRouter()
+# served instead of the endpoints of the same path when DATABASE_ASYNC is set
+async_router = APIRouter()
+
+# sent with a full page of events, the after_id of the next page
+AFTER_ID_HEADER = "X-Molar-After-Id"
+
+EVENTSTORE_COLUMNS = [
+    "id",
+    "uuid",
+    "event",
+    "type",
+    "timestamp",
+    "data",
+    "user_id",
+    "alembic_version",
+]
+
+
+def page_size(limit: Optional[int], stream: bool) -> Optional[int]:
+    # a streamed eventstore is only limited on demand
+    if stream:
+        return limit
+    if limit is None:
+        return settings.EVENTSTORE_PAGE_SIZE
+    if limit > settings.EVENTSTORE_MAX_PAGE_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"The limit can't exceed {settings.EVENTSTORE_MAX_PAGE_SIZE} "
+            "events, use stream to read more",
+        )
+    return limit
+
+
+def iterate_from_thread(stream: AsyncIterator[bytes]) -> Iterator[bytes]:
+    # the chunks of a request are received on the event loop, the endpoint
+    # running in the threadpool waits for each of them
+    iterator = stream.__aiter__()
+    while True:
+        try:
+            yield anyio.from_thread.run(iterator.__anext__)
+        except StopAsyncIteration:
+            return
+
+
+def eventstore_page(objs, limit: int, response: Optional[Response]):
+    # a full page may be followed by another one, after its last event
+    if response is not None and len(objs) > 0 and len(objs) == limit:
+        response.headers[AFTER_ID_HEADER] = str(objs[-1].id)
+    return [
+        schemas.EventStore(
+            id=obj.id,
+            uuid=obj.uuid,
+            event=obj.event,
+            type=obj.type,
+            timestamp=obj.timestamp,
+            data=obj.data,
+            user_id=obj.user_id,
+            alembic_version=obj.alembic_version,
+        )
+        for obj in objs
+    ]
 
 
 @router.get("/{database_name}", response_model=List[schemas.EventStore])
 def view_eventstore(
     database_name: str,
-    db: Session = Depends(deps.get_db),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    type: Optional[str] = None,
+    event: Optional[schemas.EventTypes] = None,
+    user_id: Optional[int] = None,
+    after: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    stream: bool = False,
+    db: Session = Depends(deps.get_read_db),
     crud=Depends(deps.get_crud),
-    current_user=Depends(deps.get_current_active_user),
+    current_user=Depends(deps.get_read_current_active_user),
+    session_scope=Depends(deps.get_read_session_scope),
+    response: Response = None,
 ):
+    """
+    Lists the events ordered by id. Use `after_id` and `limit` to page through
+    the eventstore, a page holds `EVENTSTORE_PAGE_SIZE` events by default and a
+    full page carries the `after_id` of the next one in its X-Molar-After-Id
+    header. With `stream`, the events are sent as newline delimited json while
+    they are read from a server-side cursor, and are only limited by `limit`.
+    """
     if crud.eventstore is None:
         raise HTTPException(status_code=404, detail="Eventstore not found")
-    db_obj = crud.eventstore.get_all(db)
+    limit = page_size(limit, stream)
+    query = crud.eventstore.get_filtered(
+        db,
+        after_id=after_id,
+        limit=limit,
+        type=type,
+        event=event,
+        user_id=user_id,
+        after=after,
+        before=before,
+    )
+
+    if stream:
+
+        # the response is sent after the session of the request is closed
+        def _lines():
+            with session_scope() as session:
+                objs = query.with_session(session).yield_per(settings.STREAM_BATCH_SIZE)
+                for obj in objs:
+                    record = {c: getattr(obj, c) for c in EVENTSTORE_COLUMNS}
+                    yield json.dumps(record, default=json_default) + "\n"
+
+        return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+    return eventstore_page(query.all(), limit, response)
+
+
+@router.get("/{database_name}/history/{uuid}", response_model=List[schemas.EventStore])
+def view_history(
+    database_name: str,
+    uuid: UUID,
+    db: Session = Depends(deps.get_read_db),
+    crud=Depends(deps.get_crud),
+    current_user=Depends(deps.get_read_current_active_user),
+):
+    """
+    Lists the events of a single entity, ordered by id.
+    """
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    db_obj = crud.eventstore.get_history(db, uuid=uuid)
+    if len(db_obj) == 0:
+        raise HTTPException(status_code=404, detail="Data not found")
     return [
         schemas.EventStore(
             id=obj.id,
@@ -46,6 +175,8 @@ def create(
     db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_user),
     crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
 ):
     if crud.eventstore is None:
         raise HTTPException(status_code=404, detail="Eventstore not found")
@@ -56,6 +187,7 @@ def create(
             raise HTTPException(status_code=401, detail="Unique constraint violation!")
         raise HTTPException(status_code=500, detail=str(err))
 
+    set_lsn_header(response, db, replicas)
     return schemas.EventStore(
         id=obj_out.id,
         uuid=obj_out.uuid,
@@ -68,6 +200,103 @@ def create(
     )
 
 
+@router.post("/{database_name}/bulk", response_model=schemas.EventStoreBulkResult)
+def create_bulk(
+    database_name: str,
+    events: List[schemas.EventStoreBulkItem],
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_user),
+    crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+
+    start = time.perf_counter()
+    uuids = []
+    if len(events) > 0:
+        try:
+            uuids = crud.eventstore.create_bulk(
+                db, obj_in=events, user_id=current_user.user_id
+            )
+        except sqlalchemy.exc.IntegrityError as err:
+            if "psycopg2.errors.UniqueViolation" in str(err):
+                raise HTTPException(
+                    status_code=401, detail="Unique constraint violation!"
+                )
+            raise HTTPException(status_code=500, detail=str(err))
+        except sqlalchemy.exc.DBAPIError as err:
+            if "psycopg2.errors.NoDataFound" in str(err):
+                raise HTTPException(status_code=404, detail="Data not found")
+            raise HTTPException(status_code=500, detail=str(err))
+        set_lsn_header(response, db, replicas)
+    elapsed = time.perf_counter() - start
+
+    return schemas.EventStoreBulkResult(
+        uuids=uuids,
+        count=len(uuids),
+        elapsed=elapsed,
+        events_per_second=len(uuids) / elapsed if elapsed > 0 else 0.0,
+    )
+
+
+@router.post("/{database_name}/copy", response_model=schemas.EventStoreBulkResult)
+def create_copy(
+    database_name: str,
+    request: Request,
+    return_uuids: bool = True,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_user),
+    crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
+):
+    """
+    Creates entries from a CSV stream with the columns (type, data), data being
+    the json encoded entry. The stream is spooled to disk past
+    COPY_SPOOL_MAX_SIZE bytes, so the payload is never fully held in memory.
+    The endpoint runs in the threadpool, off the event loop, as the spooling
+    and the copy both block.
+    """
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+
+    start = time.perf_counter()
+    with SpooledTemporaryFile(max_size=settings.COPY_SPOOL_MAX_SIZE, mode="w+b") as f:
+        for chunk in iterate_from_thread(request.stream()):
+            f.write(chunk)
+        f.seek(0)
+
+        try:
+            uuids = crud.eventstore.copy_create(
+                db, stream=f, user_id=current_user.user_id
+            )
+        except ValueError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+        except sqlalchemy.exc.IntegrityError as err:
+            if "psycopg2.errors.UniqueViolation" in str(err):
+                raise HTTPException(
+                    status_code=401, detail="Unique constraint violation!"
+                )
+            raise HTTPException(status_code=500, detail=str(err))
+        except sqlalchemy.exc.DataError as err:
+            raise HTTPException(status_code=400, detail=str(err))
+        except sqlalchemy.exc.DBAPIError as err:
+            if "psycopg2.errors.UndefinedTable" in str(err):
+                raise HTTPException(status_code=404, detail="Type not found")
+            raise HTTPException(status_code=500, detail=str(err))
+        set_lsn_header(response, db, replicas)
+    elapsed = time.perf_counter() - start
+
+    return schemas.EventStoreBulkResult(
+        uuids=uuids if return_uuids else [],
+        count=len(uuids),
+        elapsed=elapsed,
+        events_per_second=len(uuids) / elapsed if elapsed > 0 else 0.0,
+    )
+
+
 def update(
     database_name: str,
     event: schemas.EventStoreUpdate,
@@ -100,8 +329,12 @@ def update_patch(
     db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_user),
     crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
 ):
-    return update(database_name, event, db, current_user, crud)
+    obj_out = update(database_name, event, db, current_user, crud)
+    set_lsn_header(response, db, replicas)
+    return obj_out
 
 
 @router.post("/update/{database_name}", response_model=schemas.EventStore)
@@ -111,8 +344,12 @@ def update_post(
     db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_user),
     crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
 ):
-    return update(database_name, event, db, current_user, crud)
+    obj_out = update(database_name, event, db, current_user, crud)
+    set_lsn_header(response, db, replicas)
+    return obj_out
 
 
 @router.delete("/{database_name}", response_model=schemas.EventStore)
@@ -122,6 +359,8 @@ def delete(
     db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_user),
     crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
 ):
     if crud.eventstore is None:
         raise HTTPException(status_code=404, detail="Eventstore not found")
@@ -131,6 +370,7 @@ def delete(
         if "psycopg2.errors.NoDataFound" in str(err):
             raise HTTPException(status_code=404, detail="Data not found")
         raise HTTPException(status_code=500, detail=str(err))
+    set_lsn_header(response, db, replicas)
     return schemas.EventStore(
         id=obj_out.id,
         uuid=obj_out.uuid,
@@ -143,6 +383,39 @@ def delete(
     )
 
 
+@router.get(
+    "/rollback/{database_name}", response_model=List[schemas.EventStoreRollbackPlan]
+)
+def rollback_plan(
+    database_name: str,
+    before: datetime,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    """
+    Dry run of a rollback: returns the number of rows that would be deleted,
+    inserted and updated in each table.
+    """
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        plan = crud.eventstore.rollback_plan(
+            db, before=before, user_id=current_user.user_id
+        )
+    except sqlalchemy.exc.DBAPIError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+    return [
+        schemas.EventStoreRollbackPlan(
+            table_name=row.table_name,
+            deleted=row.deleted,
+            inserted=row.inserted,
+            updated=row.updated,
+        )
+        for row in plan
+    ]
+
+
 @router.patch("/rollback/{database_name}", response_model=schemas.EventStore)
 def rollback(
     database_name: str,
@@ -150,10 +423,238 @@ def rollback(
     db: Session = Depends(deps.get_db),
     current_user=Depends(deps.get_current_active_superuser),
     crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
 ):
     if crud.eventstore is None:
         raise HTTPException(status_code=404, detail="Eventstore not found")
     obj_out = crud.eventstore.rollback(db, before=before, user_id=current_user.user_id)
+    set_lsn_header(response, db, replicas)
+    return schemas.EventStore(
+        id=obj_out.id,
+        uuid=obj_out.uuid,
+        event=obj_out.event,
+        type=obj_out.type,
+        timestamp=obj_out.timestamp,
+        data=obj_out.data,
+        user_id=obj_out.user_id,
+        alembic_version=obj_out.alembic_version,
+    )
+
+
+@router.get(
+    "/{database_name}/partitions", response_model=List[schemas.EventStorePartition]
+)
+def view_partitions(
+    database_name: str,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        partitions = crud.eventstore.get_partitions(db)
+    except sqlalchemy.exc.ProgrammingError as err:
+        if "psycopg2.errors.UndefinedFunction" in str(err):
+            raise HTTPException(status_code=404, detail="Eventstore is not partitioned")
+        raise HTTPException(status_code=500, detail=str(err))
+    return [
+        schemas.EventStorePartition(
+            name=partition.name,
+            lower_bound=partition.lower_bound,
+            upper_bound=partition.upper_bound,
+            count=partition.count,
+        )
+        for partition in partitions
+    ]
+
+
+@router.post("/{database_name}/partitions", response_model=List[str])
+def create_partitions(
+    database_name: str,
+    months_ahead: int = settings.EVENTSTORE_PARTITIONS_AHEAD,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        return crud.eventstore.create_partitions(db, months_ahead=months_ahead)
+    except sqlalchemy.exc.ProgrammingError as err:
+        if "psycopg2.errors.UndefinedFunction" in str(err):
+            raise HTTPException(status_code=404, detail="Eventstore is not partitioned")
+        raise HTTPException(status_code=500, detail=str(err))
+    except sqlalchemy.exc.DBAPIError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+
+@router.patch("/{database_name}/partitions/archive", response_model=List[str])
+def archive_partitions(
+    database_name: str,
+    before: datetime,
+    archive_schema: str = "sourcing_archive",
+    drop: bool = False,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    """
+    Detaches the partitions of the eventstore that only hold events older than
+    `before`. Archived events are no longer taken into account by rollbacks.
+    """
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        return crud.eventstore.archive_partitions(
+            db, before=before, archive_schema=archive_schema, drop=drop
+        )
+    except sqlalchemy.exc.ProgrammingError as err:
+        if "psycopg2.errors.UndefinedFunction" in str(err):
+            raise HTTPException(status_code=404, detail="Eventstore is not partitioned")
+        raise HTTPException(status_code=500, detail=str(err))
+    except sqlalchemy.exc.DBAPIError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+
+@router.get(
+    "/{database_name}/snapshots", response_model=List[schemas.EventStoreSnapshot]
+)
+def view_snapshots(
+    database_name: str,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_user),
+    crud=Depends(deps.get_crud),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    return [
+        schemas.EventStoreSnapshot(**snapshot._mapping)
+        for snapshot in crud.eventstore.get_snapshots(db)
+    ]
+
+
+@router.post("/{database_name}/snapshots", response_model=schemas.EventStoreSnapshot)
+def create_snapshot(
+    database_name: str,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        snapshot = crud.eventstore.create_snapshot(db, user_id=current_user.user_id)
+    except sqlalchemy.exc.DBAPIError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+    return schemas.EventStoreSnapshot(**snapshot._mapping)
+
+
+@router.delete("/{database_name}/snapshots", response_model=List[int])
+def prune_snapshots(
+    database_name: str,
+    before: Optional[datetime] = None,
+    keep: Optional[int] = None,
+    db: Session = Depends(deps.get_db),
+    current_user=Depends(deps.get_current_active_superuser),
+    crud=Depends(deps.get_crud),
+):
+    """
+    Deletes the snapshots created before `before` and/or all but the `keep`
+    most recent ones.
+    """
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    if before is None and keep is None:
+        raise HTTPException(
+            status_code=400, detail="No criterion were provided for the pruning"
+        )
+    try:
+        return crud.eventstore.prune_snapshots(db, before=before, keep=keep)
+    except sqlalchemy.exc.DBAPIError as err:
+        raise HTTPException(status_code=500, detail=str(err))
+
+
+@async_router.get("/{database_name}", response_model=List[schemas.EventStore])
+async def async_view_eventstore(
+    database_name: str,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    type: Optional[str] = None,
+    event: Optional[schemas.EventTypes] = None,
+    user_id: Optional[int] = None,
+    after: Optional[datetime] = None,
+    before: Optional[datetime] = None,
+    stream: bool = False,
+    db=Depends(deps.get_async_db),
+    crud=Depends(deps.get_crud),
+    current_user=Depends(deps.get_async_current_active_user),
+    session_scope=Depends(deps.get_async_session_scope),
+    response: Response = None,
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    limit = page_size(limit, stream)
+    query = crud.eventstore.get_filtered(
+        db.sync_session,
+        after_id=after_id,
+        limit=limit,
+        type=type,
+        event=event,
+        user_id=user_id,
+        after=after,
+        before=before,
+    )
+
+    if stream:
+
+        async def _lines():
+            async with session_scope() as session:
+                result = await session.stream_scalars(query.statement)
+                async for objs in result.partitions(settings.STREAM_BATCH_SIZE):
+                    yield "".join(
+                        json.dumps(
+                            {c: getattr(obj, c) for c in EVENTSTORE_COLUMNS},
+                            default=json_default,
+                        )
+                        + "\n"
+                        for obj in objs
+                    )
+
+        return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+    return eventstore_page(
+        (await db.scalars(query.statement)).all(), limit, response
+    )
+
+
+@async_router.post("/{database_name}", response_model=schemas.EventStore)
+async def async_create(
+    database_name: str,
+    event: schemas.EventStoreCreate,
+    db=Depends(deps.get_async_db),
+    current_user=Depends(deps.get_async_current_active_user),
+    crud=Depends(deps.get_crud),
+    response: Response = None,
+    replicas=Depends(deps.get_replicas),
+):
+    if crud.eventstore is None:
+        raise HTTPException(status_code=404, detail="Eventstore not found")
+    try:
+        obj_out = await db.run_sync(
+            lambda session: crud.eventstore.create(
+                session, obj_in=event, user_id=current_user.user_id
+            )
+        )
+    except sqlalchemy.exc.IntegrityError as err:
+        # psycopg2.errors.UniqueViolation, asyncpg.exceptions.UniqueViolationError
+        if "UniqueViolation" in str(err):
+            raise HTTPException(status_code=401, detail="Unique constraint violation!")
+        raise HTTPException(status_code=500, detail=str(err))
+
+    await db.run_sync(lambda session: set_lsn_header(response, session, replicas))
+
     return schemas.EventStore(
         id=obj_out.id,
         uuid=obj_out.uuid,
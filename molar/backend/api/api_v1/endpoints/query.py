@@ -1,8 +1,11 @@
 # std
-from typing import Any, Dict, List, Optional, Union
+from datetime import datetime
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Union
 
 # external
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
 import sqlalchemy
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Session
@@ -10,9 +13,109 @@ from sqlalchemy.orm import Session
 # molar
 from molar.backend import schemas
 from molar.backend.api import deps
-from molar.backend.database.query import process_query_output, query_builder
+from molar.backend.core.config import settings
+from molar.backend.database import arrow
+from molar.backend.database.query import (
+    cached_query_builder,
+    count_query,
+    decode_cursor,
+    encode_cursor,
+    excluded_columns,
+    iter_query_output,
+    process_query_output,
+    query_builder,
+    query_tables,
+    result_etag,
+    result_key,
+    table_versions,
+)
+from molar.backend.database.utils import RowExtractor
+from molar.backend.utils import json_default
 
 router = APIRouter()
+# served instead of the endpoints of the same path when DATABASE_ASYNC is set
+async_router = APIRouter()
+
+CURSOR_HEADER = "X-Molar-Cursor"
+
+
+def start_read_only_transaction(db: Session):
+    # time-travel queries never write: the transaction opened to authenticate
+    # the user is ended so the next one can be declared read only
+    db.commit()
+    db.execute("set transaction read only")
+
+
+def stream_query_output(
+    session_scope, query, db_objs, types, media_type: str, exclude=None
+):
+    # the rows are fetched from a server-side cursor, by batches, while the
+    # response is sent: the generator reads them from a session of its own
+    def _rows():
+        with session_scope() as session:
+            yield from query.with_session(session).yield_per(settings.STREAM_BATCH_SIZE)
+
+    if media_type == arrow.ARROW_STREAM_MEDIA_TYPE:
+        return StreamingResponse(
+            arrow.iter_arrow_stream(
+                db_objs, _rows(), types, settings.STREAM_BATCH_SIZE, exclude
+            ),
+            media_type=media_type,
+        )
+
+    def _lines():
+        for records in iter_query_output(
+            db_objs, _rows(), types, settings.STREAM_BATCH_SIZE, exclude
+        ):
+            yield "".join(
+                json.dumps(record, default=json_default) + "\n" for record in records
+            )
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+
+class StreamedQuery(NamedTuple):
+    session_scope: Any
+    query: Any
+    db_objs: List[Any]
+    types: List[str]
+    media_type: str
+    exclude: Dict[int, Any]
+
+
+def async_stream_query_output(streamed: StreamedQuery):
+    async def _partitions():
+        async with streamed.session_scope() as session:
+            # the async session can't iterate a query, its statement is
+            # streamed instead
+            result = await session.stream(streamed.query.statement)
+            if streamed.query.is_single_entity:
+                result = result.scalars()
+            async for rows in result.partitions(settings.STREAM_BATCH_SIZE):
+                yield rows
+
+    if streamed.media_type == arrow.ARROW_STREAM_MEDIA_TYPE:
+        writer = arrow.ArrowStreamWriter(
+            streamed.db_objs, streamed.types, streamed.exclude
+        )
+
+        async def _batches():
+            async for rows in _partitions():
+                yield writer.write(rows)
+            yield writer.close()
+
+        return StreamingResponse(_batches(), media_type=streamed.media_type)
+
+    extractor = RowExtractor(streamed.db_objs, streamed.types, streamed.exclude)
+
+    async def _lines():
+        async for rows in _partitions():
+            yield "".join(
+                json.dumps(record, default=json_default) + "\n"
+                for record in extractor.records(rows)
+            )
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
 
 
 def query(
@@ -21,20 +124,142 @@ def query(
     current_user,
     database_name: str,
     types: schemas.QueryTypes,
-    limit: int = 10,
+    limit: Optional[int] = None,
     offset: int = 0,
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     aliases: Optional[schemas.QueryAliases] = None,
     order_by: Optional[schemas.QueryOrderBys] = None,
+    as_of: Optional[datetime] = None,
+    query_cache=None,
+    columnar: bool = False,
+    media_type: str = "application/json",
+    stream: bool = False,
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    response: Optional[Response] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
+    result_cache=None,
+    if_none_match: Optional[str] = None,
+    session_scope=None,
+    stream_output=stream_query_output,
 ):
     if db is None:
         raise HTTPException(status_code=404, detail="Database not found!")
-    try:
-        query, db_objs, types = query_builder(
-            db, models, types, limit, offset, joins, filters, order_by, aliases
+    if defer_large is None:
+        defer_large = settings.QUERY_DEFER_LARGE_COLUMNS
+    # a streamed result is only limited on demand, a page holds 10 rows
+    if limit is None and not stream:
+        limit = 10
+    if media_type != "application/json" and arrow.pyarrow is None:
+        raise HTTPException(
+            status_code=406, detail=f"{media_type} responses require pyarrow"
         )
-        records = process_query_output(db_objs, query.all(), types)
+    if stream and media_type == arrow.PARQUET_MEDIA_TYPE:
+        raise HTTPException(status_code=400, detail="Parquet files can't be streamed")
+    if as_of is not None:
+        start_read_only_transaction(db)
+    try:
+        cursor_values = decode_cursor(cursor) if cursor is not None else None
+        keyset = keyset or cursor_values is not None
+        # time-travel queries are not cached, their subqueries differ by as_of
+        if as_of is None and query_cache is not None and query_cache.max_size > 0:
+            query, db_objs, types = cached_query_builder(
+                db,
+                models,
+                query_cache,
+                types,
+                limit,
+                offset,
+                joins,
+                filters,
+                order_by,
+                aliases,
+                keyset,
+                cursor_values,
+                aggregates,
+                group_by,
+                having,
+                projections,
+                defer_large,
+            )
+        else:
+            query, db_objs, types = query_builder(
+                db,
+                models,
+                types,
+                limit,
+                offset,
+                joins,
+                filters,
+                order_by,
+                aliases,
+                as_of,
+                keyset=keyset,
+                cursor=cursor_values,
+                aggregates=aggregates,
+                group_by=group_by,
+                having=having,
+                projections=projections,
+                defer_large=defer_large,
+            )
+        # the deferred columns are not read from the rows either
+        exclude = excluded_columns(db_objs, types, projections, defer_large)
+        if stream:
+            return stream_output(
+                session_scope, query, db_objs, types, media_type, exclude
+            )
+
+        # the versions are read before the rows: a result can be more recent
+        # than its etag, never older
+        etag = tables = None
+        if result_cache is not None and result_cache.max_size > 0 and as_of is None:
+            tables = query_tables(query)
+        if tables:
+            key = result_key(
+                query,
+                user_id=current_user.user_id,
+                media_type=media_type,
+                columnar=columnar,
+                keyset=keyset,
+            )
+            etag = result_etag(key, table_versions(db, tables))
+            if if_none_match is not None and etag in [
+                tag.strip() for tag in if_none_match.split(",")
+            ]:
+                return Response(status_code=304, headers={"ETag": etag})
+            cached = result_cache.get(key, etag)
+            if cached is not None:
+                content, headers = cached
+                return Response(
+                    content=content, media_type=media_type, headers=headers
+                )
+
+        rows = query.all()
+        headers = {}
+        # a full page may be followed by another one, starting after its last row
+        if keyset and len(rows) > 0 and len(rows) == limit:
+            headers[CURSOR_HEADER] = encode_cursor(list(rows[-1][len(db_objs) :]))
+
+        if media_type != "application/json":
+            table = arrow.query_output_to_table(db_objs, rows, types, exclude)
+            content = arrow.serialize_table(table, media_type)
+        else:
+            records = process_query_output(db_objs, rows, types, columnar, exclude)
+            if etag is None:
+                if response is not None:
+                    response.headers.update(headers)
+                return records
+            content = json.dumps(records, default=json_default).encode()
+
+        if etag is not None:
+            headers["ETag"] = etag
+            result_cache.set(key, etag, (content, headers))
+        return Response(content=content, media_type=media_type, headers=headers)
     except ValueError as err:
         raise HTTPException(status_code=400, detail=str(err))
 
@@ -42,13 +267,12 @@ def query(
         raise HTTPException(status_code=400, detail=str(err))
 
     except sqlalchemy.exc.ProgrammingError as err:
-        if "specified more than once":
+        if "specified more than once" in str(err):
             raise HTTPException(
                 status_code=400,
                 detail="A field is specified more than once in the query!",
             )
         raise HTTPException(status_code=400, detail=str(err))
-    return records
 
 
 def debug_query(
@@ -64,12 +288,36 @@ def debug_query(
     aliases: Optional[schemas.QueryAliases] = None,
     order_by: Optional[schemas.QueryOrderBys] = None,
     explain_analyze: bool = False,
+    as_of: Optional[datetime] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
 ):
     if db is None:
         raise HTTPException(status_code=404, detail="Database not found!")
+    if defer_large is None:
+        defer_large = settings.QUERY_DEFER_LARGE_COLUMNS
+    if as_of is not None:
+        start_read_only_transaction(db)
 
     query, _, _ = query_builder(
-        db, models, types, limit, offset, joins, filters, order_by, aliases
+        db,
+        models,
+        types,
+        limit,
+        offset,
+        joins,
+        filters,
+        order_by,
+        aliases,
+        as_of,
+        aggregates=aggregates,
+        group_by=group_by,
+        having=having,
+        projections=projections,
+        defer_large=defer_large,
     )
     statement = str(
         query.statement.compile(
@@ -84,19 +332,38 @@ def debug_query(
     return "\n".join([res[0] for res in result.all()])
 
 
-@router.get("/{database_name}", response_model=List[Dict[str, Any]])
+@router.get(
+    "/{database_name}",
+    response_model=Union[List[Dict[str, Any]], Dict[str, List[Any]]],
+)
 def get_query(
     database_name: str,
     types: schemas.QueryTypes,
-    limit: int = 10,
+    limit: Optional[int] = None,
     offset: int = 0,
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     aliases: Optional[schemas.QueryAliases] = None,
-    db: Session = Depends(deps.get_db),
+    db: Session = Depends(deps.get_read_db),
     models=Depends(deps.get_models),
-    current_user=Depends(deps.get_current_active_user),
+    current_user=Depends(deps.get_read_current_active_user),
     order_by: Optional[schemas.QueryOrderBys] = None,
+    as_of: Optional[datetime] = None,
+    query_cache=Depends(deps.get_query_cache),
+    columnar: bool = False,
+    accept: Optional[str] = Header(None),
+    stream: bool = False,
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    response: Response = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
+    result_cache=Depends(deps.get_result_cache),
+    if_none_match: Optional[str] = Header(None),
+    session_scope=Depends(deps.get_read_session_scope),
 ):
     return query(
         db,
@@ -110,22 +377,57 @@ def get_query(
         filters,
         aliases,
         order_by,
+        as_of,
+        query_cache,
+        columnar,
+        arrow.negotiate_media_type(accept),
+        stream,
+        keyset,
+        cursor,
+        response,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+        result_cache,
+        if_none_match,
+        session_scope=session_scope,
     )
 
 
-@router.post("/{database_name}", response_model=List[Dict[str, Any]])
+@router.post(
+    "/{database_name}",
+    response_model=Union[List[Dict[str, Any]], Dict[str, List[Any]]],
+)
 def post_query(
     database_name: str,
     types: schemas.QueryTypes,
-    limit: int = 10,
+    limit: Optional[int] = None,
     offset: int = 0,
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     aliases: Optional[schemas.QueryAliases] = None,
-    db: Session = Depends(deps.get_db),
+    db: Session = Depends(deps.get_read_db),
     models=Depends(deps.get_models),
-    current_user=Depends(deps.get_current_active_user),
+    current_user=Depends(deps.get_read_current_active_user),
     order_by: Optional[schemas.QueryOrderBys] = None,
+    as_of: Optional[datetime] = None,
+    query_cache=Depends(deps.get_query_cache),
+    columnar: bool = False,
+    accept: Optional[str] = Header(None),
+    stream: bool = False,
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    response: Response = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
+    result_cache=Depends(deps.get_result_cache),
+    if_none_match: Optional[str] = Header(None),
+    session_scope=Depends(deps.get_read_session_scope),
 ):
     return query(
         db,
@@ -139,6 +441,130 @@ def post_query(
         filters,
         aliases,
         order_by,
+        as_of,
+        query_cache,
+        columnar,
+        arrow.negotiate_media_type(accept),
+        stream,
+        keyset,
+        cursor,
+        response,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+        result_cache,
+        if_none_match,
+        session_scope=session_scope,
+    )
+
+
+def count(
+    db,
+    models,
+    current_user,
+    database_name: str,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    estimate: bool = False,
+    as_of: Optional[datetime] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+):
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found!")
+    if as_of is not None:
+        start_read_only_transaction(db)
+    try:
+        query, _, _ = query_builder(
+            db,
+            models,
+            types,
+            None,
+            None,
+            joins,
+            filters,
+            None,
+            aliases,
+            as_of,
+            group_by=group_by,
+            having=having,
+        )
+        return schemas.QueryCount(
+            count=count_query(db, query, estimate), estimate=estimate
+        )
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+
+    except sqlalchemy.exc.AmbiguousForeignKeysError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+
+    except sqlalchemy.exc.ProgrammingError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+
+
+@router.get("/{database_name}/count", response_model=schemas.QueryCount)
+def get_count(
+    database_name: str,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db: Session = Depends(deps.get_read_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_read_current_active_user),
+    estimate: bool = False,
+    as_of: Optional[datetime] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+):
+    return count(
+        db,
+        models,
+        current_user,
+        database_name,
+        types,
+        joins,
+        filters,
+        aliases,
+        estimate,
+        as_of,
+        group_by,
+        having,
+    )
+
+
+@router.post("/{database_name}/count", response_model=schemas.QueryCount)
+def post_count(
+    database_name: str,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db: Session = Depends(deps.get_read_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_read_current_active_user),
+    estimate: bool = False,
+    as_of: Optional[datetime] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+):
+    return count(
+        db,
+        models,
+        current_user,
+        database_name,
+        types,
+        joins,
+        filters,
+        aliases,
+        estimate,
+        as_of,
+        group_by,
+        having,
     )
 
 
@@ -151,11 +577,17 @@ def get_debug_query(
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     aliases: Optional[schemas.QueryAliases] = None,
-    db: Session = Depends(deps.get_db),
+    db: Session = Depends(deps.get_debug_db),
     models=Depends(deps.get_models),
-    current_user=Depends(deps.get_current_active_user),
+    current_user=Depends(deps.get_read_current_active_user),
     order_by: Optional[schemas.QueryOrderBys] = None,
     explain_analyze: bool = False,
+    as_of: Optional[datetime] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
 ):
     return debug_query(
         db,
@@ -170,6 +602,12 @@ def get_debug_query(
         aliases,
         order_by,
         explain_analyze,
+        as_of,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
     )
 
 
@@ -182,11 +620,17 @@ def post_debug_query(
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     aliases: Optional[schemas.QueryAliases] = None,
-    db: Session = Depends(deps.get_db),
+    db: Session = Depends(deps.get_debug_db),
     models=Depends(deps.get_models),
-    current_user=Depends(deps.get_current_active_user),
+    current_user=Depends(deps.get_read_current_active_user),
     order_by: Optional[schemas.QueryOrderBys] = None,
     explain_analyze: bool = False,
+    as_of: Optional[datetime] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
 ):
     return debug_query(
         db,
@@ -201,4 +645,237 @@ def post_debug_query(
         aliases,
         order_by,
         explain_analyze,
+        as_of,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+    )
+
+
+@router.get("/cache/{database_name}", response_model=schemas.QueryCacheStats)
+def get_query_cache_stats(
+    database_name: str,
+    current_user=Depends(deps.get_current_active_superuser),
+    query_cache=Depends(deps.get_query_cache),
+):
+    if query_cache is None:
+        raise HTTPException(status_code=404, detail="Database not found!")
+    return query_cache.stats()
+
+
+async def async_query(db, *args, session_scope=None):
+    """
+    Runs `query` on the connection of an async session: the orm query is built
+    and executed the same way, without holding a thread of the pool while the
+    database answers. Streamed results are read from an async session.
+    """
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found!")
+    result = await db.run_sync(
+        lambda session: query(
+            session, *args, session_scope=session_scope, stream_output=StreamedQuery
+        )
+    )
+    if not isinstance(result, StreamedQuery):
+        return result
+    return async_stream_query_output(result)
+
+
+@async_router.get(
+    "/{database_name}",
+    response_model=Union[List[Dict[str, Any]], Dict[str, List[Any]]],
+)
+async def async_get_query(
+    database_name: str,
+    types: schemas.QueryTypes,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db=Depends(deps.get_async_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_async_current_active_user),
+    order_by: Optional[schemas.QueryOrderBys] = None,
+    as_of: Optional[datetime] = None,
+    query_cache=Depends(deps.get_query_cache),
+    columnar: bool = False,
+    accept: Optional[str] = Header(None),
+    stream: bool = False,
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    response: Response = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
+    result_cache=Depends(deps.get_result_cache),
+    if_none_match: Optional[str] = Header(None),
+    session_scope=Depends(deps.get_async_session_scope),
+):
+    return await async_query(
+        db,
+        models,
+        current_user,
+        database_name,
+        types,
+        limit,
+        offset,
+        joins,
+        filters,
+        aliases,
+        order_by,
+        as_of,
+        query_cache,
+        columnar,
+        arrow.negotiate_media_type(accept),
+        stream,
+        keyset,
+        cursor,
+        response,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+        result_cache,
+        if_none_match,
+        session_scope=session_scope,
+    )
+
+
+@async_router.post(
+    "/{database_name}",
+    response_model=Union[List[Dict[str, Any]], Dict[str, List[Any]]],
+)
+async def async_post_query(
+    database_name: str,
+    types: schemas.QueryTypes,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db=Depends(deps.get_async_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_async_current_active_user),
+    order_by: Optional[schemas.QueryOrderBys] = None,
+    as_of: Optional[datetime] = None,
+    query_cache=Depends(deps.get_query_cache),
+    columnar: bool = False,
+    accept: Optional[str] = Header(None),
+    stream: bool = False,
+    keyset: bool = False,
+    cursor: Optional[str] = None,
+    response: Response = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: Optional[bool] = None,
+    result_cache=Depends(deps.get_result_cache),
+    if_none_match: Optional[str] = Header(None),
+    session_scope=Depends(deps.get_async_session_scope),
+):
+    return await async_query(
+        db,
+        models,
+        current_user,
+        database_name,
+        types,
+        limit,
+        offset,
+        joins,
+        filters,
+        aliases,
+        order_by,
+        as_of,
+        query_cache,
+        columnar,
+        arrow.negotiate_media_type(accept),
+        stream,
+        keyset,
+        cursor,
+        response,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+        result_cache,
+        if_none_match,
+        session_scope=session_scope,
+    )
+
+
+@async_router.get("/{database_name}/count", response_model=schemas.QueryCount)
+async def async_get_count(
+    database_name: str,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db=Depends(deps.get_async_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_async_current_active_user),
+    estimate: bool = False,
+    as_of: Optional[datetime] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+):
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found!")
+    return await db.run_sync(
+        lambda session: count(
+            session,
+            models,
+            current_user,
+            database_name,
+            types,
+            joins,
+            filters,
+            aliases,
+            estimate,
+            as_of,
+            group_by,
+            having,
+        )
+    )
+
+
+@async_router.post("/{database_name}/count", response_model=schemas.QueryCount)
+async def async_post_count(
+    database_name: str,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    db=Depends(deps.get_async_db),
+    models=Depends(deps.get_models),
+    current_user=Depends(deps.get_async_current_active_user),
+    estimate: bool = False,
+    as_of: Optional[datetime] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+):
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found!")
+    return await db.run_sync(
+        lambda session: count(
+            session,
+            models,
+            current_user,
+            database_name,
+            types,
+            joins,
+            filters,
+            aliases,
+            estimate,
+            as_of,
+            group_by,
+            having,
+        )
     )
@@ -1,8 +1,9 @@
 # std
-from typing import Generator, Optional
+from functools import partial
+from typing import AsyncGenerator, Generator, Optional
 
 # external
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt
 from pydantic import ValidationError
@@ -19,11 +20,12 @@ reusable_oauth2 = OAuth2PasswordBearer(
 
 
 def get_main_db() -> Generator:
+    base = database.main
+    session = base.open_session()
     try:
-        session = database.main.session_local()
         yield session
     finally:
-        session.close()
+        base.close_session(session)
 
 
 def get_main_crud():
@@ -73,41 +75,127 @@ def get_main_current_active_superuser(
     return current_user
 
 
-def get_db(database_name: Optional[str] = "main") -> Generator:
+def get_database_handler(database_name: Optional[str] = "main") -> Generator:
+    # the dependencies of a request share its handler, which isn't evicted
+    # from the registry until the request is done
+    base = database.acquire_database(database_name)
+    if base is None:
+        yield None
+        return
+
+    try:
+        yield base
+    finally:
+        database.DATABASE_REGISTRY.release(base)
+
+
+def get_db(base=Depends(get_database_handler)) -> Generator:
+    if base is None:
+        yield None
+        return
+
+    session = base.open_session()
+    try:
+        yield session
+    finally:
+        base.close_session(session)
+
+
+def get_read_db(
+    x_molar_lsn: Optional[str] = Header(None),
+    base=Depends(get_database_handler),
+) -> Generator:
+    if base is None:
+        yield None
+        return
+
+    # on a replica, unless it hasn't replayed the last write of the client yet
+    try:
+        session = base.open_read_session(x_molar_lsn)
+    except ValueError as err:
+        raise HTTPException(status_code=400, detail=str(err))
+    try:
+        yield session
+    finally:
+        base.close_session(session)
+
+
+def get_debug_db(
+    explain_analyze: bool = False,
+    x_molar_lsn: Optional[str] = Header(None),
+    base=Depends(get_database_handler),
+) -> Generator:
+    # explain analyze runs the query, it's timed on the primary
+    if explain_analyze:
+        yield from get_db(base)
+    else:
+        yield from get_read_db(x_molar_lsn, base)
+
+
+async def get_async_db(base=Depends(get_database_handler)) -> AsyncGenerator:
+    # opening a database reflects it, the handler is resolved in the thread
+    # pool, off the event loop
+    if base is None:
+        yield None
+        return
+    if base.async_session_local is None:
+        raise HTTPException(status_code=501, detail="DATABASE_ASYNC is disabled")
+
+    session = base.open_async_session()
     try:
-        base = getattr(database, database_name)
-        if base is None:
-            yield None
-        else:
-            session = base.session_local()
-            yield session
+        yield session
     finally:
-        if base is not None:
-            session.close()
+        await base.close_async_session(session)
+
+
+def get_read_session_scope(
+    x_molar_lsn: Optional[str] = Header(None),
+    base=Depends(get_database_handler),
+):
+    # a streamed response is sent once the request is done, its generator
+    # opens a session of its own, where the reads of the request go
+    if base is None:
+        return None
+    return partial(base.read_session, x_molar_lsn)
+
+
+def get_async_session_scope(base=Depends(get_database_handler)):
+    if base is None:
+        return None
+    return base.async_session
 
 
-def get_crud(database_name: Optional[str] = "main"):
-    base = getattr(database, database_name)
+def get_crud(base=Depends(get_database_handler)):
     if base is None:
         return None
     return base.crud
 
 
-def get_models(database_name: Optional[str] = "main"):
-    base = getattr(database, database_name)
+def get_models(base=Depends(get_database_handler)):
     if base is None:
         return None
     return base.models
 
 
-def get_current_user(
-    database_name: str = "main",
-    db: Session = Depends(get_db),
-    crud: CRUDInterface = Depends(get_crud),
-    token: str = Depends(reusable_oauth2),
-):
-    if db is None:
-        raise HTTPException(status_code=404, detail="Database not found")
+def get_replicas(base=Depends(get_database_handler)):
+    if base is None:
+        return None
+    return base.replicas
+
+
+def get_query_cache(base=Depends(get_database_handler)):
+    if base is None:
+        return None
+    return base.query_cache
+
+
+def get_result_cache(base=Depends(get_database_handler)):
+    if base is None:
+        return None
+    return base.result_cache
+
+
+def decode_token(token: str, database_name: str) -> schemas.TokenPayload:
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[security.ALGORITHM]
@@ -121,6 +209,13 @@ def get_current_user(
 
     if token_data.db != database_name:
         raise HTTPException(status_code=403, detail="Not allowed on this database")
+    return token_data
+
+
+def authenticate(database_name: str, db, crud: CRUDInterface, token: str):
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found")
+    token_data = decode_token(token, database_name)
 
     if crud is None or not hasattr(crud, "user"):
         raise HTTPException(status_code=404, detail="User table not found")
@@ -131,6 +226,24 @@ def get_current_user(
     return user
 
 
+def get_current_user(
+    database_name: str = "main",
+    db: Session = Depends(get_db),
+    crud: CRUDInterface = Depends(get_crud),
+    token: str = Depends(reusable_oauth2),
+):
+    return authenticate(database_name, db, crud, token)
+
+
+def get_read_current_user(
+    database_name: str = "main",
+    db: Session = Depends(get_read_db),
+    crud: CRUDInterface = Depends(get_crud),
+    token: str = Depends(reusable_oauth2),
+):
+    return authenticate(database_name, db, crud, token)
+
+
 def get_current_active_user(
     crud: CRUDInterface = Depends(get_crud),
     current_user=Depends(get_current_user),
@@ -140,6 +253,15 @@ def get_current_active_user(
     return current_user
 
 
+def get_read_current_active_user(
+    crud: CRUDInterface = Depends(get_crud),
+    current_user=Depends(get_read_current_user),
+):
+    if not crud.user.is_active(current_user):
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
+
+
 def get_current_active_superuser(
     crud: CRUDInterface = Depends(get_crud),
     current_user=Depends(get_current_user),
@@ -149,3 +271,25 @@ def get_current_active_superuser(
             status_code=400, detail="The user doesn't have enough privileges"
         )
     return current_user
+
+
+async def get_async_current_user(
+    database_name: str = "main",
+    db=Depends(get_async_db),
+    crud: CRUDInterface = Depends(get_crud),
+    token: str = Depends(reusable_oauth2),
+):
+    if db is None:
+        raise HTTPException(status_code=404, detail="Database not found")
+    return await db.run_sync(
+        lambda session: authenticate(database_name, session, crud, token)
+    )
+
+
+async def get_async_current_active_user(
+    crud: CRUDInterface = Depends(get_crud),
+    current_user=Depends(get_async_current_user),
+):
+    if not crud.user.is_active(current_user):
+        raise HTTPException(status_code=400, detail="Inactive user")
+    return current_user
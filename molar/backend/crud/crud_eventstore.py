@@ -1,12 +1,18 @@
 # std
-from datetime import datetime
+from datetime import date, datetime
+import json
+from typing import IO, List, Optional
+from uuid import UUID
 
 # external
+import sqlalchemy
 from sqlalchemy.orm import Session
 
 # molar
+from molar.backend.core.config import settings
 from molar.backend.schemas.eventstore import (
     EventStore,
+    EventStoreBulkItem,
     EventStoreCreate,
     EventStoreDelete,
     EventStoreUpdate,
@@ -15,12 +21,64 @@ from molar.backend.schemas.eventstore import (
 
 from .base import CRUDBase, ModelType
 
+STAGING_TABLE = (
+    "create temporary table eventstore_staging ("
+    '    "position" bigint generated always as identity,'
+    '    "type" character varying(2044),'
+    '    "uuid" uuid default uuid_generate_v4() not null,'
+    "    \"data\" jsonb default '{}' not null"
+    ") on commit drop"
+)
+
 
 class CRUDEventStore(CRUDBase[ModelType, EventStoreCreate, EventStoreUpdate]):
+    _partitions_checked_on: Optional[date] = None
+
     def get_all(self, db: Session):
         return db.query(self.model).all()
 
+    def get_filtered(
+        self,
+        db: Session,
+        *,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        type: Optional[str] = None,
+        event: Optional[EventTypes] = None,
+        user_id: Optional[int] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+    ):
+        """
+        Returns the query of the events matching the filters, ordered by id.
+        Pages are fetched with keyset pagination: `after_id` is the id of the last
+        event of the previous page.
+        """
+        filters = []
+        if after_id is not None:
+            filters.append(self.model.id > after_id)
+        if type is not None:
+            filters.append(self.model.type == type)
+        if event is not None:
+            filters.append(self.model.event == event.value)
+        if user_id is not None:
+            filters.append(self.model.user_id == user_id)
+        if after is not None:
+            filters.append(self.model.timestamp >= after)
+        if before is not None:
+            filters.append(self.model.timestamp < before)
+        return db.query(self.model).filter(*filters).order_by(self.model.id).limit(limit)
+
+    def get_history(self, db: Session, *, uuid: UUID):
+        return (
+            db.query(self.model)
+            .filter(self.model.uuid == str(uuid))
+            .order_by(self.model.id)
+            .all()
+        )
+
     def create(self, db: Session, *, obj_in: EventStoreCreate, user_id: int):
+        self.ensure_partitions(db)
         db_obj = self.model(
             event="create", type=obj_in.type, data=obj_in.data, user_id=user_id
         )
@@ -29,7 +87,75 @@ class CRUDEventStore(CRUDBase[ModelType, EventStoreCreate, EventStoreUpdate]):
         db.refresh(db_obj)
         return db_obj
 
+    def create_bulk(
+        self, db: Session, *, obj_in: List[EventStoreBulkItem], user_id: int
+    ):
+        """
+        Inserts all the events with a single multi-row insert in one transaction.
+        If any event fails to be applied, the whole batch is rolled back.
+        Returns the uuids of the events in the order they were given.
+        """
+        self.ensure_partitions(db)
+        table = self.model.__table__
+        values = [
+            {
+                "event": obj.event.value,
+                "type": obj.type,
+                "uuid": str(obj.uuid) if obj.uuid is not None else None,
+                "data": obj.data,
+                "user_id": user_id,
+            }
+            for obj in obj_in
+        ]
+        query = (
+            sqlalchemy.insert(table)
+            .values(values)
+            .returning(table.c.id, table.c.uuid)
+        )
+        try:
+            results = db.execute(query).all()
+            db.commit()
+        except sqlalchemy.exc.DBAPIError:
+            db.rollback()
+            raise
+        return [result.uuid for result in sorted(results, key=lambda r: r.id)]
+
+    def copy_create(self, db: Session, *, stream: IO, user_id: int):
+        """
+        Loads create events from a CSV stream with the columns (type, data) in a
+        staging table using COPY, then applies them to the public tables and
+        records them in the eventstore with set-based queries.
+        Returns the uuids of the created entries in the order of the stream.
+        """
+        self.ensure_partitions(db)
+        try:
+            db.execute(STAGING_TABLE)
+            cursor = db.connection().connection.cursor()
+            try:
+                cursor.copy_expert(
+                    "copy eventstore_staging (type, data) from stdin with (format csv)",
+                    stream,
+                )
+            except Exception as err:
+                raise ValueError(f"Invalid CSV stream: {err}")
+            finally:
+                cursor.close()
+
+            results = db.execute(
+                sqlalchemy.text(
+                    "select * from sourcing.apply_staged_events("
+                    "'eventstore_staging', :user_id)"
+                ),
+                {"user_id": user_id},
+            ).all()
+            db.commit()
+        except (sqlalchemy.exc.DBAPIError, ValueError):
+            db.rollback()
+            raise
+        return [result.uuid for result in sorted(results, key=lambda r: r.id)]
+
     def update(self, db: Session, *, obj_in: EventStoreUpdate, user_id: int):
+        self.ensure_partitions(db)
         db_obj = self.model(
             event="update",
             uuid=str(obj_in.uuid),
@@ -43,6 +169,7 @@ class CRUDEventStore(CRUDBase[ModelType, EventStoreCreate, EventStoreUpdate]):
         return db_obj
 
     def delete(self, db: Session, *, obj_in: EventStoreDelete, user_id: int):
+        self.ensure_partitions(db)
         db_obj = self.model(
             event="delete", type=obj_in.type, uuid=str(obj_in.uuid), user_id=user_id
         )
@@ -52,6 +179,7 @@ class CRUDEventStore(CRUDBase[ModelType, EventStoreCreate, EventStoreUpdate]):
         return db_obj
 
     def rollback(self, db: Session, *, before: datetime, user_id: int):
+        self.ensure_partitions(db)
         db_obj = self.model(
             event="rollback", data={"before": str(before)}, user_id=user_id
         )
@@ -59,3 +187,126 @@ class CRUDEventStore(CRUDBase[ModelType, EventStoreCreate, EventStoreUpdate]):
         db.commit()
         db.refresh(db_obj)
         return db_obj
+
+    def rollback_plan(self, db: Session, *, before: datetime, user_id: int):
+        """
+        Returns, for each table, the number of rows a rollback would delete,
+        insert and update, without applying it.
+        """
+        try:
+            return db.execute(
+                sqlalchemy.text(
+                    "select * from sourcing.rollback_tables("
+                    "cast(:criteria as jsonb), now()::timestamp, :user_id, true)"
+                ),
+                {"criteria": json.dumps({"before": str(before)}), "user_id": user_id},
+            ).all()
+        finally:
+            db.rollback()
+
+    def get_snapshots(self, db: Session):
+        return db.execute(
+            "select * from sourcing.snapshot order by event_id desc"
+        ).all()
+
+    def create_snapshot(self, db: Session, *, user_id: int):
+        """
+        Copies the public tables in a new snapshot, used as a starting point by
+        the reconstructions and rollbacks to a later point in time.
+        """
+        try:
+            snapshot_id = db.execute(
+                sqlalchemy.text("select sourcing.create_snapshot(:user_id)"),
+                {"user_id": user_id},
+            ).scalar()
+            db.commit()
+        except sqlalchemy.exc.DBAPIError:
+            db.rollback()
+            raise
+        return db.execute(
+            sqlalchemy.text(
+                "select * from sourcing.snapshot where snapshot_id = :snapshot_id"
+            ),
+            {"snapshot_id": snapshot_id},
+        ).one()
+
+    def prune_snapshots(
+        self,
+        db: Session,
+        *,
+        before: Optional[datetime] = None,
+        keep: Optional[int] = None,
+    ):
+        try:
+            results = db.execute(
+                sqlalchemy.text(
+                    "select * from sourcing.prune_snapshots(:before, :keep)"
+                ),
+                {"before": before, "keep": keep},
+            ).all()
+            db.commit()
+        except sqlalchemy.exc.DBAPIError:
+            db.rollback()
+            raise
+        return [result[0] for result in results]
+
+    def ensure_partitions(self, db: Session):
+        """
+        Creates the monthly partitions of the eventstore for the coming months.
+        This is done at most once a day, before the first event is written.
+        Eventstores created before partitioning was introduced are left as is.
+        """
+        today = date.today()
+        if self._partitions_checked_on == today:
+            return
+
+        is_partitioned = db.execute(
+            "select to_regproc('sourcing.create_eventstore_partitions') is not null"
+        ).scalar()
+        if is_partitioned:
+            self.create_partitions(db, months_ahead=settings.EVENTSTORE_PARTITIONS_AHEAD)
+        self._partitions_checked_on = today
+
+    def get_partitions(self, db: Session):
+        return db.execute("select * from sourcing.eventstore_partitions()").all()
+
+    def create_partitions(self, db: Session, *, months_ahead: int):
+        try:
+            results = db.execute(
+                sqlalchemy.text(
+                    "select * from sourcing.create_eventstore_partitions(:months_ahead)"
+                ),
+                {"months_ahead": months_ahead},
+            ).all()
+            db.commit()
+        except sqlalchemy.exc.DBAPIError:
+            db.rollback()
+            raise
+        return [result[0] for result in results]
+
+    def archive_partitions(
+        self,
+        db: Session,
+        *,
+        before: datetime,
+        archive_schema: str = "sourcing_archive",
+        drop: bool = False,
+    ):
+        """
+        Detaches the partitions holding only events older than `before` from the
+        eventstore. They are moved to `archive_schema`, or dropped if `drop` is
+        true.
+        """
+        try:
+            results = db.execute(
+                sqlalchemy.text(
+                    "select * from sourcing.archive_eventstore_partitions("
+                    ":before, :archive_schema, :drop)"
+                ),
+                {"before": before, "archive_schema": archive_schema, "drop": drop},
+            ).all()
+            db.commit()
+        except sqlalchemy.exc.DBAPIError:
+            db.rollback()
+            raise
+        return [result[0] for result in results]
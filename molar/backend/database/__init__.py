@@ -1,46 +1,71 @@
 # std
-from typing import Dict
+from typing import Optional
 
 # external
-from pydantic import PostgresDsn
 import sqlalchemy
 
-from . import query
+from . import arrow, query
 from ..core.config import settings
-from .database_handler import DatabaseHandler
+from .database_handler import database_uri, DatabaseHandler, replica_uris
+from .registry import DatabaseRegistry
 
-DATABASE_REGISTRY: Dict[str, DatabaseHandler] = {}
+DATABASE_REGISTRY = DatabaseRegistry(
+    max_size=settings.DATABASE_REGISTRY_MAX_SIZE,
+    idle_timeout=settings.DATABASE_IDLE_TIMEOUT,
+    connection_budget=settings.DATABASE_CONNECTION_BUDGET,
+)
 
 
-DATABASE_REGISTRY["main"] = DatabaseHandler(
-    settings.SQLALCHEMY_DATABASE_URI, schemas=["public", "user"]
+DATABASE_REGISTRY.add(
+    "main",
+    DatabaseHandler(
+        settings.SQLALCHEMY_DATABASE_URI
+        if settings.DATABASE_POOLER_URI is None
+        else database_uri(settings.POSTGRES_DB),
+        schemas=["public", "user"],
+        replica_uris=replica_uris(settings.POSTGRES_DB),
+    ),
+    pinned=True,
 )
 
 
 def __getattr__(database_name: str):
-    if database_name in DATABASE_REGISTRY.keys():
-        return DATABASE_REGISTRY[database_name]
+    db_handler = DATABASE_REGISTRY.get(database_name)
+    if db_handler is not None:
+        return db_handler
 
     try:
         db_handler = DatabaseHandler(
-            PostgresDsn.build(
-                scheme="postgresql",
-                user=settings.POSTGRES_USER,
-                password=settings.POSTGRES_PASSWORD,
-                host=settings.POSTGRES_SERVER,
-                path=f"/{database_name}",
-            )
+            database_uri(database_name), replica_uris=replica_uris(database_name)
         )
     except sqlalchemy.exc.OperationalError:
         return None
-    DATABASE_REGISTRY[database_name] = db_handler
-    return db_handler
+    return DATABASE_REGISTRY.add(database_name, db_handler)
+
+
+def acquire_database(database_name: str) -> Optional[DatabaseHandler]:
+    """
+    Returns the handler of a database, opening it if needed, or None if the
+    database doesn't exist. The handler is kept in the registry until it is
+    given back with `DATABASE_REGISTRY.release`.
+    """
+    while True:
+        db_handler = DATABASE_REGISTRY.acquire(database_name)
+        if db_handler is None:
+            # it may be evicted again by another thread before it's acquired
+            if __getattr__(database_name) is None:
+                return None
+            continue
+        if DATABASE_REGISTRY.pinned(database_name) or not db_handler.schema_changed():
+            return db_handler
+        # migrated by another worker, its models and cached queries are
+        # reflected again
+        DATABASE_REGISTRY.release(db_handler)
+        close_database(database_name)
 
 
 def close_database(database_name: str):
-    if database_name not in DATABASE_REGISTRY.keys():
+    db = DATABASE_REGISTRY.remove(database_name)
+    if db is None:
         return
-
-    db = DATABASE_REGISTRY[database_name]
     db.close()
-    del DATABASE_REGISTRY[database_name]
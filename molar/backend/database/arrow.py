@@ -0,0 +1,144 @@
+# std
+import io
+from itertools import islice
+import json
+from typing import Any, Dict, Iterator, List
+
+# external
+from sqlalchemy import types as sqltypes
+from sqlalchemy.dialects import postgresql
+
+try:
+    # external
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+# molar
+from molar.backend.database.utils import RowExtractor
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+
+def negotiate_media_type(accept: str) -> str:
+    """
+    Returns the columnar media type requested in an Accept header, or
+    "application/json" if none of them is.
+    """
+    if accept is not None:
+        for media_type in (ARROW_STREAM_MEDIA_TYPE, PARQUET_MEDIA_TYPE):
+            if media_type in accept:
+                return media_type
+    return "application/json"
+
+
+def arrow_type(column_type):
+    """
+    Returns the arrow type of a column, or None if it has to be inferred from
+    the values. Knowing the types up front keeps the schema of the record
+    batches of a stream identical, even when a batch holds only nulls.
+    """
+    if isinstance(column_type, (postgresql.UUID, sqltypes.JSON, sqltypes.String)):
+        return pyarrow.string()
+    if isinstance(column_type, sqltypes.ARRAY):
+        item_type = arrow_type(column_type.item_type)
+        return pyarrow.list_(item_type) if item_type is not None else None
+    if isinstance(column_type, sqltypes.Float):
+        return pyarrow.float64()
+    if isinstance(column_type, sqltypes.Integer):
+        return pyarrow.int64()
+    if isinstance(column_type, sqltypes.Boolean):
+        return pyarrow.bool_()
+    if isinstance(column_type, sqltypes.DateTime):
+        return pyarrow.timestamp("us")
+    if isinstance(column_type, sqltypes.Date):
+        return pyarrow.date32()
+    return None
+
+
+def arrow_array(values: List[Any], column_type):
+    # uuids and json documents have no arrow counterpart, they are sent as text
+    if isinstance(column_type, postgresql.UUID):
+        values = [str(v) if v is not None else None for v in values]
+    elif isinstance(column_type, sqltypes.JSON):
+        values = [
+            json.dumps(v, default=str) if v is not None else None for v in values
+        ]
+    return pyarrow.array(values, type=arrow_type(column_type))
+
+
+def columns_to_table(extractor: RowExtractor, columns: Dict[str, List[Any]]):
+    return pyarrow.table(
+        {
+            name: arrow_array(values, extractor.column_types[name])
+            for name, values in columns.items()
+        }
+    )
+
+
+def query_output_to_table(db_objs, query_results, types, exclude=None):
+    extractor = RowExtractor(db_objs, types, exclude)
+    return columns_to_table(extractor, extractor.columns(query_results))
+
+
+class ArrowStreamWriter:
+    """
+    Serializes batches of rows as the record batches of an Arrow IPC stream.
+    The schema is the one of the first batch.
+    """
+
+    def __init__(self, db_objs, types, exclude=None):
+        self.extractor = RowExtractor(db_objs, types, exclude)
+        self.sink = io.BytesIO()
+        self.writer = self.schema = None
+
+    def _flush(self) -> bytes:
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def write(self, rows) -> bytes:
+        table = columns_to_table(self.extractor, self.extractor.columns(rows))
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+        return self._flush()
+
+    def close(self) -> bytes:
+        # an empty result is still sent as the schema and an empty batch
+        data = self.write([]) if self.writer is None else b""
+        self.writer.close()
+        return data + self._flush()
+
+
+def iter_arrow_stream(
+    db_objs, query_results, types, batch_size: int, exclude=None
+) -> Iterator[bytes]:
+    """
+    Yields an Arrow IPC stream holding one record batch per `batch_size` rows
+    of `query_results`, so the rows never have to be all in memory.
+    """
+    writer = ArrowStreamWriter(db_objs, types, exclude)
+    rows = iter(query_results)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if len(batch) == 0:
+            break
+        yield writer.write(batch)
+        if len(batch) < batch_size:
+            break
+    yield writer.close()
+
+
+def serialize_table(table, media_type: str) -> bytes:
+    sink = pyarrow.BufferOutputStream()
+    if media_type == PARQUET_MEDIA_TYPE:
+        pyarrow.parquet.write_table(table, sink)
+    else:
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
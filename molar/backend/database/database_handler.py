@@ -1,15 +1,246 @@
 # std
-from typing import Generator, List
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, Generator, List, Optional
 import warnings
 
 # external
+import anyio
 from pydantic import PostgresDsn
-from sqlalchemy import create_engine
+import sqlalchemy
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import NullPool
 
+try:
+    # external
+    import asyncpg
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+except ImportError:  # pragma: no cover
+    asyncpg = None
+
+from ..core.config import settings
 from ..crud import CRUDInterface
 from .models import ModelsFromAutomapBase
+from .query import QueryCache, ResultCache
+from .reflection import dump_metadata, load_metadata
+from .replicas import ReplicaSet
+
+
+def database_uri(database_name: str) -> str:
+    """
+    Returns the uri of a database, on the pooler if DATABASE_POOLER_URI is set.
+    """
+    if settings.DATABASE_POOLER_URI is not None:
+        url = make_url(settings.DATABASE_POOLER_URI).set(database=database_name)
+        return url.render_as_string(hide_password=False)
+    return PostgresDsn.build(
+        scheme="postgresql",
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        host=settings.POSTGRES_SERVER,
+        path=f"/{database_name}",
+    )
+
+
+def replica_uris(database_name: str) -> List[str]:
+    """
+    Returns the uris of the read replicas of a database, on the servers of
+    DATABASE_REPLICA_URIS.
+    """
+    return [
+        make_url(uri).set(database=database_name).render_as_string(hide_password=False)
+        for uri in settings.DATABASE_REPLICA_URIS
+    ]
+
+
+def engine_options(database_name: Optional[str]) -> Dict[str, int]:
+    """
+    Returns the options of the engine of a database: the DATABASE_* settings,
+    overridden by the entry of the database in DATABASE_ENGINE_OPTIONS.
+    """
+    options = {
+        "pool_size": settings.DATABASE_POOL_SIZE,
+        "max_overflow": settings.DATABASE_MAX_OVERFLOW,
+        "pool_recycle": settings.DATABASE_POOL_RECYCLE,
+        "pool_timeout": settings.DATABASE_POOL_TIMEOUT,
+        "pre_ping_interval": settings.DATABASE_PRE_PING_INTERVAL,
+        "null_pool": settings.DATABASE_POOLER_URI is not None,
+    }
+    overrides = settings.DATABASE_ENGINE_OPTIONS.get(database_name, {})
+    unknown = set(overrides) - set(options)
+    if len(unknown) > 0:
+        raise ValueError(
+            f"Unknown engine options for {database_name}: {', '.join(sorted(unknown))}"
+        )
+    options.update(overrides)
+    return options
+
+
+def ping_idle_connections(engine, interval: int):
+    """
+    Pings the connections that were idle in the pool for more than `interval`
+    seconds when they are checked out, so the pool replaces the ones closed in
+    the meantime. Unlike `pool_pre_ping`, the connections in constant use don't
+    pay a round trip on every checkout.
+    """
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        connection_record.info["checked_in"] = time.monotonic()
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checked_in = connection_record.info.get("checked_in")
+        if checked_in is None or time.monotonic() - checked_in < interval:
+            return
+        if not engine.dialect.do_ping(dbapi_connection):
+            raise exc.DisconnectionError()
+
+
+def create_database_engine(
+    sqlalchemy_database_uri: PostgresDsn,
+    options: Dict[str, Any],
+    asynchronous: bool = False,
+):
+    """
+    Creates the engine of a database, or with `asynchronous` an AsyncEngine
+    using asyncpg with the same options.
+    """
+    pre_ping_interval = options["pre_ping_interval"]
+    if options["null_pool"]:
+        # every session opens a new connection, to the pooler if any, there is
+        # no idle connection to ping
+        pre_ping_interval = -1
+        pool_options = {"poolclass": NullPool}
+    else:
+        pool_options = {
+            "pool_size": options["pool_size"],
+            "max_overflow": options["max_overflow"],
+            "pool_recycle": options["pool_recycle"],
+            "pool_timeout": options["pool_timeout"],
+        }
+    create_options = {
+        "pool_pre_ping": pre_ping_interval == 0,
+        **pool_options,
+    }
+
+    if not asynchronous:
+        engine = create_engine(sqlalchemy_database_uri, **create_options)
+    else:
+        url = make_url(str(sqlalchemy_database_uri)).set(
+            drivername="postgresql+asyncpg"
+        )
+        if options["null_pool"]:
+            # a pooler in transaction mode doesn't keep the prepared
+            # statements of a client from one transaction to the next
+            url = url.update_query_dict({"prepared_statement_cache_size": "0"})
+            create_options["connect_args"] = {"statement_cache_size": 0}
+        engine = create_async_engine(url, **create_options)
+    if pre_ping_interval > 0:
+        ping_idle_connections(
+            engine.sync_engine if asynchronous else engine, pre_ping_interval
+        )
+    return engine
+
+
+def dispose_async_engine(async_engine):
+    """
+    Closes the connections of an async engine. They can only be closed on the
+    event loop they were opened on, the handlers being closed from its worker
+    threads or from the loop itself.
+    """
+    try:
+        anyio.from_thread.run(async_engine.dispose)
+    except RuntimeError:
+        try:
+            asyncio.get_running_loop().create_task(async_engine.dispose())
+        except RuntimeError:
+            # out of the loop, e.g. at exit, the connections are dropped along
+            # with the engine
+            pass
+
+
+def alembic_versions(connection) -> Optional[List[str]]:
+    """
+    Returns the alembic versions of a database, or None if it isn't versioned.
+    """
+    table = connection.execute("select to_regclass('public.alembic_version')")
+    if table.scalar() is None:
+        return None
+    return sorted(
+        connection.execute("select version_num from public.alembic_version")
+        .scalars()
+        .all()
+    )
+
+
+def reflection_cache_path(
+    url, schemas: List[str], versions: Optional[List[str]]
+) -> Optional[Path]:
+    """
+    Returns the path of the cached metadata of a database at its alembic
+    `versions`, or None if the cache is disabled or the database isn't
+    versioned.
+    """
+    if settings.REFLECTION_CACHE_DIR is None or versions is None:
+        return None
+    key = json.dumps(
+        [url.host, url.port, url.database, schemas, versions, sqlalchemy.__version__]
+    )
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return Path(settings.REFLECTION_CACHE_DIR) / f"{url.database}-{digest}.json"
+
+
+def reflect_database(engine, schemas: List[str], versions: Optional[List[str]] = None):
+    """
+    Returns the automap base of the tables of `schemas`. The reflected metadata
+    is cached on disk by alembic version: the workers load it instead of
+    reflecting the database, until it's migrated.
+    """
+    cache_path = reflection_cache_path(engine.url, schemas, versions)
+    metadata = None
+    if cache_path is not None and cache_path.exists():
+        try:
+            with open(cache_path) as f:
+                metadata = load_metadata(json.load(f))
+        except Exception:
+            # a truncated file or one written by an incompatible version
+            metadata = None
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if metadata is not None:
+            base = automap_base(metadata=metadata)
+            base.prepare()
+            return base
+
+        base = automap_base()
+        for schema in schemas:
+            base.prepare(engine, reflect=True, schema=schema)
+
+    if cache_path is not None:
+        # written aside then renamed, so no worker reads a partial file
+        partial_path = cache_path.with_suffix(f".{os.getpid()}.partial")
+        try:
+            data = dump_metadata(base.metadata)
+            cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with open(partial_path, "w") as f:
+                json.dump(data, f)
+            os.replace(partial_path, cache_path)
+        except (OSError, ValueError):
+            # a column of a type that can't be cached, the database is
+            # reflected by each worker
+            pass
+    return base
 
 
 class DatabaseHandler:
@@ -17,20 +248,144 @@ class DatabaseHandler:
         self,
         sqlalchemy_database_uri: PostgresDsn,
         schemas: List[str] = ["public", "sourcing", "user"],
+        replica_uris: List[str] = [],
     ):
-        self.base = automap_base()
-        self.engine = create_engine(sqlalchemy_database_uri, pool_pre_ping=True)
+        self.database_name = make_url(str(sqlalchemy_database_uri)).database
+        options = engine_options(self.database_name)
+        self.engine = create_database_engine(sqlalchemy_database_uri, options)
+        # connections the pool may keep, an unlimited overflow isn't counted
+        self.max_connections = 0
+        if not options["null_pool"]:
+            self.max_connections = options["pool_size"] + max(
+                options["max_overflow"], 0
+            )
+        self.active_sessions = 0
+        self.last_used = time.monotonic()
+        self._sessions_lock = threading.Lock()
         self.session_local = sessionmaker(
             autocommit=False, autoflush=False, bind=self.engine
         )
-        self.models = ModelsFromAutomapBase(self.base)
+        # the connections to the replicas are not counted, they don't load the
+        # primary
+        self.replicas = ReplicaSet(
+            [create_database_engine(uri, options) for uri in replica_uris],
+            settings.DATABASE_REPLICA_MAX_LAG,
+            settings.DATABASE_REPLICA_CHECK_INTERVAL,
+        )
 
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            for schema in schemas:
-                self.base.prepare(self.engine, reflect=True, schema=schema)
+        # the async endpoints run the same orm queries on asyncpg connections
+        self.async_engine = self.async_session_local = None
+        if settings.DATABASE_ASYNC:
+            if asyncpg is None:
+                raise RuntimeError("DATABASE_ASYNC requires asyncpg")
+            self.async_engine = create_database_engine(
+                sqlalchemy_database_uri, options, asynchronous=True
+            )
+            if not options["null_pool"]:
+                self.max_connections *= 2
+            self.async_session_local = sessionmaker(
+                autoflush=False,
+                bind=self.async_engine,
+                class_=AsyncSession,
+                expire_on_commit=False,
+            )
+        with self.engine.connect() as connection:
+            self.alembic_versions = alembic_versions(connection)
+        self.schema_checked = time.monotonic()
+        self.base = reflect_database(self.engine, schemas, self.alembic_versions)
+        self.models = ModelsFromAutomapBase(self.base)
 
         self.crud = CRUDInterface(self.models)
+        self.query_cache = QueryCache(settings.QUERY_CACHE_SIZE)
+        # the table versions are only maintained by the eventstore migrations
+        versioned = "sourcing.table_version" in self.base.metadata.tables
+        self.result_cache = ResultCache(
+            settings.QUERY_RESULT_CACHE_SIZE if versioned else 0,
+            settings.QUERY_RESULT_CACHE_TTL,
+        )
+
+    def schema_changed(self) -> bool:
+        """
+        Checks, at most every DATABASE_SCHEMA_CHECK_INTERVAL seconds, whether
+        the database was migrated since it was reflected, e.g. by the alembic
+        endpoints served by another worker.
+        """
+        interval = settings.DATABASE_SCHEMA_CHECK_INTERVAL
+        if interval < 0 or self.alembic_versions is None:
+            return False
+        now = time.monotonic()
+        if now - self.schema_checked < interval:
+            return False
+        self.schema_checked = now
+        try:
+            with self.engine.connect() as connection:
+                return alembic_versions(connection) != self.alembic_versions
+        except exc.DBAPIError:
+            return False
+
+    def _count_session(self, increment: int):
+        with self._sessions_lock:
+            self.active_sessions += increment
+            self.last_used = time.monotonic()
+
+    def open_session(self) -> Session:
+        self._count_session(1)
+        return self.session_local()
+
+    def close_session(self, session: Session):
+        try:
+            session.close()
+        finally:
+            self._count_session(-1)
+
+    def open_read_session(self, lsn: Optional[str] = None) -> Session:
+        """
+        Opens a session for reads on a replica having replayed the primary up
+        to `lsn`, or on the primary if none is available.
+        """
+        replica = self.replicas.pick(lsn)
+        self._count_session(1)
+        if replica is None:
+            return self.session_local()
+        return replica.session_local()
+
+    def open_async_session(self) -> "AsyncSession":
+        self._count_session(1)
+        return self.async_session_local()
+
+    async def close_async_session(self, session: "AsyncSession"):
+        try:
+            await session.close()
+        finally:
+            self._count_session(-1)
+
+    @contextmanager
+    def read_session(self, lsn: Optional[str] = None) -> Generator[Session, None, None]:
+        """
+        Session of a streamed response, opened and closed by its generator
+        since the response is sent after the session of the request is closed.
+        """
+        session = self.open_read_session(lsn)
+        try:
+            yield session
+        finally:
+            self.close_session(session)
+
+    @asynccontextmanager
+    async def async_session(self) -> AsyncGenerator["AsyncSession", None]:
+        session = self.open_async_session()
+        try:
+            yield session
+        finally:
+            # the stream is cancelled when the client disconnects, the session
+            # is closed all the same
+            with anyio.CancelScope(shield=True):
+                await self.close_async_session(session)
 
     def close(self):
+        self.query_cache.clear()
+        self.result_cache.clear()
         self.engine.dispose()
+        self.replicas.dispose()
+        if self.async_engine is not None:
+            dispose_async_engine(self.async_engine)
@@ -1,3 +1,21 @@
+# std
+from datetime import datetime
+import json
+
+# external
+import sqlalchemy
+from sqlalchemy.orm import aliased
+
+RECONSTRUCT_QUERY = (
+    "select record.*"
+    "  from sourcing.reconstruct(cast(:criteria as jsonb), array[:type]) as state,"
+    "       jsonb_populate_record("
+    "           null::public.{table},"
+    "           state.data || jsonb_build_object('{table}_id', state.uuid)"
+    "       ) as record"
+)
+
+
 class ModelsFromAutomapBase:
     def __init__(self, base):
         self.base = base
@@ -6,3 +24,38 @@ class ModelsFromAutomapBase:
         if name in self.base.classes.keys():
             return self.base.classes[name]
         return None
+
+
+class AsOfModels:
+    """
+    Wraps the models so that every table is replaced by its state as of a point
+    in time, reconstructed from the eventstore. Each model is aliased to a
+    subquery on sourcing.reconstruct carrying the same columns and foreign keys,
+    so queries can be built on it exactly as on the live tables.
+    """
+
+    def __init__(self, models, as_of: datetime):
+        self.models = models
+        self.as_of = as_of
+        self._aliases = {}
+
+    def __getattr__(self, name: str):
+        if name in self._aliases:
+            return self._aliases[name]
+
+        model = getattr(self.models, name)
+        if model is None or model.__table__.schema != "public":
+            return model
+
+        query = (
+            sqlalchemy.text(RECONSTRUCT_QUERY.format(table=name))
+            .bindparams(
+                sqlalchemy.bindparam(
+                    "criteria", json.dumps({"before": str(self.as_of)}), unique=True
+                ),
+                sqlalchemy.bindparam("type", name, unique=True),
+            )
+            .columns(*model.__table__.columns)
+        )
+        self._aliases[name] = aliased(model, query.subquery(name), name=name)
+        return self._aliases[name]
@@ -1,14 +1,29 @@
 # std
-from typing import Any, Dict, List, Optional, Union
+import base64
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+import hashlib
+from itertools import islice
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+from uuid import UUID
 
 # external
 import pkg_resources
 import sqlalchemy
-from sqlalchemy.orm import aliased, Session
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import aliased, defer, Session
+from sqlalchemy.sql.elements import BinaryExpression, ColumnElement
+from sqlalchemy.sql.util import find_tables
 
 # molar
 from molar.backend import schemas
-from molar.backend.database.utils import sqlalchemy_to_dict
+from molar.backend.database.models import AsOfModels
+from molar.backend.database.utils import RowExtractor
+from molar.backend.utils import json_default
 
 INFORMATION_QUERY = open(
     pkg_resources.resource_filename("molar", "sql/information_query.sql"), "r"
@@ -48,14 +63,28 @@ def query_builder(
     db: Session,
     models,
     types: schemas.QueryTypes,
-    limit: int,
+    limit: Optional[int],
     offset: int,
     joins: Optional[schemas.QueryJoins] = None,
     filters: Optional[schemas.QueryFilters] = None,
     order_by: Optional[schemas.QueryOrderBys] = None,
     aliases: Optional[schemas.QueryAliases] = None,
+    as_of: Optional[datetime] = None,
+    parameters: Optional[Dict[str, Any]] = None,
+    keyset: bool = False,
+    cursor: Optional[List[Any]] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: bool = False,
 ):
     alias_registry: Dict[str, Any] = {}
+    aggregate_registry: Dict[str, Any] = {}
+
+    # Querying the state reconstructed from the eventstore
+    if as_of is not None:
+        models = AsOfModels(models, as_of)
 
     # Resolving aliases
     if aliases is not None:
@@ -68,16 +97,34 @@ def query_builder(
             )
 
     # Resolving main types
-    if not isinstance(types, list):
-        types = [types]
+    types = list(types) if isinstance(types, list) else [types]
 
     db_objs = []
     for type_ in types:
         db_obj = resolve_type(type_, models, alias_registry)
         db_objs.append(db_obj)
 
+    # Aggregates are selected after the main types, under their alias
+    if aggregates is not None:
+        if not isinstance(aggregates, list):
+            aggregates = [aggregates]
+        for aggregate in aggregates:
+            label = aggregate_expression(aggregate, models, alias_registry)
+            aggregate_registry[label.name] = label
+            db_objs.append(label)
+            types.append(label.name)
+
+    if len(db_objs) == 0:
+        raise ValueError("No types nor aggregates to query!")
     query = db.query(*db_objs)
 
+    # Columns of the queried tables that are not loaded
+    excluded = excluded_columns(db_objs, types, projections, defer_large)
+    for position, keys in excluded.items():
+        query = query.options(
+            *[defer(getattr(db_objs[position], key)) for key in sorted(keys)]
+        )
+
     if joins is not None:
         if not isinstance(joins, list):
             joins = [joins]
@@ -101,42 +148,576 @@ def query_builder(
             )
 
     if filters is not None:
-        filters = expand_filters(filters, models, alias_registry)
+        filters = expand_filters(filters, models, alias_registry, parameters)
         query = query.filter(filters)
 
+    if group_by is not None:
+        if not isinstance(group_by, list):
+            group_by = [group_by]
+        query = query.group_by(
+            *[resolve_type(g, models, alias_registry) for g in group_by]
+        )
+
+    if having is not None:
+        having = expand_filters(
+            having, models, alias_registry, parameters, aggregate_registry
+        )
+        query = query.having(having)
+
+    orderings = []
     if order_by is not None:
         if not isinstance(order_by, list):
             order_by = [order_by]
-        order_bys = []
         for ob in order_by:
-            t = resolve_type(ob.type, models, alias_registry)
-            if ob.order == "asc":
-                order_bys.append(t.asc())
+            if ob.type in aggregate_registry:
+                column = aggregate_registry[ob.type]
             else:
-                order_bys.append(t.desc())
-        query = query.order_by(*order_bys)
+                column = resolve_type(ob.type, models, alias_registry)
+            orderings.append((column, "asc" if ob.order == "asc" else "desc"))
+
+    # Keyset pagination: the rows are ordered by the order_by columns then the
+    # primary key, whose values in the last row are returned as extra columns
+    if keyset:
+        if group_by is not None or len(aggregate_registry) > 0:
+            raise ValueError("Aggregated queries can't be paginated with a cursor!")
+        for column in primary_key(db_objs[0]):
+            if not any(clause(column).compare(clause(c)) for c, _ in orderings):
+                orderings.append((column, "asc"))
+        query = query.add_columns(*[c for c, _ in orderings])
+
+        if cursor is not None:
+            if len(cursor) != len(orderings):
+                raise ValueError("The cursor doesn't match the query!")
+            if parameters is not None:
+                for i, value in enumerate(cursor):
+                    parameters[f"cursor_{i}"] = value
+                cursor = [
+                    sqlalchemy.bindparam(f"cursor_{i}") for i in range(len(cursor))
+                ]
+            query = query.filter(keyset_predicate(orderings, cursor))
+
+    if len(orderings) > 0:
+        query = query.order_by(
+            *[c.asc() if order == "asc" else c.desc() for c, order in orderings]
+        )
 
     query = query.offset(offset).limit(limit)
     return query, db_objs, types
 
 
-def process_query_output(db_objs, query_results, types):
-    if len(db_objs) == 1:
-        return [sqlalchemy_to_dict(db_objs[0], r, types[0]) for r in query_results]
+def is_large_column(column) -> bool:
+    return isinstance(
+        column.type, (sqlalchemy.ARRAY, sqlalchemy.JSON, sqlalchemy.LargeBinary)
+    )
+
+
+def excluded_columns(
+    db_objs,
+    types: List[str],
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: bool = False,
+) -> Dict[int, Set[str]]:
+    """
+    Maps the position of each queried table to the keys of the columns that
+    are not loaded. A projection either includes only some columns, or
+    excludes some of them. With `defer_large`, the array and json columns
+    are left out of the tables without a projection including columns.
+    """
+    if projections is None:
+        projections = []
+    elif not isinstance(projections, list):
+        projections = [projections]
+    by_type = {projection.type: projection for projection in projections}
+
+    excluded: Dict[int, Set[str]] = {}
+    for position, (db_obj, type_) in enumerate(zip(db_objs, types)):
+        projection = by_type.pop(type_, None)
+        if not isinstance(
+            db_obj,
+            (sqlalchemy.orm.util.AliasedClass, sqlalchemy.orm.decl_api.DeclarativeMeta),
+        ):
+            if projection is not None:
+                raise ValueError(f"Projections only apply to tables, not {type_}!")
+            continue
+
+        mapper = sqlalchemy.inspect(db_obj).mapper
+        columns = {
+            attr.key: attr.columns[0]
+            for attr in mapper.column_attrs
+            if len(attr.columns) > 0
+        }
+        primary_keys = {mapper.get_property_by_column(c).key for c in mapper.primary_key}
+
+        keys: Set[str] = set()
+        if projection is not None:
+            for key in (projection.include or []) + (projection.exclude or []):
+                if key not in columns:
+                    raise ValueError(f"Column {key} not found in {type_}!")
+            if projection.include is not None:
+                keys |= set(columns) - set(projection.include)
+            if projection.exclude is not None:
+                keys |= set(projection.exclude)
+        if defer_large and (projection is None or projection.include is None):
+            keys |= {key for key, column in columns.items() if is_large_column(column)}
+
+        keys -= primary_keys
+        if len(keys) > 0:
+            excluded[position] = keys
+
+    if len(by_type) > 0:
+        raise ValueError(f"Projected types not queried: {', '.join(by_type)}!")
+    return excluded
+
+
+def aggregate_expression(aggregate: schemas.QueryAggregate, models, alias_registry):
+    name = aggregate.alias or f"{aggregate.function.value}({aggregate.type})"
+    column = resolve_type(aggregate.type, models, alias_registry)
+
+    if aggregate.function == "count":
+        if not isinstance(
+            column, (sqlalchemy.orm.attributes.QueryableAttribute, ColumnElement)
+        ):
+            return sqlalchemy.func.count().label(name)
+        return sqlalchemy.func.count(column).label(name)
+
+    if not isinstance(
+        column, (sqlalchemy.orm.attributes.QueryableAttribute, ColumnElement)
+    ):
+        raise ValueError(
+            f"{aggregate.function.value} requires a column, not {aggregate.type}!"
+        )
+
+    # json fields are text, they are cast to compute numerical aggregates
+    if isinstance(column, BinaryExpression) and aggregate.function in (
+        "sum",
+        "avg",
+        "percentile",
+    ):
+        column = sqlalchemy.cast(column, sqlalchemy.Float)
+
+    if aggregate.function == "percentile":
+        return (
+            sqlalchemy.func.percentile_cont(aggregate.percentile)
+            .within_group(column)
+            .label(name)
+        )
+    return getattr(sqlalchemy.func, aggregate.function.value)(column).label(name)
+
+
+def clause(column):
+    if hasattr(column, "__clause_element__"):
+        return column.__clause_element__()
+    return column
+
+
+def primary_key(db_obj):
+    if isinstance(db_obj, sqlalchemy.orm.attributes.InstrumentedAttribute):
+        db_obj = db_obj.parent.entity
+    elif not isinstance(
+        db_obj,
+        (sqlalchemy.orm.util.AliasedClass, sqlalchemy.orm.decl_api.DeclarativeMeta),
+    ):
+        raise ValueError(
+            "The first type of a paginated query must be a table or a column!"
+        )
+    mapper = sqlalchemy.inspect(db_obj).mapper
+    return [
+        getattr(db_obj, mapper.get_property_by_column(column).key)
+        for column in mapper.primary_key
+    ]
+
+
+def keyset_predicate(orderings, values):
+    """
+    Selects the rows that come after `values` in the order of `orderings`,
+    i.e. `(c1, c2) > (v1, v2)` when all the columns are sorted the same way.
+    """
+    columns = [column for column, _ in orderings]
+    directions = {order for _, order in orderings}
+    if len(directions) == 1:
+        if directions == {"asc"}:
+            return sqlalchemy.tuple_(*columns) > sqlalchemy.tuple_(*values)
+        return sqlalchemy.tuple_(*columns) < sqlalchemy.tuple_(*values)
+
+    clauses = []
+    for i, (column, order) in enumerate(orderings):
+        after = column > values[i] if order == "asc" else column < values[i]
+        clauses.append(
+            sqlalchemy.and_(*[c == v for c, v in zip(columns[:i], values[:i])], after)
+        )
+    return sqlalchemy.or_(*clauses)
+
+
+# types of the cursor values json doesn't hold, they are decoded back to them so
+# they are bound with their type, which asyncpg requires
+CURSOR_TYPES = {
+    "datetime": (datetime, datetime.fromisoformat),
+    "date": (date, date.fromisoformat),
+    "uuid": (UUID, UUID),
+    "decimal": (Decimal, Decimal),
+}
+
+
+def encode_cursor(values: List[Any]) -> str:
+    typed_values = []
+    for value in values:
+        name = next(
+            (n for n, (t, _) in CURSOR_TYPES.items() if isinstance(value, t)), None
+        )
+        if name is None:
+            typed_values.append([None, value])
+        else:
+            typed_values.append([name, str(value)])
+    return base64.urlsafe_b64encode(
+        json.dumps(typed_values, default=json_default).encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        typed_values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = []
+        for name, value in typed_values:
+            values.append(value if name is None else CURSOR_TYPES[name][1](value))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Invalid cursor!")
+    return values
+
+
+class QueryCache:
+    """
+    LRU cache of the queries built by `query_builder`, keyed by the shape of
+    the query. The filter values are bound parameters of the cached queries, so
+    one entry serves all the requests that only differ by these values.
+    """
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[Any, List[Any], List[str]]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+class ResultCache(QueryCache):
+    """
+    LRU cache of serialized query results. Each entry is stored with its etag,
+    which depends on the versions of the tables the query reads, and is only
+    served under the same etag, for `ttl` seconds at most.
+    """
+
+    def __init__(self, max_size: int = 0, ttl: float = 300):
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key: str, etag: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] != etag or entry[1] < time.monotonic()):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key: str, etag: str, entry):
+        super().set(key, (etag, time.monotonic() + self.ttl, entry))
+
+
+def query_tables(query) -> Optional[List[str]]:
+    """
+    Returns the names of the tables read by a query, aliases and joins
+    included, or None if it reads tables that are not managed through the
+    eventstore: their changes are not versioned.
+    """
+    tables = set()
+    for table in find_tables(
+        query.statement, check_columns=True, include_aliases=True, include_joins=True
+    ):
+        if isinstance(table, sqlalchemy.sql.selectable.Alias):
+            table = table.element
+        if not isinstance(table, sqlalchemy.Table):
+            continue
+        if table.schema != "public":
+            return None
+        tables.add(table.name)
+    return sorted(tables)
+
+
+def table_versions(db: Session, tables: List[str]) -> Dict[str, int]:
+    """
+    Returns the versions of `tables`, bumped by the events touching them.
+    """
+    versions = {table: 0 for table in tables}
+    result = db.execute(
+        sqlalchemy.text(
+            "select table_name, version from sourcing.table_version "
+            "where table_name = any(:tables)"
+        ),
+        {"tables": tables},
+    )
+    versions.update({table_name: version for table_name, version in result})
+    return versions
+
+
+def result_key(query, **options) -> str:
+    """
+    Key of the result of a query: its SQL statement and parameters, which are
+    the same for all the requests asking for the same rows, and the `options`
+    shaping the response.
+    """
+    compiled = query.statement.compile(dialect=postgresql.dialect())
+    return json.dumps(
+        {"statement": str(compiled), "params": compiled.params, **options},
+        default=json_default,
+        sort_keys=True,
+    )
+
+
+def result_etag(key: str, versions: Dict[str, int]) -> str:
+    digest = hashlib.sha1(key.encode())
+    digest.update(json.dumps(versions, sort_keys=True).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def query_shape(
+    models,
+    types: schemas.QueryTypes,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    order_by: Optional[schemas.QueryOrderBys] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    keyset: bool = False,
+    cursor: Optional[List[Any]] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: bool = False,
+):
+    """
+    Returns the key identifying the shape of a query along with its filter
+    values, in the order `expand_filters` binds them.
+    """
+
+    def as_list(value):
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
+
+    alias_registry = {
+        alias.alias: resolve_type(alias.type, models) for alias in as_list(aliases)
+    }
+    values: List[Any] = []
+
+    def filter_shape(filters):
+        if isinstance(filters, schemas.QueryFilterList):
+            return {
+                "op": filters.op,
+                "filters": [filter_shape(f) for f in filters.filters],
+            }
 
-    results = []
-    for result in query_results:
-        result_dict = {}
-        for res, db_obj, t in zip(result, db_objs, types):
-            result_dict.update(sqlalchemy_to_dict(db_obj, res, t, add_table_name=True))
-        results.append(result_dict)
-    return results
+        value = filters.value
+        if value is None:
+            shape = None
+        elif isinstance(value, str) and is_column(value, models, alias_registry):
+            shape = {"column": value}
+        else:
+            shape = {"parameter": isinstance(value, (list, tuple))}
+            values.append(value)
+        return {"type": filters.type, "op": filters.op, "value": shape}
+
+    key = json.dumps(
+        {
+            "types": as_list(types),
+            "aliases": [alias.dict() for alias in as_list(aliases)],
+            "joins": [join.dict() for join in as_list(joins)],
+            "filters": filter_shape(filters) if filters is not None else None,
+            "having": filter_shape(having) if having is not None else None,
+            "aggregates": [a.dict() for a in as_list(aggregates)],
+            "group_by": as_list(group_by),
+            "projections": [p.dict() for p in as_list(projections)],
+            "defer_large": defer_large,
+            "order_by": [ob.dict() for ob in as_list(order_by)],
+            "keyset": keyset,
+            "cursor": len(cursor) if cursor is not None else None,
+        },
+        sort_keys=True,
+    )
+    return key, values
+
+
+def cached_query_builder(
+    db: Session,
+    models,
+    query_cache: QueryCache,
+    types: schemas.QueryTypes,
+    limit: Optional[int],
+    offset: int,
+    joins: Optional[schemas.QueryJoins] = None,
+    filters: Optional[schemas.QueryFilters] = None,
+    order_by: Optional[schemas.QueryOrderBys] = None,
+    aliases: Optional[schemas.QueryAliases] = None,
+    keyset: bool = False,
+    cursor: Optional[List[Any]] = None,
+    aggregates: Optional[schemas.QueryAggregates] = None,
+    group_by: Optional[schemas.QueryGroupBys] = None,
+    having: Optional[schemas.QueryFilters] = None,
+    projections: Optional[schemas.QueryProjections] = None,
+    defer_large: bool = False,
+):
+    key, values = query_shape(
+        models,
+        types,
+        joins,
+        filters,
+        order_by,
+        aliases,
+        keyset,
+        cursor,
+        aggregates,
+        group_by,
+        having,
+        projections,
+        defer_large,
+    )
+
+    entry = query_cache.get(key)
+    if entry is None:
+        query, db_objs, types = query_builder(
+            db,
+            models,
+            types,
+            None,
+            None,
+            joins,
+            filters,
+            order_by,
+            aliases,
+            parameters={},
+            keyset=keyset,
+            cursor=cursor,
+            aggregates=aggregates,
+            group_by=group_by,
+            having=having,
+            projections=projections,
+            defer_large=defer_large,
+        )
+        entry = (query.with_session(None), db_objs, types)
+        query_cache.set(key, entry)
+
+    query, db_objs, types = entry
+    params = {f"filter_{i}": value for i, value in enumerate(values)}
+    params.update({f"cursor_{i}": value for i, value in enumerate(cursor or [])})
+    query = query.with_session(db).params(params).offset(offset).limit(limit)
+    return query, db_objs, types
 
 
-def expand_filters(filters, models, alias_registry):
+def count_query(db: Session, query, estimate: bool = False) -> int:
+    """
+    Counts the rows of a query, or returns the planner's estimate of it from
+    `explain (format json)`, which doesn't run the query.
+    """
+    query = query.order_by(None)
+    if not estimate:
+        return query.count()
+
+    compiled = query.statement.compile(
+        dialect=db.get_bind().dialect, compile_kwargs={"render_postcompile": True}
+    )
+    params = compiled.params
+    if compiled.positional:
+        # asyncpg binds the parameters by position
+        params = tuple(params[name] for name in compiled.positiontup)
+    plan = (
+        db.connection()
+        .exec_driver_sql(f"explain (format json) {compiled}", params)
+        .scalar()
+    )
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def process_query_output(
+    db_objs, query_results, types, columnar: bool = False, exclude=None
+):
+    extractor = RowExtractor(db_objs, types, exclude)
+    if columnar:
+        return extractor.columns(query_results)
+    return extractor.records(query_results)
+
+
+def iter_query_output(db_objs, query_results, types, batch_size: int, exclude=None):
+    """
+    Yields the records of `query_results` by batches of `batch_size`, so the
+    rows never have to be all in memory.
+    """
+    extractor = RowExtractor(db_objs, types, exclude)
+    rows = iter(query_results)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if len(batch) == 0:
+            break
+        yield extractor.records(batch)
+
+
+def is_column(value: str, models, alias_registry) -> bool:
+    try:
+        resolve_type(value, models, alias_registry)
+    except ValueError:
+        return False
+    return True
+
+
+def expand_filters(
+    filters, models, alias_registry, parameters=None, aggregate_registry=None
+):
     if isinstance(filters, schemas.QueryFilterList):
         op = filters.op
-        filters = [expand_filters(f, models, alias_registry) for f in filters.filters]
+        filters = [
+            expand_filters(f, models, alias_registry, parameters, aggregate_registry)
+            for f in filters.filters
+        ]
         if op == "and":
             return sqlalchemy.and_(*filters)
         elif op == "or":
@@ -145,7 +726,10 @@ def expand_filters(filters, models, alias_registry):
             raise ValueError(f"Filter operator not supported: {filters.op}")
 
     elif isinstance(filters, schemas.QueryFilter):
-        type = resolve_type(filters.type, models, alias_registry)
+        if aggregate_registry is not None and filters.type in aggregate_registry:
+            type = aggregate_registry[filters.type]
+        else:
+            type = resolve_type(filters.type, models, alias_registry)
         operator = filters.op
         if filters.op == "==":
             operator = "__eq__"
@@ -159,6 +743,8 @@ def expand_filters(filters, models, alias_registry):
             operator = "__ge__"
         elif filters.op == "<=":
             operator = "__le__"
+        elif filters.op == "in":
+            operator = "in_"
 
         # If value is another column
         value = filters.value
@@ -170,4 +756,12 @@ def expand_filters(filters, models, alias_registry):
             else:
                 value = value_type
 
+        # The values are bound parameters of the queries that are cached
+        if parameters is not None and value is filters.value and value is not None:
+            name = f"filter_{len(parameters)}"
+            parameters[name] = value
+            value = sqlalchemy.bindparam(
+                name, expanding=isinstance(value, (list, tuple))
+            )
+
         return getattr(type, operator)(value)
@@ -0,0 +1,167 @@
+# std
+from typing import Any, Dict, List
+
+# external
+from sqlalchemy import (
+    Column,
+    ForeignKeyConstraint,
+    MetaData,
+    PrimaryKeyConstraint,
+    Table,
+    text,
+    types,
+    UniqueConstraint,
+    util,
+)
+from sqlalchemy.dialects import postgresql
+
+# types the reflected columns are restored to, by name. The reflection cache is
+# plain json: it's never evaluated, a type missing from here isn't cached
+TYPES = {
+    name: type_
+    for module in [types, postgresql]
+    for name, type_ in vars(module).items()
+    if isinstance(type_, type) and issubclass(type_, types.TypeEngine)
+}
+
+
+def dump_type(type_: types.TypeEngine) -> Dict[str, Any]:
+    name = type(type_).__name__
+    if TYPES.get(name) is not type(type_):
+        raise ValueError(f"Column type {name} can't be cached")
+
+    if isinstance(type_, types.Enum):
+        kwargs = {"name": type_.name, "schema": type_.schema}
+        return {"type": name, "enums": list(type_.enums), "kwargs": kwargs}
+
+    kwargs = {}
+    for key in util.get_cls_kwargs(type(type_)):
+        if key.startswith("_") or not hasattr(type_, key):
+            continue
+        value = getattr(type_, key)
+        if isinstance(value, types.TypeEngine):
+            value = dump_type(value)
+        elif not isinstance(value, (bool, int, float, str, type(None))):
+            raise ValueError(f"Column type {name} can't be cached")
+        kwargs[key] = value
+    return {"type": name, "kwargs": kwargs}
+
+
+def load_type(data: Dict[str, Any]) -> types.TypeEngine:
+    kwargs = {
+        key: load_type(value) if isinstance(value, dict) else value
+        for key, value in data["kwargs"].items()
+    }
+    if "enums" in data:
+        return TYPES[data["type"]](*data["enums"], create_type=False, **kwargs)
+    return TYPES[data["type"]](**kwargs)
+
+
+def dump_table(table: Table) -> Dict[str, Any]:
+    columns = [
+        {
+            "name": column.name,
+            "type": dump_type(column.type),
+            "nullable": column.nullable,
+            "default": (
+                None
+                if column.server_default is None
+                else str(column.server_default.arg)
+            ),
+            "autoincrement": column.autoincrement,
+            "comment": column.comment,
+        }
+        for column in table.columns
+    ]
+    foreign_keys = [
+        {
+            "name": constraint.name,
+            "columns": [element.parent.name for element in constraint.elements],
+            "references": [element.target_fullname for element in constraint.elements],
+            "ondelete": constraint.ondelete,
+            "onupdate": constraint.onupdate,
+        }
+        for constraint in sorted(
+            table.foreign_key_constraints, key=lambda constraint: constraint.name or ""
+        )
+    ]
+    unique_constraints = [
+        {"name": constraint.name, "columns": [c.name for c in constraint.columns]}
+        for constraint in table.constraints
+        if isinstance(constraint, UniqueConstraint)
+    ]
+    return {
+        "name": table.name,
+        "schema": table.schema,
+        "comment": table.comment,
+        "columns": columns,
+        "primary_key": {
+            "name": table.primary_key.name,
+            "columns": [column.name for column in table.primary_key.columns],
+        },
+        "foreign_keys": foreign_keys,
+        "unique_constraints": unique_constraints,
+    }
+
+
+def load_table(metadata: MetaData, data: Dict[str, Any]) -> Table:
+    columns = [
+        Column(
+            column["name"],
+            load_type(column["type"]),
+            nullable=column["nullable"],
+            server_default=(
+                None if column["default"] is None else text(column["default"])
+            ),
+            autoincrement=column["autoincrement"],
+            comment=column["comment"],
+        )
+        for column in data["columns"]
+    ]
+    constraints = [
+        PrimaryKeyConstraint(
+            *data["primary_key"]["columns"], name=data["primary_key"]["name"]
+        )
+    ]
+    constraints += [
+        ForeignKeyConstraint(
+            fk["columns"],
+            fk["references"],
+            name=fk["name"],
+            ondelete=fk["ondelete"],
+            onupdate=fk["onupdate"],
+            link_to_name=True,
+        )
+        for fk in data["foreign_keys"]
+    ]
+    constraints += [
+        UniqueConstraint(*unique["columns"], name=unique["name"])
+        for unique in data["unique_constraints"]
+    ]
+    return Table(
+        data["name"],
+        metadata,
+        *columns,
+        *constraints,
+        schema=data["schema"],
+        comment=data["comment"],
+    )
+
+
+def dump_metadata(metadata: MetaData) -> List[Dict[str, Any]]:
+    """
+    Serializes the tables of reflected `metadata` into json: their columns and
+    the constraints the models are mapped from. Raises a ValueError if one of
+    the columns has a type that can't be restored.
+    """
+    return [dump_table(table) for table in metadata.sorted_tables]
+
+
+def load_metadata(data: List[Dict[str, Any]]) -> MetaData:
+    """
+    Restores the metadata serialized by dump_metadata.
+    """
+    metadata = MetaData()
+    for table in data:
+        load_table(metadata, table)
+    return metadata
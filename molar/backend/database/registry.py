@@ -0,0 +1,153 @@
+# std
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .database_handler import DatabaseHandler
+
+
+class DatabaseRegistry:
+    """
+    Registry of the handlers of the databases opened by a worker. Each handler
+    holds its own connection pool, so the registry is bounded: the least
+    recently used handlers are evicted when there are more than `max_size` of
+    them, when their pools would exceed `connection_budget` connections, or
+    when they have been idle for `idle_timeout` seconds. Handlers with sessions
+    in flight are never evicted, nor the pinned ones.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 0,
+        idle_timeout: int = 0,
+        connection_budget: int = 0,
+    ):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connection_budget = connection_budget
+        self.evictions = 0
+        self.idle_evictions = 0
+        self._handlers: "OrderedDict[str, DatabaseHandler]" = OrderedDict()
+        self._pinned: List[str] = []
+        self._lock = threading.Lock()
+
+    def __contains__(self, database_name: str) -> bool:
+        return database_name in self._handlers
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    def pinned(self, database_name: str) -> bool:
+        return database_name in self._pinned
+
+    def keys(self):
+        return list(self._handlers.keys())
+
+    def get(self, database_name: str) -> Optional[DatabaseHandler]:
+        with self._lock:
+            return self._get(database_name)
+
+    def acquire(self, database_name: str) -> Optional[DatabaseHandler]:
+        """
+        Returns the handler of `database_name` with one more session counted
+        on it before the lock is released, so that it can't be evicted by
+        another thread until it is given back with `release`.
+        """
+        with self._lock:
+            handler = self._get(database_name)
+            if handler is not None:
+                handler._count_session(1)
+            return handler
+
+    def release(self, handler: DatabaseHandler):
+        handler._count_session(-1)
+
+    def add(
+        self, database_name: str, handler: DatabaseHandler, pinned: bool = False
+    ) -> DatabaseHandler:
+        """
+        Registers `handler`, evicting other handlers to make room for it. If a
+        handler was registered for the same database in the meantime, that one
+        is returned and `handler` is closed.
+        """
+        with self._lock:
+            if database_name in self._handlers:
+                handler.close()
+                self._handlers.move_to_end(database_name)
+                return self._handlers[database_name]
+
+            self._handlers[database_name] = handler
+            if pinned:
+                self._pinned.append(database_name)
+            self._evict_idle()
+            self._evict_over_limits()
+            return handler
+
+    def remove(self, database_name: str) -> Optional[DatabaseHandler]:
+        with self._lock:
+            if database_name in self._pinned:
+                self._pinned.remove(database_name)
+            return self._handlers.pop(database_name, None)
+
+    def connections(self) -> int:
+        return sum(handler.max_connections for handler in self._handlers.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._handlers),
+                "max_size": self.max_size,
+                "connections": self.connections(),
+                "connection_budget": self.connection_budget,
+                "active_sessions": sum(
+                    handler.active_sessions for handler in self._handlers.values()
+                ),
+                "evictions": self.evictions,
+                "idle_evictions": self.idle_evictions,
+                "databases": list(self._handlers.keys()),
+            }
+
+    def _get(self, database_name: str) -> Optional[DatabaseHandler]:
+        self._evict_idle()
+        handler = self._handlers.get(database_name)
+        if handler is not None:
+            handler.last_used = time.monotonic()
+            self._handlers.move_to_end(database_name)
+        return handler
+
+    def _evictable(self, database_name: str) -> bool:
+        return (
+            database_name not in self._pinned
+            and self._handlers[database_name].active_sessions == 0
+        )
+
+    def _evict(self, database_name: str):
+        self._handlers.pop(database_name).close()
+
+    def _evict_idle(self):
+        if self.idle_timeout <= 0:
+            return
+        deadline = time.monotonic() - self.idle_timeout
+        for database_name, handler in list(self._handlers.items()):
+            if handler.last_used < deadline and self._evictable(database_name):
+                self._evict(database_name)
+                self.idle_evictions += 1
+
+    def _over_limits(self) -> bool:
+        if self.max_size > 0 and len(self._handlers) > self.max_size:
+            return True
+        return (
+            self.connection_budget > 0
+            and self.connections() > self.connection_budget
+        )
+
+    def _evict_over_limits(self):
+        # from the least recently used, the last added handler is kept even if
+        # it alone exceeds the limits
+        for database_name in list(self._handlers.keys())[:-1]:
+            if not self._over_limits():
+                break
+            if self._evictable(database_name):
+                self._evict(database_name)
+                self.evictions += 1
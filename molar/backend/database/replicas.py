@@ -0,0 +1,132 @@
+# std
+import itertools
+import threading
+import time
+from typing import Any, List, Optional
+
+# external
+from sqlalchemy import exc, text
+from sqlalchemy.orm import Session, sessionmaker
+
+# header carrying the position of the primary in its wal after a write, sent
+# back by the clients so they read their own writes
+LSN_HEADER = "X-Molar-LSN"
+
+# position replayed by a replica and how far behind the primary it is, a
+# server that isn't in recovery is its own primary
+REPLICATION_STATUS = text(
+    """
+    select case when pg_is_in_recovery()
+                then pg_last_wal_replay_lsn()
+                else pg_current_wal_lsn() end::text,
+           case when not pg_is_in_recovery()
+                  or pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                then 0
+                else extract(epoch from now() - pg_last_xact_replay_timestamp())
+            end
+    """
+)
+
+
+def parse_lsn(lsn: str) -> int:
+    """
+    Converts a log sequence number, e.g. 16/B374D848, into an integer.
+    """
+    try:
+        high, low = lsn.split("/")
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid log sequence number: {lsn}")
+
+
+def current_lsn(db: Session) -> str:
+    return db.execute(text("select pg_current_wal_lsn()::text")).scalar()
+
+
+def set_lsn_header(response, db: Session, replicas: Optional["ReplicaSet"]):
+    """
+    Sends the position of the primary after a write, so the next reads of the
+    client wait for a replica replaying it, or go to the primary.
+    """
+    if replicas is not None and len(replicas) > 0:
+        response.headers[LSN_HEADER] = current_lsn(db)
+
+
+class Replica:
+    """
+    Read replica of a database. Its replication status is checked at most
+    every `check_interval` seconds, from the requests sent to it.
+    """
+
+    def __init__(self, engine, check_interval: float):
+        self.engine = engine
+        self.session_local = sessionmaker(
+            autocommit=False, autoflush=False, bind=engine
+        )
+        self.check_interval = check_interval
+        self.replay_lsn: Optional[int] = None
+        self.lag: Optional[float] = None
+        self.checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def refresh(self, force: bool = False):
+        # a request doesn't wait for the check run by another one
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if not force and time.monotonic() - self.checked < self.check_interval:
+                return
+            self.checked = time.monotonic()
+            try:
+                with self.engine.connect() as connection:
+                    lsn, lag = connection.execute(REPLICATION_STATUS).one()
+                self.replay_lsn, self.lag = parse_lsn(lsn), float(lag)
+            except exc.DBAPIError:
+                # unreachable, the replica is left out until its next check
+                self.replay_lsn = self.lag = None
+        finally:
+            self._lock.release()
+
+    def available(self, max_lag: float, lsn: Optional[int] = None) -> bool:
+        self.refresh()
+        if self.lag is None or self.lag > max_lag:
+            return False
+        if lsn is None or self.replay_lsn >= lsn:
+            return True
+        # it may have replayed the write of the client since its last check
+        self.refresh(force=True)
+        return self.replay_lsn is not None and self.replay_lsn >= lsn
+
+
+class ReplicaSet:
+    """
+    Read replicas of a database, used in turn. The ones lagging more than
+    `max_lag` seconds behind the primary, or not having replayed the last
+    write of the client yet, are skipped: without any replica left, the read
+    goes to the primary.
+    """
+
+    def __init__(self, engines: List[Any], max_lag: float, check_interval: float):
+        self.replicas = [Replica(engine, check_interval) for engine in engines]
+        self.max_lag = max_lag
+        self.fallbacks = 0
+        self._turns = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.replicas)
+
+    def pick(self, lsn: Optional[str] = None) -> Optional[Replica]:
+        if len(self.replicas) == 0:
+            return None
+        position = parse_lsn(lsn) if lsn is not None else None
+        start = next(self._turns)
+        for i in range(len(self.replicas)):
+            replica = self.replicas[(start + i) % len(self.replicas)]
+            if replica.available(self.max_lag, position):
+                return replica
+        self.fallbacks += 1
+        return None
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
@@ -1,5 +1,5 @@
 # std
-from typing import Any, Container, Dict, Optional, Type
+from typing import Any, Callable, Container, Dict, List, Optional
 from uuid import UUID
 
 # external
@@ -9,76 +9,146 @@ from sqlalchemy.dialects import postgresql
 from sqlalchemy.inspection import inspect
 from sqlalchemy.orm.properties import ColumnProperty
 
-# Derived from from https://github.com/tiangolo/pydantic-sqlalchemy/blob/master/pydantic_sqlalchemy/main.py
-# by Tiangolo. Distributed under MIT license.
 
+class RowExtractor:
+    """
+    Converts the rows returned by a query into records, or into columns.
+    Output names and value converters are resolved once from the queried
+    objects, so the conversion does no inspection per row.
 
-def extract_fields(
-    mapper,
-    result,
-    add_table_name: bool = False,
-    exclude: Container[str] = [],
-    table_name: Optional[str] = None,
-):
-    fields = {}
-    if table_name is None:
-        table_name = mapper.tables[0].name
-    for attr in mapper.attrs:
-        if isinstance(attr, ColumnProperty):
-            if attr.columns:
-                name = attr.key
-                if name in exclude:
-                    continue
-                value = getattr(result, name, None)
-                if value is None:
-                    continue
-                column = attr.columns[0]
-                if isinstance(column.type, postgresql.base.UUID):
-                    value = UUID(value)
-                if add_table_name:
-                    name = f"{table_name}.{name}"
-            fields[name] = value
-    return fields
+    In the records, the columns of an entity that are null are left out,
+    and UUID columns are converted to `uuid.UUID`. The columns always hold
+    every field, null or not. `exclude` maps the position of an entity to the
+    keys of its columns that are not output, usually because they are
+    deferred and would otherwise be loaded one row at a time.
+    """
 
+    def __init__(
+        self,
+        db_objs: List[Any],
+        types: List[str],
+        exclude: Optional[Dict[int, Container[str]]] = None,
+    ):
+        add_table_name = len(db_objs) > 1
+        exclude = exclude or {}
+        self.single_entity = len(db_objs) == 1 and not isinstance(
+            db_objs[0],
+            (
+                orm.attributes.InstrumentedAttribute,
+                sql.elements.BinaryExpression,
+                sql.elements.Label,
+            ),
+        )
+
+        # (position in the row, is an entity, [(key, output name, converter)])
+        self.fields = []
+        self.column_types: Dict[str, Any] = {}
+        for position, (db_obj, type_) in enumerate(zip(db_objs, types)):
+            if isinstance(db_obj, orm.attributes.InstrumentedAttribute):
+                self.fields.append(
+                    (position, False, [self._column_field(db_obj, add_table_name)])
+                )
+            elif isinstance(db_obj, sql.elements.Label):
+                # aggregates are named by their label, even among other types
+                self.fields.append((position, False, [(None, db_obj.name, None)]))
+                self.column_types[db_obj.name] = db_obj.type
+            elif isinstance(db_obj, sql.elements.BinaryExpression):
+                name = (
+                    type_
+                    if not add_table_name
+                    else f"{str(db_obj.compile()).split('.')[1]}.{type_}"
+                )
+                self.fields.append((position, False, [(None, name, None)]))
+                self.column_types[name] = db_obj.type
+            else:
+                self.fields.append(
+                    (
+                        position,
+                        True,
+                        self._entity_fields(
+                            db_obj, add_table_name, exclude.get(position, ())
+                        ),
+                    )
+                )
 
-def sqlalchemy_to_dict(
-    model: Type,
-    result,
-    type_,
-    *,
-    add_table_name: bool = False,
-    exclude: Container[str] = [],
-) -> Dict[str, Any]:
-    if isinstance(model, orm.util.AliasedClass):
-        alias_name = model._aliased_insp.name
-        mapper = inspect(model).mapper
-        return extract_fields(mapper, result, add_table_name, exclude, alias_name)
+        self.names = [name for _, _, fields in self.fields for _, name, _ in fields]
 
-    elif isinstance(model, orm.decl_api.DeclarativeMeta):
-        mapper = inspect(model)
-        return extract_fields(mapper, result, add_table_name, exclude)
+    @staticmethod
+    def _converter(column) -> Optional[Callable[[Any], Any]]:
+        if isinstance(column.type, postgresql.base.UUID):
+            return UUID
+        return None
 
-    elif isinstance(model, orm.attributes.InstrumentedAttribute):
-        name = model.key
-        value = result
+    def _column_field(self, model, add_table_name: bool):
         table_name = (
             model.parent.name
             if model.parent.is_aliased_class
             else model.parent.tables[0].name
         )
-        if isinstance(model.type, postgresql.base.UUID):
-            value = UUID(value)
-        if add_table_name:
-            name = f"{table_name}.{name}"
-        return {name: value}
+        name = f"{table_name}.{model.key}" if add_table_name else model.key
+        self.column_types[name] = model.type
+        return (None, name, self._converter(model))
 
-    elif isinstance(model, sql.elements.BinaryExpression):
-        name = (
-            type_
-            if not add_table_name
-            else f"{str(model.compile()).split('.')[1]}.{type_}"
-        )
-        value = result[0] if isinstance(result, sqlalchemy.engine.row.Row) else result
-        return {name: value}
+    # The columns of the mapper are listed as in
+    # https://github.com/tiangolo/pydantic-sqlalchemy/blob/master/pydantic_sqlalchemy/main.py
+    # by Tiangolo. Distributed under MIT license.
+    def _entity_fields(self, model, add_table_name: bool, exclude: Container[str]):
+        if isinstance(model, orm.util.AliasedClass):
+            table_name = model._aliased_insp.name
+            mapper = inspect(model).mapper
+        elif isinstance(model, orm.decl_api.DeclarativeMeta):
+            mapper = inspect(model)
+            table_name = mapper.tables[0].name
+        else:
+            raise ValueError(f"Could not handle model type {type(model)}")
+
+        fields = []
+        for attr in mapper.attrs:
+            if not isinstance(attr, ColumnProperty) or not attr.columns:
+                continue
+            if attr.key in exclude:
+                continue
+            name = f"{table_name}.{attr.key}" if add_table_name else attr.key
+            self.column_types[name] = attr.columns[0].type
+            fields.append((attr.key, name, self._converter(attr.columns[0])))
+        return fields
+
+    def _values(self, row):
+        # a single entity isn't wrapped in a row, unless extra columns are
+        # queried along with it
+        if self.single_entity and not isinstance(row, sqlalchemy.engine.Row):
+            row = (row,)
+        for position, is_entity, fields in self.fields:
+            item = row[position]
+            for key, name, converter in fields:
+                if is_entity:
+                    value = getattr(item, key, None) if item is not None else None
+                else:
+                    value = item
+                if value is not None and converter is not None:
+                    value = converter(value)
+                yield is_entity, name, value
+
+    def records(self, rows) -> List[Dict[str, Any]]:
+        return [
+            {
+                name: value
+                for is_entity, name, value in self._values(row)
+                if value is not None or not is_entity
+            }
+            for row in rows
+        ]
 
-    raise ValueError(f"Could not handle model type {type(model)}")
+    def columns(self, rows) -> Dict[str, List[Any]]:
+        columns: Dict[str, List[Any]] = {name: [] for name in self.names}
+        # as in the records, the last field of a given name wins
+        last = {name: i for i, name in enumerate(self.names)}
+        appends = [
+            columns[name].append if last[name] == i else None
+            for i, name in enumerate(self.names)
+        ]
+        for row in rows:
+            for append, (_, _, value) in zip(appends, self._values(row)):
+                if append is not None:
+                    append(value)
+        return columns
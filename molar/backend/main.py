@@ -22,6 +22,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Molar-Cursor"],
     )
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
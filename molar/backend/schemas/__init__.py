@@ -1,12 +1,35 @@
-from .database import DatabaseCreate, DatabaseInformation, DatabaseUpdate
-from .eventstore import EventStore, EventStoreCreate, EventStoreDelete, EventStoreUpdate
+from .database import (
+    DatabaseCreate,
+    DatabaseInformation,
+    DatabaseRegistryStats,
+    DatabaseUpdate,
+)
+from .eventstore import (
+    EventStore,
+    EventStoreBulkItem,
+    EventStoreBulkResult,
+    EventStoreCreate,
+    EventStoreDelete,
+    EventStorePartition,
+    EventStoreRollbackPlan,
+    EventStoreSnapshot,
+    EventStoreUpdate,
+    EventTypes,
+)
 from .msg import Msg
 from .query import (
+    QueryAggregate,
+    QueryAggregates,
     QueryAliases,
+    QueryCacheStats,
+    QueryCount,
     QueryFilter,
     QueryFilterList,
     QueryFilters,
+    QueryGroupBys,
     QueryOrderBys,
+    QueryProjection,
+    QueryProjections,
     QueryJoin,
     QueryJoins,
     QueryTypes,
@@ -29,3 +29,14 @@ class DatabaseInformation(BaseModel):
     constraint_name: Optional[str]
     containt_type: Optional[str]
     references: Optional[str]
+
+
+class DatabaseRegistryStats(BaseModel):
+    size: int
+    max_size: int
+    connections: int
+    connection_budget: int
+    active_sessions: int
+    evictions: int
+    idle_evictions: int
+    databases: List[str]
@@ -5,7 +5,7 @@ from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 # external
-from pydantic import BaseModel
+from pydantic import BaseModel, root_validator
 
 
 class EventTypes(str, Enum):
@@ -42,3 +42,48 @@ class EventStoreDelete(EventStoreBase):
 class EventStoreUpdate(EventStoreBase):
     uuid: UUID
     data: Dict[str, Any]
+
+
+class EventStoreBulkItem(EventStoreBase):
+    event: EventTypes = EventTypes.create
+    uuid: Optional[UUID] = None
+    data: Dict[str, Any] = {}
+
+    @root_validator(skip_on_failure=True)
+    def check_event(cls, values):
+        event = values.get("event")
+        if event not in (EventTypes.create, EventTypes.update, EventTypes.delete):
+            raise ValueError(f"Event {event.value} cannot be sent in bulk")
+        if event != EventTypes.create and values.get("uuid") is None:
+            raise ValueError(f"An uuid is required for {event.value} events")
+        return values
+
+
+class EventStoreBulkResult(BaseModel):
+    uuids: List[UUID]
+    count: int
+    elapsed: float
+    events_per_second: float
+
+
+class EventStorePartition(BaseModel):
+    name: str
+    lower_bound: Optional[datetime]
+    upper_bound: Optional[datetime]
+    count: int
+
+
+class EventStoreRollbackPlan(BaseModel):
+    table_name: str
+    deleted: int
+    inserted: int
+    updated: int
+
+
+class EventStoreSnapshot(BaseModel):
+    snapshot_id: int
+    event_id: int
+    max_timestamp: Optional[datetime]
+    row_count: int
+    created_on: datetime
+    user_id: int
@@ -3,7 +3,7 @@ from enum import Enum
 from typing import Any, List, Optional, Union
 
 # external
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 
 
 class JoinType(str, Enum):
@@ -27,6 +27,16 @@ class RelationshipOperators(str, Enum):
     notilike = "notilike"
 
 
+class AggregateFunctions(str, Enum):
+    count = "count"
+    sum = "sum"
+    avg = "avg"
+    min = "min"
+    max = "max"
+    array_agg = "array_agg"
+    percentile = "percentile"
+
+
 class LogicalOperators(str, Enum):
     and_ = "and"
     or_ = "or"
@@ -64,15 +74,52 @@ class QueryFilterList(BaseModel):
     filters: List[Union[QueryFilter, "QueryFilterList"]]
 
 
+class QueryAggregate(BaseModel):
+    function: AggregateFunctions
+    type: str
+    alias: Optional[str] = None
+    percentile: Optional[float] = None
+
+    @validator("percentile", always=True)
+    def check_percentile(cls, v, values):
+        if values.get("function") == AggregateFunctions.percentile and (
+            v is None or not 0 <= v <= 1
+        ):
+            raise ValueError("percentile requires a percentile between 0 and 1")
+        return v
+
+
+class QueryProjection(BaseModel):
+    type: str
+    include: Optional[List[str]] = None
+    exclude: Optional[List[str]] = None
+
+
 class QueryOrderBy(BaseModel):
     type: str
     order: OrderEnum = "asc"
 
 
+class QueryCount(BaseModel):
+    count: int
+    estimate: bool
+
+
+class QueryCacheStats(BaseModel):
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    hit_rate: float
+
+
 QueryFilterList.update_forward_refs()
 
 QueryTypes = Union[str, List[str]]
-QueryAliases = Union[QueryAlias, List[QueryAlias]]
+QueryAliases = Union[List[QueryAlias], QueryAlias]
 QueryJoins = Union[List[QueryJoin], QueryJoin]
 QueryFilters = Union[QueryFilter, QueryFilterList]
-QueryOrderBys = Union[QueryOrderBy, List[QueryOrderBy]]
+QueryOrderBys = Union[List[QueryOrderBy], QueryOrderBy]
+QueryAggregates = Union[List[QueryAggregate], QueryAggregate]
+QueryGroupBys = Union[List[str], str]
+QueryProjections = Union[List[QueryProjection], QueryProjection]
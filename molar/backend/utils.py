@@ -1,8 +1,10 @@
 # std
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import logging
 from pathlib import Path
 from typing import Any, Dict, Optional
+from uuid import UUID
 
 # external
 import emails
@@ -115,3 +117,17 @@ def verify_password_reset_token(token: str) -> Optional[str]:
         return decoded_token["email"]
     except jwt.JWTError:
         return None
+
+
+def json_default(value: Any):
+    """
+    Serializes the values returned by postgres that the json module doesn't
+    handle, the same way fastapi's response encoder does.
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -116,6 +116,10 @@ def config_env_vars(
         print(f"BACKEND_NUM_WORKERS={backend_num_workers}", file=f)
         print(f"ALEMBIC_USER_DIR=/alembic", file=f)
         print(f"SECRET_KEY={secrets.token_urlsafe(32)}", file=f)
+        # see the pgbouncer service of docker-compose.yml
+        print("DATABASE_POOLER_URI=", file=f)
+        print("PGBOUNCER_POOL_SIZE=20", file=f)
+        print("PGBOUNCER_MAX_CONNECTIONS=80", file=f)
     os.chmod(dotenv_file, stat.S_IREAD)
     return locals()
 
@@ -1,7 +1,12 @@
 # std
+from collections import OrderedDict
+import csv
 from datetime import datetime, timedelta
+import io
+from itertools import islice
+import json
 import logging
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterable, List, Optional, Union
 from uuid import UUID
 
 # external
@@ -15,6 +20,13 @@ from requests import models
 from requests.api import head
 from rich.logging import RichHandler
 
+try:
+    # external
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
 # molar
 import molar
 from molar.backend import schemas
@@ -29,6 +41,11 @@ logging.basicConfig(
 
 
 class Client:
+    # number of query responses kept to be revalidated with their etag
+    RESPONSE_CACHE_SIZE = 64
+    LSN_HEADER = "X-Molar-LSN"
+    AFTER_ID_HEADER = "X-Molar-After-Id"
+
     def __init__(self, cfg: ClientConfig):
         self.cfg = cfg
         self.logger = logging.getLogger("molar")
@@ -39,6 +56,7 @@ class Client:
         self.__headers: Dict[str, str] = {}
         self.__token: Optional[str] = None
         self.__me: Optional[Dict[str, str]] = None
+        self.__responses: "OrderedDict[str, requests.Response]" = OrderedDict()
 
     @property
     def token(self):
@@ -77,18 +95,23 @@ class Client:
         data=None,
         headers=None,
         return_pandas_dataframe=False,
+        response_headers: Optional[Dict[str, str]] = None,
+        revalidate: bool = False,
     ):
         if not url.startswith("/"):
             url = "/" + url
 
+        key = self._response_key(method, url, params, json) if revalidate else None
         response = requests.request(
             method,
             f"{self.cfg.base_url}{url}",
             params=params,
             json=json,
             data=data,
-            headers=headers,
+            headers=self._conditional_headers(key, headers),
         )
+        response = self._cache_response(key, response)
+        self._track_lsn(response)
 
         if response.status_code == 500:
             raise MolarBackendError(
@@ -96,6 +119,8 @@ class Client:
             )
 
         out = response.json()
+        if response_headers is not None:
+            response_headers.update(response.headers)
 
         if response.status_code != 200:
             raise MolarBackendError(
@@ -112,6 +137,182 @@ class Client:
 
         return out
 
+    @staticmethod
+    def _response_key(*request) -> str:
+        return json.dumps(request, default=str, sort_keys=True)
+
+    def _conditional_headers(self, key: Optional[str], headers):
+        """
+        Adds the etag of the cached response of a request to its headers, so
+        the server answers 304 Not Modified if the result hasn't changed.
+        """
+        if key is None or key not in self.__responses:
+            return headers
+        etag = self.__responses[key].headers["ETag"]
+        return {**(headers or {}), "If-None-Match": etag}
+
+    def _cache_response(self, key: Optional[str], response: requests.Response):
+        """
+        Returns the cached response of a request answered by 304 Not Modified,
+        and caches the responses carrying an etag.
+        """
+        if key is None:
+            return response
+        if response.status_code == 304 and key in self.__responses:
+            self.__responses.move_to_end(key)
+            return self.__responses[key]
+        if response.status_code == 200 and "ETag" in response.headers:
+            self.__responses[key] = response
+            self.__responses.move_to_end(key)
+            while len(self.__responses) > self.RESPONSE_CACHE_SIZE:
+                self.__responses.popitem(last=False)
+        return response
+
+    def _track_lsn(self, response: requests.Response):
+        """
+        Sends the position of the primary after the last write of the client
+        with the next requests, so they are not read from a replica that
+        hasn't replayed it yet.
+        """
+        lsn = response.headers.get(self.LSN_HEADER)
+        if lsn is not None:
+            self.__headers[self.LSN_HEADER] = lsn
+
+    def stream_request(
+        self,
+        url: str,
+        method: str,
+        params=None,
+        json=None,
+        headers=None,
+    ):
+        """
+        Sends a request and yields the lines of the response as they are
+        received, for the endpoints returning newline delimited json.
+        """
+        if not url.startswith("/"):
+            url = "/" + url
+
+        with requests.request(
+            method,
+            f"{self.cfg.base_url}{url}",
+            params=params,
+            json=json,
+            headers=headers,
+            stream=True,
+        ) as response:
+            if response.status_code == 500:
+                raise MolarBackendError(
+                    status_code=500, message=f"Server Error: {response.text}"
+                )
+
+            if response.status_code != 200:
+                raise MolarBackendError(
+                    status_code=response.status_code,
+                    message=response.json()["detail"],
+                )
+
+            for line in response.iter_lines():
+                if line:
+                    yield line
+
+    def table_request(
+        self,
+        url: str,
+        method: str,
+        response_format: str,
+        params=None,
+        json=None,
+        headers=None,
+        revalidate: bool = False,
+    ):
+        """
+        Sends a request asking for an Arrow IPC stream or a Parquet file and
+        returns the result as a DataFrame built from the Arrow table.
+        """
+        if pyarrow is None:
+            raise ImportError(f"pyarrow is required for {response_format} responses")
+        if not url.startswith("/"):
+            url = "/" + url
+
+        media_type = {
+            "arrow": "application/vnd.apache.arrow.stream",
+            "parquet": "application/vnd.apache.parquet",
+        }[response_format]
+        headers = {**(headers or {}), "Accept": media_type}
+        key = (
+            self._response_key(method, url, params, json, media_type)
+            if revalidate
+            else None
+        )
+        response = requests.request(
+            method,
+            f"{self.cfg.base_url}{url}",
+            params=params,
+            json=json,
+            headers=self._conditional_headers(key, headers),
+        )
+        response = self._cache_response(key, response)
+
+        if response.status_code == 500:
+            raise MolarBackendError(
+                status_code=500, message=f"Server Error: {response.text}"
+            )
+
+        if response.status_code != 200:
+            raise MolarBackendError(
+                status_code=response.status_code, message=response.json()["detail"]
+            )
+
+        buffer = pyarrow.py_buffer(response.content)
+        if response_format == "parquet":
+            table = pyarrow.parquet.read_table(pyarrow.BufferReader(buffer))
+        else:
+            table = pyarrow.ipc.open_stream(buffer).read_all()
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+
+    def stream_table_request(
+        self,
+        url: str,
+        method: str,
+        params=None,
+        json=None,
+        headers=None,
+    ):
+        """
+        Sends a request asking for an Arrow IPC stream and yields a DataFrame
+        for each record batch as they are received.
+        """
+        if pyarrow is None:
+            raise ImportError("pyarrow is required for arrow responses")
+        if not url.startswith("/"):
+            url = "/" + url
+
+        with requests.request(
+            method,
+            f"{self.cfg.base_url}{url}",
+            params=params,
+            json=json,
+            headers={
+                **(headers or {}),
+                "Accept": "application/vnd.apache.arrow.stream",
+            },
+            stream=True,
+        ) as response:
+            if response.status_code == 500:
+                raise MolarBackendError(
+                    status_code=500, message=f"Server Error: {response.text}"
+                )
+
+            if response.status_code != 200:
+                raise MolarBackendError(
+                    status_code=response.status_code,
+                    message=response.json()["detail"],
+                )
+
+            for batch in pyarrow.ipc.open_stream(response.raw):
+                yield batch.to_pandas()
+
     """
     USER RELATED ACTIONS
     """
@@ -191,6 +392,14 @@ class Client:
             return_pandas_dataframe=return_pandas_dataframe,
         )
 
+    def get_database_registry_stats(self):
+        return self.request(
+            "/database/registry",
+            method="GET",
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
     def approve_database(self, database_name: str):
         return self.request(
             f"/database/approve/{database_name}",
@@ -217,11 +426,103 @@ class Client:
     def view_entries(
         self,
         database_name: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        type: Optional[str] = None,
+        event: Optional[str] = None,
+        user_id: Optional[int] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
     ):
+        """
+        Lists the events ordered by id. Without a `limit`, the pages of the
+        eventstore are requested until the listing is exhausted.
+        """
         database_name = database_name or self.cfg.database_name
-        return self.request(
+        params = self._eventstore_filters(
+            after_id=after_id,
+            limit=limit,
+            type=type,
+            event=event,
+            user_id=user_id,
+            after=after,
+            before=before,
+        )
+        pages = []
+        while True:
+            headers = requests.structures.CaseInsensitiveDict()
+            page = self.request(
+                f"/eventstore/{database_name}",
+                method="GET",
+                params=params,
+                return_pandas_dataframe=True,
+                headers=self.headers,
+                response_headers=headers,
+            )
+            # a full last page is followed by an empty one
+            if len(page) > 0 or len(pages) == 0:
+                pages.append(page)
+            if limit is not None or self.AFTER_ID_HEADER not in headers:
+                break
+            params["after_id"] = headers[self.AFTER_ID_HEADER]
+        if len(pages) == 1:
+            return pages[0]
+        return pd.concat(pages, ignore_index=True)
+
+    def iter_entries(
+        self,
+        chunk_size: int = 10000,
+        database_name: Optional[str] = None,
+        after_id: Optional[int] = None,
+        type: Optional[str] = None,
+        event: Optional[str] = None,
+        user_id: Optional[int] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+    ):
+        """
+        Streams the eventstore and yields DataFrames of at most `chunk_size`
+        events, ordered by id, so the eventstore never has to fit in memory.
+        """
+        database_name = database_name or self.cfg.database_name
+        params = self._eventstore_filters(
+            after_id=after_id,
+            type=type,
+            event=event,
+            user_id=user_id,
+            after=after,
+            before=before,
+        )
+        params["stream"] = True
+        lines = self.stream_request(
             f"/eventstore/{database_name}",
             method="GET",
+            params=params,
+            headers=self.headers,
+        )
+        while True:
+            records = [json.loads(line) for line in islice(lines, chunk_size)]
+            if len(records) == 0:
+                break
+            yield pd.DataFrame.from_records(records).replace({np.nan: None})
+
+    @staticmethod
+    def _eventstore_filters(**filters):
+        return {
+            k: v.isoformat() if isinstance(v, datetime) else v
+            for k, v in filters.items()
+            if v is not None
+        }
+
+    def view_entry_history(
+        self,
+        uuid: UUID,
+        database_name: Optional[str] = None,
+    ):
+        database_name = database_name or self.cfg.database_name
+        return self.request(
+            f"/eventstore/{database_name}/history/{uuid}",
+            method="GET",
             return_pandas_dataframe=True,
             headers=self.headers,
         )
@@ -244,6 +545,98 @@ class Client:
             return_pandas_dataframe=False,
         )
 
+    def create_entries(
+        self,
+        type: str,
+        data: Iterable[Dict[str, Any]],
+        batch_size: int = 1000,
+    ):
+        """
+        Creates many entries of the same type. The entries are sent in batches of
+        `batch_size` events, each batch being inserted in a single transaction.
+        Returns the uuids of the created entries, in order.
+        """
+        data = iter(data)
+        uuids = []
+        n_batch = 0
+        while True:
+            batch = [
+                {"type": type, "event": "create", "data": datum}
+                for datum in islice(data, batch_size)
+            ]
+            if len(batch) == 0:
+                break
+            out = self.request(
+                f"/eventstore/{self.cfg.database_name}/bulk",
+                method="POST",
+                json=batch,
+                headers=self.headers,
+                return_pandas_dataframe=False,
+            )
+            n_batch += 1
+            self.logger.info(
+                f"Batch {n_batch}: {out['count']} events inserted in "
+                f"{out['elapsed']:.2f}s ({out['events_per_second']:.0f} events/s)"
+            )
+            uuids.extend(out["uuids"])
+        return uuids
+
+    def upload_entries(
+        self,
+        type: str,
+        data: Union[pd.DataFrame, Iterable[Dict[str, Any]]],
+        chunk_size: int = 10000,
+        return_uuids: bool = True,
+    ):
+        """
+        Creates many entries of the same type through the COPY ingestion path.
+        `data` can be a pandas DataFrame or any iterable (e.g. a generator) of
+        dictionaries; it is encoded and streamed to the server `chunk_size`
+        entries at a time, so the whole payload is never held in memory.
+        """
+        out = self.request(
+            f"/eventstore/{self.cfg.database_name}/copy",
+            method="POST",
+            params={"return_uuids": return_uuids},
+            data=self._csv_stream(type, data, chunk_size),
+            headers={**self.headers, "Content-Type": "text/csv"},
+            return_pandas_dataframe=False,
+        )
+        self.logger.info(
+            f"{out['count']} events inserted in {out['elapsed']:.2f}s "
+            f"({out['events_per_second']:.0f} events/s)"
+        )
+        return out["uuids"] if return_uuids else out["count"]
+
+    @staticmethod
+    def _csv_stream(
+        type: str,
+        data: Union[pd.DataFrame, Iterable[Dict[str, Any]]],
+        chunk_size: int,
+    ):
+        def _records():
+            if isinstance(data, pd.DataFrame):
+                for start in range(0, len(data), chunk_size):
+                    chunk = data.iloc[start : start + chunk_size]
+                    yield from chunk.replace({np.nan: None}).to_dict("records")
+            else:
+                yield from data
+
+        def _default(value):
+            if isinstance(value, (np.generic, np.ndarray)):
+                return value.tolist()
+            return str(value)
+
+        records = _records()
+        while True:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for record in islice(records, chunk_size):
+                writer.writerow([type, json.dumps(record, default=_default)])
+            if buffer.tell() == 0:
+                break
+            yield buffer.getvalue().encode("utf-8")
+
     def update_entry(
         self,
         uuid: UUID,
@@ -280,7 +673,20 @@ class Client:
             return_pandas_dataframe=False,
         )
 
-    def rollback(self, before: datetime):
+    def rollback(self, before: datetime, dry_run: bool = False):
+        """
+        Rolls the database back to its state before `before`. With `dry_run`,
+        nothing is changed and the number of rows the rollback would delete,
+        insert and update in each table is returned instead.
+        """
+        if dry_run:
+            return self.request(
+                f"/eventstore/rollback/{self.cfg.database_name}",
+                method="GET",
+                params={"before": str(before)},
+                headers=self.headers,
+                return_pandas_dataframe=True,
+            )
         return self.request(
             f"/eventstore/rollback/{self.cfg.database_name}",
             method="PATCH",
@@ -289,6 +695,81 @@ class Client:
             return_pandas_dataframe=False,
         )
 
+    def get_snapshots(self, return_pandas_dataframe=True):
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/snapshots",
+            method="GET",
+            headers=self.headers,
+            return_pandas_dataframe=return_pandas_dataframe,
+        )
+
+    def create_snapshot(self):
+        """
+        Snapshots the current state of the database. Rollbacks to a point in
+        time after the snapshot only replay the events that followed it.
+        """
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/snapshots",
+            method="POST",
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
+    def prune_snapshots(
+        self, before: Optional[datetime] = None, keep: Optional[int] = None
+    ):
+        params = {}
+        if before is not None:
+            params["before"] = str(before)
+        if keep is not None:
+            params["keep"] = keep
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/snapshots",
+            method="DELETE",
+            params=params,
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
+    def get_eventstore_partitions(self, return_pandas_dataframe=True):
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/partitions",
+            method="GET",
+            headers=self.headers,
+            return_pandas_dataframe=return_pandas_dataframe,
+        )
+
+    def create_eventstore_partitions(self, months_ahead: int = 3):
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/partitions",
+            method="POST",
+            params={"months_ahead": months_ahead},
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
+    def archive_eventstore_partitions(
+        self,
+        before: datetime,
+        archive_schema: str = "sourcing_archive",
+        drop: bool = False,
+    ):
+        """
+        Detaches the partitions of the eventstore holding only events older than
+        `before`, moving them to `archive_schema` or dropping them.
+        """
+        return self.request(
+            f"/eventstore/{self.cfg.database_name}/partitions/archive",
+            method="PATCH",
+            params={
+                "before": str(before),
+                "archive_schema": archive_schema,
+                "drop": drop,
+            },
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
     """
     QUERYING RELATED ACTIONS
     """
@@ -302,16 +783,62 @@ class Client:
         filters: Optional[schemas.QueryFilters] = None,
         order_by: Optional[schemas.QueryOrderBys] = None,
         aliases: Optional[schemas.QueryAliases] = None,
-        return_pandas_dataframe: bool = True
+        return_pandas_dataframe: bool = True,
+        as_of: Optional[datetime] = None,
+        columnar: bool = False,
+        response_format: str = "json",
+        aggregates: Optional[schemas.QueryAggregates] = None,
+        group_by: Optional[schemas.QueryGroupBys] = None,
+        having: Optional[schemas.QueryFilters] = None,
+        projections: Optional[schemas.QueryProjections] = None,
+        defer_large: Optional[bool] = None,
     ):
-        params = {"limit": limit, "offset": offset}
+        """
+        Queries the database. With `as_of`, the query runs on the state of the
+        database before that point in time, reconstructed from the eventstore,
+        without modifying it. With `columnar`, the results are returned as a
+        dictionary of columns instead of a list of records.
+
+        `response_format` can be "arrow" or "parquet" to transfer the results
+        in a binary columnar format, which requires pyarrow. The DataFrame is
+        then built from the Arrow table: uuids and json fields are strings.
+
+        `projections` select the columns loaded for each type, and
+        `defer_large` leaves out their array and json columns, unless a
+        projection includes them. By default, the server's setting applies.
+
+        When the server caches query results, the responses are revalidated
+        with their etag: an unchanged result is not sent again.
+        """
+        params = {
+            "limit": limit,
+            "offset": offset,
+            "columnar": columnar,
+            "defer_large": defer_large,
+        }
+        if as_of is not None:
+            params["as_of"] = str(as_of)
         json = {
             "types": types,
             "joins": joins,
             "aliases": aliases,
             "filters": filters,
             "order_by": order_by,
+            "aggregates": aggregates,
+            "group_by": group_by,
+            "having": having,
+            "projections": projections,
         }
+        if response_format != "json":
+            return self.table_request(
+                f"/query/{self.cfg.database_name}",
+                method="GET",
+                response_format=response_format,
+                params=params,
+                headers=self.headers,
+                json=json,
+                revalidate=True,
+            )
         return self.request(
             f"/query/{self.cfg.database_name}",
             method="GET",
@@ -319,7 +846,161 @@ class Client:
             headers=self.headers,
             json=json,
             return_pandas_dataframe=return_pandas_dataframe,
+            revalidate=True,
+        )
+
+    def count(
+        self,
+        types: schemas.QueryTypes,
+        joins: Optional[schemas.QueryJoins] = None,
+        filters: Optional[schemas.QueryFilters] = None,
+        aliases: Optional[schemas.QueryAliases] = None,
+        group_by: Optional[schemas.QueryGroupBys] = None,
+        having: Optional[schemas.QueryFilters] = None,
+        estimate: bool = False,
+        as_of: Optional[datetime] = None,
+    ) -> int:
+        """
+        Counts the rows a query would return. With `estimate`, the count is the
+        planner's estimate, which is immediate but approximate.
+        """
+        params = {"estimate": estimate}
+        if as_of is not None:
+            params["as_of"] = str(as_of)
+        json = {
+            "types": types,
+            "joins": joins,
+            "aliases": aliases,
+            "filters": filters,
+            "group_by": group_by,
+            "having": having,
+        }
+        out = self.request(
+            f"/query/{self.cfg.database_name}/count",
+            method="GET",
+            params=params,
+            headers=self.headers,
+            json=json,
+            return_pandas_dataframe=False,
         )
+        return out["count"]
+
+    def iter_query(
+        self,
+        types: schemas.QueryTypes,
+        limit: Optional[int] = None,
+        offset: Optional[int] = None,
+        joins: Optional[schemas.QueryJoins] = None,
+        filters: Optional[schemas.QueryFilters] = None,
+        order_by: Optional[schemas.QueryOrderBys] = None,
+        aliases: Optional[schemas.QueryAliases] = None,
+        aggregates: Optional[schemas.QueryAggregates] = None,
+        group_by: Optional[schemas.QueryGroupBys] = None,
+        having: Optional[schemas.QueryFilters] = None,
+        projections: Optional[schemas.QueryProjections] = None,
+        defer_large: Optional[bool] = None,
+        as_of: Optional[datetime] = None,
+        chunk_size: int = 10000,
+        response_format: str = "json",
+    ):
+        """
+        Streams the results of a query, read on the server from a server-side
+        cursor, and yields DataFrames so they never have to fit in memory.
+        With the "json" format, the DataFrames hold `chunk_size` rows at most.
+        With the "arrow" format, there is one DataFrame per record batch sent
+        by the server.
+        """
+        params = {
+            "limit": limit,
+            "offset": offset,
+            "stream": True,
+            "defer_large": defer_large,
+        }
+        if as_of is not None:
+            params["as_of"] = str(as_of)
+        json_ = {
+            "types": types,
+            "joins": joins,
+            "aliases": aliases,
+            "filters": filters,
+            "order_by": order_by,
+            "aggregates": aggregates,
+            "group_by": group_by,
+            "having": having,
+            "projections": projections,
+        }
+        if response_format == "arrow":
+            yield from self.stream_table_request(
+                f"/query/{self.cfg.database_name}",
+                method="GET",
+                params=params,
+                json=json_,
+                headers=self.headers,
+            )
+            return
+
+        lines = self.stream_request(
+            f"/query/{self.cfg.database_name}",
+            method="GET",
+            params=params,
+            json=json_,
+            headers=self.headers,
+        )
+        while True:
+            records = [json.loads(line) for line in islice(lines, chunk_size)]
+            if len(records) == 0:
+                break
+            yield pd.DataFrame.from_records(records).replace({np.nan: None})
+
+    def iter_pages(
+        self,
+        types: schemas.QueryTypes,
+        page_size: int = 1000,
+        joins: Optional[schemas.QueryJoins] = None,
+        filters: Optional[schemas.QueryFilters] = None,
+        order_by: Optional[schemas.QueryOrderBys] = None,
+        aliases: Optional[schemas.QueryAliases] = None,
+        projections: Optional[schemas.QueryProjections] = None,
+        defer_large: bool = True,
+        as_of: Optional[datetime] = None,
+    ):
+        """
+        Pages through the results of a query and yields a DataFrame per page.
+        The pages are fetched with keyset pagination: each one starts after
+        the last row of the previous one, ordered by `order_by` then the
+        primary key of the first type, so every page costs the same. The
+        `order_by` columns shouldn't hold nulls. The array and json columns
+        are not fetched unless `defer_large` is False or a projection
+        includes them.
+        """
+        params = {"limit": page_size, "keyset": True, "defer_large": defer_large}
+        if as_of is not None:
+            params["as_of"] = str(as_of)
+        json = {
+            "types": types,
+            "joins": joins,
+            "aliases": aliases,
+            "filters": filters,
+            "order_by": order_by,
+            "projections": projections,
+        }
+        while True:
+            headers = requests.structures.CaseInsensitiveDict()
+            page = self.request(
+                f"/query/{self.cfg.database_name}",
+                method="GET",
+                params=params,
+                headers=self.headers,
+                json=json,
+                return_pandas_dataframe=True,
+                response_headers=headers,
+                revalidate=True,
+            )
+            if len(page) > 0:
+                yield page
+            if "X-Molar-Cursor" not in headers:
+                break
+            params["cursor"] = headers["X-Molar-Cursor"]
 
     def debug_query(
         self,
@@ -331,7 +1012,16 @@ class Client:
         order_by: Optional[schemas.QueryOrderBys] = None,
         aliases: Optional[schemas.QueryAliases] = None,
         explain_analyze: bool = False,
+        as_of: Optional[datetime] = None,
+        aggregates: Optional[schemas.QueryAggregates] = None,
+        group_by: Optional[schemas.QueryGroupBys] = None,
+        having: Optional[schemas.QueryFilters] = None,
+        projections: Optional[schemas.QueryProjections] = None,
+        defer_large: Optional[bool] = None,
     ):
+        params = {"explain_analyze": explain_analyze, "defer_large": defer_large}
+        if as_of is not None:
+            params["as_of"] = str(as_of)
         json = {
             "types": types,
             "limit": limit,
@@ -340,16 +1030,28 @@ class Client:
             "aliases": aliases,
             "filters": filters,
             "order_by": order_by,
+            "aggregates": aggregates,
+            "group_by": group_by,
+            "having": having,
+            "projections": projections,
         }
         return self.request(
             f"/query/debug/{self.cfg.database_name}",
             method="GET",
             headers=self.headers,
-            params={"explain_analyze": explain_analyze},
+            params=params,
             json=json,
             return_pandas_dataframe=False,
         )
 
+    def get_query_cache_stats(self):
+        return self.request(
+            f"/query/cache/{self.cfg.database_name}",
+            method="GET",
+            headers=self.headers,
+            return_pandas_dataframe=False,
+        )
+
     """
     ALEMBIC RELATED ACTIONS
     """
@@ -19,6 +19,7 @@ def install_molar_database(
     superuser_email,
     superuser_hashed_password,
     revisions,
+    generated_apply=False,
 ):
     create_database(
         alembic_config,
@@ -27,6 +28,7 @@ def install_molar_database(
         postgres_password,
         new_database_name,
         revisions,
+        generated_apply,
     )
     add_user(
         superuser_fullname,
@@ -75,6 +77,7 @@ def create_database(
     postgres_password,
     new_database_name,
     revisions,
+    generated_apply=False,
 ):
     connection = sql_utils.create_connection(
         postgres_username, postgres_password, hostname, "postgres"
@@ -98,9 +101,21 @@ def create_database(
         ),
     )
     command.upgrade(alembic_config, revisions)
+
+    if generated_apply:
+        enable_generated_apply(connection)
     connection.close()
 
 
+def enable_generated_apply(connection):
+    with connection.begin():
+        has_generated_apply = connection.execute(
+            "select to_regproc('sourcing.enable_generated_apply') is not null"
+        ).scalar()
+        if has_generated_apply:
+            connection.execute("select sourcing.enable_generated_apply()")
+
+
 def drop_database(hostname, postgres_username, postgres_password, database):
     connection = sql_utils.create_connection(
         postgres_username, postgres_password, hostname, "postgres"
@@ -0,0 +1,36 @@
+"""eventstore-snapshots
+
+Revision ID: 2f8c5a1d7e64
+Revises: 9d3a6f0b8e52
+Create Date: 2026-10-18 13:52:10.267481
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "2f8c5a1d7e64"
+down_revision = "9d3a6f0b8e52"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_snapshots.sql"))
+
+
+def downgrade():
+    op.execute(
+        sql_utils.read_sql_function(
+            "event_sourcing_rollback.sql", "sourcing.rollback_tables"
+        )
+    )
+    op.execute("drop function if exists sourcing.reconstruct")
+    op.execute("drop function if exists sourcing.prune_snapshots")
+    op.execute("drop function if exists sourcing.create_snapshot")
+    op.execute("drop table if exists sourcing.snapshot_row")
+    op.execute("drop table if exists sourcing.snapshot")
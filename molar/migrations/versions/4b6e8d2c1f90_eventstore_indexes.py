@@ -0,0 +1,43 @@
+"""eventstore-indexes
+
+Revision ID: 4b6e8d2c1f90
+Revises: e7b14d3f6a28
+Create Date: 2026-10-18 12:58:41.503297
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4b6e8d2c1f90"
+down_revision = "e7b14d3f6a28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # history of an entity and the rollback's group by uuid
+    op.create_index(
+        "eventstore_uuid_id", "eventstore", ["uuid", "id"], schema="sourcing"
+    )
+    op.create_index(
+        "eventstore_type_timestamp",
+        "eventstore",
+        ["type", "timestamp"],
+        schema="sourcing",
+    )
+    # events are appended in time order, a brin index stays tiny
+    op.create_index(
+        "eventstore_timestamp_brin",
+        "eventstore",
+        ["timestamp"],
+        schema="sourcing",
+        postgresql_using="brin",
+    )
+
+
+def downgrade():
+    op.drop_index("eventstore_timestamp_brin", "eventstore", schema="sourcing")
+    op.drop_index("eventstore_type_timestamp", "eventstore", schema="sourcing")
+    op.drop_index("eventstore_uuid_id", "eventstore", schema="sourcing")
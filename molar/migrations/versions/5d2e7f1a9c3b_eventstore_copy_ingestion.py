@@ -0,0 +1,37 @@
+"""eventstore-copy-ingestion
+
+Revision ID: 5d2e7f1a9c3b
+Revises: f31c7d486f1f
+Create Date: 2026-10-18 09:12:41.518302
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "5d2e7f1a9c3b"
+down_revision = "f31c7d486f1f"
+branch_labels = ("eventstore",)
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_copy.sql"))
+
+
+def downgrade():
+    op.execute("drop function if exists sourcing.apply_staged_events")
+    op.execute("drop trigger if exists on_event_insert on sourcing.eventstore")
+    op.execute(
+        (
+            "create trigger on_event_insert"
+            "    before insert"
+            "    on sourcing.eventstore"
+            "    for each row"
+            "        execute procedure sourcing.on_event();"
+        )
+    )
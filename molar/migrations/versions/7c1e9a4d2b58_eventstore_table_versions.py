@@ -0,0 +1,31 @@
+"""eventstore-table-versions
+
+Revision ID: 7c1e9a4d2b58
+Revises: 2f8c5a1d7e64
+Create Date: 2026-10-18 15:21:37.804113
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "7c1e9a4d2b58"
+down_revision = "2f8c5a1d7e64"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_table_versions.sql"))
+
+
+def downgrade():
+    op.execute(
+        "drop trigger if exists on_events_bump_table_version on sourcing.eventstore"
+    )
+    op.execute("drop function if exists sourcing.on_events_bump_table_version")
+    op.execute("drop table if exists sourcing.table_version")
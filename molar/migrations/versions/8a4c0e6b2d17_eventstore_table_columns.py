@@ -0,0 +1,32 @@
+"""eventstore-table-columns
+
+Revision ID: 8a4c0e6b2d17
+Revises: 5d2e7f1a9c3b
+Create Date: 2026-10-18 10:03:17.204855
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "8a4c0e6b2d17"
+down_revision = "5d2e7f1a9c3b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_table_columns.sql"))
+
+
+def downgrade():
+    op.execute("drop event trigger if exists sourcing_refresh_table_columns")
+    op.execute("drop function if exists sourcing.on_ddl_refresh_table_columns")
+    op.execute("drop function if exists sourcing.refresh_table_columns")
+    op.execute("drop table if exists sourcing.table_columns")
+    for function_name in ["sourcing.on_create_query", "sourcing.on_update_query"]:
+        op.execute(sql_utils.read_sql_function("event_sourcing.sql", function_name))
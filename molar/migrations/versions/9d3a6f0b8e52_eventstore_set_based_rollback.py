@@ -0,0 +1,35 @@
+"""eventstore-set-based-rollback
+
+Revision ID: 9d3a6f0b8e52
+Revises: 4b6e8d2c1f90
+Create Date: 2026-10-18 13:21:37.842016
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "9d3a6f0b8e52"
+down_revision = "4b6e8d2c1f90"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_rollback.sql"))
+
+
+def downgrade():
+    op.execute(
+        sql_utils.read_sql_function(
+            "event_sourcing_generated_apply.sql", 'sourcing."on_event"'
+        )
+    )
+    op.execute("drop function if exists sourcing.rollback_tables")
+    op.execute("drop function if exists sourcing.entity_tables")
+    op.execute("drop aggregate if exists sourcing.jsonb_merge(jsonb)")
+    op.execute("drop function if exists sourcing.jsonb_merge_state")
@@ -0,0 +1,39 @@
+"""eventstore-generated-apply
+
+Revision ID: c3f9b2e45a01
+Revises: 8a4c0e6b2d17
+Create Date: 2026-10-18 11:26:52.730114
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "c3f9b2e45a01"
+down_revision = "8a4c0e6b2d17"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_generated_apply.sql"))
+
+
+def downgrade():
+    op.execute(sql_utils.read_sql_function("event_sourcing.sql", 'sourcing."on_event"'))
+    op.execute(
+        sql_utils.read_sql_function(
+            "event_sourcing_table_columns.sql", "sourcing.on_ddl_refresh_table_columns"
+        )
+    )
+    op.execute("select sourcing.drop_apply_functions()")
+    op.execute("drop function if exists sourcing.apply_event")
+    op.execute("drop function if exists sourcing.enable_generated_apply")
+    op.execute("drop function if exists sourcing.disable_generated_apply")
+    op.execute("drop function if exists sourcing.generate_apply_functions")
+    op.execute("drop function if exists sourcing.drop_apply_functions")
+    op.execute("drop table if exists sourcing.settings")
@@ -0,0 +1,69 @@
+"""eventstore-partitions
+
+Revision ID: e7b14d3f6a28
+Revises: c3f9b2e45a01
+Create Date: 2026-10-18 12:24:05.118734
+
+"""
+# external
+from alembic import op
+import sqlalchemy as sa
+
+# molar
+from molar import sql_utils
+
+# revision identifiers, used by Alembic.
+revision = "e7b14d3f6a28"
+down_revision = "c3f9b2e45a01"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(sql_utils.read_sql_file("event_sourcing_partitions.sql"))
+
+
+def downgrade():
+    op.execute("alter table sourcing.eventstore rename to eventstore_partitioned")
+    op.execute(
+        (
+            "create table sourcing.eventstore ("
+            "    like sourcing.eventstore_partitioned"
+            "    including defaults including constraints,"
+            '    primary key ( "id" )'
+            ")"
+        )
+    )
+    op.execute(
+        (
+            "alter table sourcing.eventstore"
+            "  add constraint eventstore_user_id foreign key (user_id)"
+            '  references "user".user (user_id)'
+        )
+    )
+    op.execute(
+        (
+            "insert into sourcing.eventstore"
+            '  select "id", "event", "type", "data", "timestamp", "uuid", "user_id",'
+            '         "alembic_version"'
+            "    from sourcing.eventstore_partitioned"
+        )
+    )
+    op.execute("drop table sourcing.eventstore_partitioned")
+    op.execute(
+        "alter table sourcing.eventstore rename constraint eventstore_pkey1 to eventstore_pkey"
+    )
+    op.execute(
+        (
+            "create trigger on_event_insert"
+            "    before insert"
+            "    on sourcing.eventstore"
+            "    for each row"
+            "    when (current_setting('sourcing.skip_apply', true) is distinct from 'on')"
+            "        execute procedure sourcing.on_event();"
+        )
+    )
+    op.execute("drop function if exists sourcing.archive_eventstore_partitions")
+    op.execute("drop function if exists sourcing.eventstore_partitions")
+    op.execute("drop function if exists sourcing.create_eventstore_partitions")
+    op.execute("drop function if exists sourcing.create_eventstore_partition")
@@ -0,0 +1,86 @@
+-- The trigger is skipped for events that have already been applied
+-- to the public tables (see apply_staged_events)
+drop trigger if exists on_event_insert on sourcing.eventstore;
+create trigger on_event_insert
+    before insert
+    on sourcing.eventstore
+    for each row
+    when (current_setting('sourcing.skip_apply', true) is distinct from 'on')
+        execute procedure sourcing.on_event();
+
+
+-- apply_staged_events
+--
+-- applies create events loaded (usually through copy) in a staging table
+-- with the columns ("position", "type", "uuid", "data"). The events of a type
+-- having the same keys are inserted with a single set-based insert, in order
+-- of first appearance in the staging table, then all the events are recorded
+-- in the eventstore at once. As in on_event, only the columns given in the
+-- data are inserted, the others take their default.
+create or replace function sourcing.apply_staged_events(staging regclass, user_id bigint)
+returns table ("id" bigint, "uuid" uuid) as $function$
+declare
+    ts timestamp without time zone := now()::timestamp without time zone;
+    versions text[] := (select array_agg(version_num) from public.alembic_version);
+    rec record;
+    cols text;
+    vals text;
+begin
+    for rec in execute format(
+        'select "type", "keys"
+           from (select "type", "position",
+                        array(select k from jsonb_object_keys("data") as k order by k)
+                            as "keys"
+                   from %s) as s
+       group by "type", "keys"
+       order by min("position")',
+        staging
+    )
+    loop
+        if rec.type is null or to_regclass(format('public.%I', rec.type)) is null then
+            raise undefined_table using message = format('Invalid type: %L', rec.type);
+        end if;
+
+        select string_agg(format('%I', columns.column_name), ', '
+                          order by columns.ordinal_position),
+               string_agg(format('r.%I', columns.column_name), ', '
+                          order by columns.ordinal_position)
+          into cols, vals
+          from information_schema.columns
+         where columns.table_schema = 'public'
+           and columns.table_name = rec.type
+           and (columns.column_name = any(rec.keys)
+                or columns.column_name in (rec.type || '_id', 'created_on', 'updated_on'));
+
+        execute format(
+            'insert into public.%1$I (%6$s)
+             select %7$s
+               from %4$s as s,
+                    jsonb_populate_record(
+                        null::public.%1$I,
+                        s.data || jsonb_build_object(%2$L, s.uuid,
+                                                     ''created_on'', %3$L::timestamp,
+                                                     ''updated_on'', %3$L::timestamp)
+                    ) as r
+              where s.type = %5$L
+                and array(select k from jsonb_object_keys(s.data) as k order by k)
+                    = %8$L::text[]
+           order by s.position',
+            rec.type, rec.type || '_id', ts, staging, rec.type, cols, vals, rec.keys
+        );
+    end loop;
+
+    perform set_config('sourcing.skip_apply', 'on', true);
+    return query execute format(
+        'insert into sourcing.eventstore
+            ("event", "type", "uuid", "data", "timestamp", "user_id", "alembic_version")
+         select ''create'', s.type, s.uuid, s.data, %L, %s, %L
+           from %s as s
+       order by s.position
+      returning eventstore.id, eventstore.uuid',
+        ts, user_id, versions, staging
+    );
+    perform set_config('sourcing.skip_apply', 'off', true);
+end;
+$function$
+language plpgsql;
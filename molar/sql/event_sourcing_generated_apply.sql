@@ -0,0 +1,315 @@
+create table if not exists sourcing.settings (
+    "name"  text primary key,
+    "value" text not null
+);
+
+insert into sourcing.settings ("name", "value")
+     values ('generated_apply', 'off')
+on conflict do nothing;
+
+
+-- apply_event
+--
+-- dispatcher to the generated apply functions. It returns the number of rows
+-- affected by the event or null if no function has been generated for its type.
+create or replace function sourcing.apply_event(new record)
+returns integer as $function$
+begin
+    return null;
+end;
+$function$
+language plpgsql;
+
+
+create or replace function sourcing.drop_apply_functions()
+returns void as $function$
+declare
+    rec record;
+begin
+    for rec in (
+        select proname
+          from pg_proc
+         where pronamespace = 'sourcing'::regnamespace
+           and proname ~ '^apply_(create|update|delete)_'
+    )
+    loop
+        execute format('drop function if exists sourcing.%I(record)', rec.proname);
+    end loop;
+
+    create or replace function sourcing.apply_event(new record)
+    returns integer as $apply$
+    begin
+        return null;
+    end;
+    $apply$
+    language plpgsql;
+end;
+$function$
+language plpgsql;
+
+
+-- generate_apply_functions
+--
+-- generates, for every public table, static create, update and delete
+-- functions so the plans of the apply path can be cached, along with the
+-- dispatcher calling them based on the type of the event.
+create or replace function sourcing.generate_apply_functions()
+returns void as $function$
+declare
+    tbl record;
+    col record;
+    pk text;
+    value text;
+    fallback text;
+    insert_columns text;
+    insert_values text;
+    update_sets text;
+    dispatch text := '';
+begin
+    perform sourcing.drop_apply_functions();
+
+    for tbl in (
+        select table_name
+          from sourcing.table_columns
+      group by table_name
+        having bool_or(column_name = table_name || '_id')
+      order by table_name
+    )
+    loop
+        pk := tbl.table_name || '_id';
+        insert_columns := '';
+        insert_values := '';
+        update_sets := '';
+
+        for col in (
+            select attribute.attname as col_name,
+                   format_type(attribute.atttypid, attribute.atttypmod) as col_type,
+                   type.typcategory = 'A' as is_array,
+                   pg_get_expr(def.adbin, def.adrelid) as col_default
+              from pg_attribute as attribute
+              join pg_type as type on type.oid = attribute.atttypid
+         left join pg_attrdef as def
+                on def.adrelid = attribute.attrelid and def.adnum = attribute.attnum
+             where attribute.attrelid = format('public.%I', tbl.table_name)::regclass
+               and attribute.attnum > 0
+               and not attribute.attisdropped
+          order by attribute.attnum
+        )
+        loop
+            continue when col.col_name = pk;
+
+            value := case
+                when col.is_array then
+                    format('(select array_agg(element #>> ''{}'')
+                               from jsonb_array_elements(new.data->%L) as element)::%s',
+                           col.col_name, col.col_type)
+                when col.col_type = 'integer' then
+                    format('(new.data->>%L)::numeric::integer', col.col_name)
+                when col.col_type = 'jsonb' then
+                    format('(new.data->%L)', col.col_name)
+                else
+                    format('(new.data->>%L)::%s', col.col_name, col.col_type)
+            end;
+
+            fallback := case
+                when col.col_name in ('created_on', 'updated_on') then 'new.timestamp'
+                else coalesce(col.col_default, 'null')
+            end;
+            insert_columns := insert_columns || format(', %I', col.col_name);
+            insert_values := insert_values
+                || format(', case when new.data ? %L then %s else %s end',
+                          col.col_name, value, fallback);
+
+            if col.col_type = 'jsonb' then
+                -- Does an aggreagation of the two jsonb. Last key wins.
+                value := format('%I || (new.data->%L)', col.col_name, col.col_name);
+            end if;
+            fallback := case
+                when col.col_name = 'updated_on' then 'new.timestamp'
+                else format('%I', col.col_name)
+            end;
+            update_sets := update_sets
+                || format(', %I = case when new.data ? %L then %s else %s end',
+                          col.col_name, col.col_name, value, fallback);
+        end loop;
+
+        if update_sets = '' then
+            update_sets := format(', %I = %I', pk, pk);
+        end if;
+
+        execute format(
+            'create or replace function sourcing.%I(new record)
+             returns integer as $apply$
+             begin
+                 insert into public.%I (%I%s) values (new.uuid%s);
+                 return 1;
+             end;
+             $apply$
+             language plpgsql;',
+            'apply_create_' || tbl.table_name, tbl.table_name, pk,
+            insert_columns, insert_values
+        );
+
+        execute format(
+            'create or replace function sourcing.%I(new record)
+             returns integer as $apply$
+             declare
+                 affected integer;
+             begin
+                 update public.%I set %s where %I = new.uuid;
+                 get diagnostics affected = row_count;
+                 return affected;
+             end;
+             $apply$
+             language plpgsql;',
+            'apply_update_' || tbl.table_name, tbl.table_name,
+            right(update_sets, -2), pk
+        );
+
+        execute format(
+            'create or replace function sourcing.%I(new record)
+             returns integer as $apply$
+             declare
+                 affected integer;
+             begin
+                 delete from public.%I where %I = new.uuid;
+                 get diagnostics affected = row_count;
+                 return affected;
+             end;
+             $apply$
+             language plpgsql;',
+            'apply_delete_' || tbl.table_name, tbl.table_name, pk
+        );
+
+        dispatch := dispatch || format(
+            'when %L then
+                 case new.event
+                 when ''create'' then return sourcing.%I(new);
+                 when ''update'' then return sourcing.%I(new);
+                 when ''delete'' then return sourcing.%I(new);
+                 else return null;
+                 end case;
+            ',
+            tbl.table_name, 'apply_create_' || tbl.table_name,
+            'apply_update_' || tbl.table_name, 'apply_delete_' || tbl.table_name
+        );
+    end loop;
+
+    if dispatch = '' then
+        return;
+    end if;
+
+    execute format(
+        'create or replace function sourcing.apply_event(new record)
+         returns integer as $apply$
+         begin
+             case new.type
+             %s
+             else return null;
+             end case;
+         end;
+         $apply$
+         language plpgsql;',
+        dispatch
+    );
+end;
+$function$
+language plpgsql;
+
+
+create or replace function sourcing.enable_generated_apply()
+returns void as $function$
+begin
+    update sourcing.settings set "value" = 'on' where "name" = 'generated_apply';
+    perform sourcing.generate_apply_functions();
+end;
+$function$
+language plpgsql;
+
+
+create or replace function sourcing.disable_generated_apply()
+returns void as $function$
+begin
+    update sourcing.settings set "value" = 'off' where "name" = 'generated_apply';
+    perform sourcing.drop_apply_functions();
+end;
+$function$
+language plpgsql;
+
+
+-- the apply functions are generated again every time the schema changes,
+-- e.g. when a migration runs
+create or replace function sourcing.on_ddl_refresh_table_columns()
+returns event_trigger as $function$
+begin
+    perform sourcing.refresh_table_columns();
+    if (select "value" from sourcing.settings where "name" = 'generated_apply') = 'on' then
+        perform sourcing.generate_apply_functions();
+    end if;
+end;
+$function$
+language plpgsql;
+
+
+--
+-- Trigger function that binds everything together
+--
+create or replace function sourcing."on_event"( )
+returns trigger as $function$
+declare
+    count INT := 1;
+begin
+    if new.timestamp is null then
+        new.timestamp := now()::timestamp without time zone;
+    end if;
+
+    new.alembic_version := (select array_agg(version_num) from public.alembic_version);
+
+    case new.event
+    when 'create' then
+        if new.uuid is null then
+            new.uuid := uuid_generate_v4();
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_create_query(new));
+            count := 1;
+        end if;
+    when 'update' then
+        if new.uuid is null then
+            raise null_value_not_allowed using message='No uuid has been provided';
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_update_query(new));
+            get diagnostics count = ROW_COUNT;
+        end if;
+    when 'delete' then
+        if new.uuid is null then
+            raise null_value_not_allowed using message='No uuid have been provided';
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_delete_query(new));
+            get diagnostics count = ROW_COUNT;
+        end if;
+    when 'rollback-begin' then
+    when 'rollback-end' then
+    when 'rollback' then
+        execute (select sourcing.on_rollback_query(new));
+        insert into sourcing.eventstore
+            ("event", "data", "timestamp", "user_id", "alembic_version")
+     values ('rollback-end', new.data, new.timestamp, new.user_id, new.alembic_version);
+        new.event := 'rollback-begin';
+    else
+        raise unique_violation using message = format('Invalid event type: %L', new.event);
+    end case;
+
+    if count = 0 then
+        raise no_data_found using message = format('No item matches the uuid %L', new.uuid);
+    end if;
+
+    return new;
+end;
+$function$
+language plpgsql;
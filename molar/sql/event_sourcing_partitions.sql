@@ -0,0 +1,201 @@
+-- The eventstore is range-partitioned by month on "timestamp". Events that
+-- don't fall in any monthly partition land in the default partition, so an
+-- insert never fails because a partition is missing.
+alter table sourcing.eventstore rename to eventstore_unpartitioned;
+alter table sourcing.eventstore_unpartitioned
+    rename constraint eventstore_pkey to eventstore_unpartitioned_pkey;
+alter table sourcing.eventstore_unpartitioned
+    drop constraint eventstore_user_id;
+drop trigger if exists on_event_insert on sourcing.eventstore_unpartitioned;
+
+create table sourcing.eventstore (
+    "id"    bigint default nextval('sourcing.eventstore_id_seq'::regclass) not null,
+    "event" character varying(2044)                                        not null,
+    "type"  character varying(2044),
+    "data"  jsonb    default '{}'                                                      not null,
+    "timestamp" timestamp without time zone default now()::timestamp without time zone not null,
+    "uuid" uuid,
+    "user_id" bigint not null,
+    "alembic_version" text[] not null,
+    primary key ( "id", "timestamp" )
+) partition by range ( "timestamp" );
+
+alter table sourcing.eventstore
+  add constraint eventstore_user_id foreign key (user_id) references "user".user (user_id);
+
+create table sourcing.eventstore_default
+    partition of sourcing.eventstore default;
+
+
+-- create_eventstore_partition
+--
+-- creates the partition of the month starting at `month_start`. Events of this
+-- month already stored in the default partition are moved to the new one.
+create or replace function sourcing.create_eventstore_partition(month_start date)
+returns text as $function$
+declare
+    lower_bound timestamp without time zone := date_trunc('month', month_start);
+    upper_bound timestamp without time zone := date_trunc('month', month_start) + interval '1 month';
+    partition_name text := format('eventstore_p%s', to_char(lower_bound, 'YYYY_MM'));
+begin
+    if to_regclass(format('sourcing.%I', partition_name)) is not null then
+        return null;
+    end if;
+
+    execute format(
+        'create table sourcing.%I
+            (like sourcing.eventstore including defaults including constraints)',
+        partition_name
+    );
+    execute format(
+        'with moved as (
+             delete from sourcing.eventstore_default
+              where "timestamp" >= %1$L and "timestamp" < %2$L
+          returning *
+         )
+         insert into sourcing.%3$I select * from moved',
+        lower_bound, upper_bound, partition_name
+    );
+    execute format(
+        'alter table sourcing.eventstore attach partition sourcing.%I
+            for values from (%L) to (%L)',
+        partition_name, lower_bound, upper_bound
+    );
+    return partition_name;
+end;
+$function$
+language plpgsql;
+
+
+-- create_eventstore_partitions
+--
+-- makes sure the partitions from the current month up to `months_ahead` months
+-- in the future exist. It can be called as often as needed.
+create or replace function sourcing.create_eventstore_partitions(months_ahead integer default 3)
+returns setof text as $function$
+declare
+    partition_name text;
+    month_start date;
+begin
+    perform pg_advisory_xact_lock(hashtext('sourcing.eventstore_partitions'));
+    for month_start in (
+        select generate_series(date_trunc('month', now()),
+                               date_trunc('month', now()) + make_interval(months => months_ahead),
+                               interval '1 month')::date
+    )
+    loop
+        partition_name := sourcing.create_eventstore_partition(month_start);
+        if partition_name is not null then
+            return next partition_name;
+        end if;
+    end loop;
+end;
+$function$
+language plpgsql;
+
+
+-- eventstore_partitions
+--
+-- lists the monthly partitions of the eventstore with their bounds and
+-- their number of events.
+create or replace function sourcing.eventstore_partitions()
+returns table ("name" text, "lower_bound" timestamp without time zone,
+               "upper_bound" timestamp without time zone, "count" bigint) as $function$
+declare
+    rec record;
+begin
+    for rec in (
+        select child.relname::text as partition_name,
+               regexp_match(pg_get_expr(child.relpartbound, child.oid),
+                            'FROM \(''([^'']+)''\) TO \(''([^'']+)''\)') as bounds
+          from pg_inherits
+          join pg_class as child on child.oid = pg_inherits.inhrelid
+         where pg_inherits.inhparent = 'sourcing.eventstore'::regclass
+      order by child.relname
+    )
+    loop
+        name := rec.partition_name;
+        lower_bound := rec.bounds[1]::timestamp without time zone;
+        upper_bound := rec.bounds[2]::timestamp without time zone;
+        execute format('select count(*) from sourcing.%I', rec.partition_name) into count;
+        return next;
+    end loop;
+end;
+$function$
+language plpgsql;
+
+
+-- archive_eventstore_partitions
+--
+-- detaches the partitions holding only events older than `before` and moves
+-- them to `archive_schema`, or drops them if `drop_partitions` is true.
+-- Archived events are not part of the eventstore anymore: they are not
+-- considered by rollbacks.
+create or replace function sourcing.archive_eventstore_partitions(
+    before timestamp without time zone,
+    archive_schema name default 'sourcing_archive',
+    drop_partitions boolean default false
+)
+returns setof text as $function$
+declare
+    rec record;
+begin
+    perform pg_advisory_xact_lock(hashtext('sourcing.eventstore_partitions'));
+    if not drop_partitions then
+        execute format('create schema if not exists %I', archive_schema);
+    end if;
+
+    for rec in (
+        select partitions.name
+          from sourcing.eventstore_partitions() as partitions
+         where partitions.upper_bound <= before
+      order by partitions.lower_bound
+    )
+    loop
+        execute format('alter table sourcing.eventstore detach partition sourcing.%I',
+                       rec.name);
+        if drop_partitions then
+            execute format('drop table sourcing.%I', rec.name);
+        else
+            execute format('alter table sourcing.%I set schema %I', rec.name, archive_schema);
+        end if;
+        return next rec.name;
+    end loop;
+end;
+$function$
+language plpgsql;
+
+
+-- creates the partitions needed by the existing events, then moves them
+do $$
+declare
+    month_start date;
+begin
+    for month_start in (
+        select generate_series(
+                   coalesce(date_trunc('month', min("timestamp")), date_trunc('month', now())),
+                   date_trunc('month', now()),
+                   interval '1 month'
+               )::date
+          from sourcing.eventstore_unpartitioned
+    )
+    loop
+        perform sourcing.create_eventstore_partition(month_start);
+    end loop;
+end$$;
+select sourcing.create_eventstore_partitions();
+
+insert into sourcing.eventstore
+select "id", "event", "type", "data", "timestamp", "uuid", "user_id", "alembic_version"
+  from sourcing.eventstore_unpartitioned;
+
+drop table sourcing.eventstore_unpartitioned;
+
+
+-- row triggers of a partitioned table are cloned on each of its partitions
+create trigger on_event_insert
+    before insert
+    on sourcing.eventstore
+    for each row
+    when (current_setting('sourcing.skip_apply', true) is distinct from 'on')
+        execute procedure sourcing.on_event();
@@ -0,0 +1,363 @@
+-- jsonb_merge
+--
+-- folds the data of successive events the same way the trigger applies them:
+-- the last value of a key wins, except for jsonb objects which are merged.
+create or replace function sourcing.jsonb_merge_state(state jsonb, event_data jsonb)
+returns jsonb as $function$
+    select state || coalesce(
+               jsonb_object_agg(
+                   item.key,
+                   case
+                   when jsonb_typeof(state->item.key) = 'object'
+                    and jsonb_typeof(item.value) = 'object' then (state->item.key) || item.value
+                   else item.value
+                   end
+               ),
+               '{}'::jsonb
+           )
+      from jsonb_each(coalesce(event_data, '{}'::jsonb)) as item
+$function$
+language sql immutable;
+
+drop aggregate if exists sourcing.jsonb_merge(jsonb);
+create aggregate sourcing.jsonb_merge(jsonb) (
+    sfunc = sourcing.jsonb_merge_state,
+    stype = jsonb,
+    initcond = '{}'
+);
+
+
+-- entity_tables
+--
+-- public tables that are managed through the eventstore, with their depth in
+-- the foreign key graph: a table always comes after the tables it references.
+create or replace function sourcing.entity_tables()
+returns table ("table_name" name, "depth" integer) as $function$
+    with recursive entities as (
+        select table_columns.table_name
+          from sourcing.table_columns
+      group by table_columns.table_name
+        having bool_or(table_columns.column_name = table_columns.table_name || '_id')
+    ), foreign_keys as (
+        select child.relname as child, parent.relname as parent
+          from pg_constraint
+          join pg_class as child on child.oid = pg_constraint.conrelid
+          join pg_class as parent on parent.oid = pg_constraint.confrelid
+         where pg_constraint.contype = 'f'
+           and pg_constraint.conrelid <> pg_constraint.confrelid
+           and child.relnamespace = 'public'::regnamespace
+           and parent.relnamespace = 'public'::regnamespace
+    ), depths as (
+        select entities.table_name, 0 as depth, array[entities.table_name] as path
+          from entities
+         union all
+        select foreign_keys.child, depths.depth + 1, depths.path || foreign_keys.child
+          from depths
+          join foreign_keys on foreign_keys.parent = depths.table_name
+         where not foreign_keys.child = any(depths.path)
+    )
+    select depths.table_name, max(depths.depth)
+      from depths
+      join entities on entities.table_name = depths.table_name
+  group by depths.table_name
+$function$
+language sql stable;
+
+
+-- rollback_tables
+--
+-- brings the public tables back to the state described by the events matching
+-- `criteria` ({"before": ..., "after": ...}). The target state of every entity
+-- is computed with a single fold over the eventstore, compared to the current
+-- rows, and only the tables that differ (and the tables referencing them) are
+-- truncated and rebuilt, in foreign key order. The eventstore receives one
+-- delete and/or create event per entity that changed, instead of a replay of
+-- the whole history. With `dry_run`, only the number of affected rows is
+-- returned.
+create or replace function sourcing.rollback_tables(
+    criteria jsonb,
+    ts timestamp without time zone,
+    user_id bigint,
+    dry_run boolean default false
+)
+returns table ("table_name" text, "deleted" bigint, "inserted" bigint, "updated" bigint) as $function$
+declare
+    q1 text := '';
+    tbl record;
+    col record;
+    pk text;
+    insert_columns text;
+    insert_values text;
+    plan record;
+    rebuilt text[] := '{}';
+    rebuilt_table text;
+    total integer;
+    step integer := 0;
+    versions text[] := (select array_agg(version_num) from public.alembic_version);
+begin
+    if (criteria ? 'before') then
+        q1 = format('"timestamp" < %L ::timestamp without time zone and ',
+                    criteria->>'before');
+    end if;
+    if (criteria ? 'after') then
+        q1 = q1 || format('"timestamp" > %L ::timestamp without time zone and ',
+                          criteria->>'after');
+    end if;
+    if q1 = '' then
+        raise invalid_parameter_value using message = 'No criterion were provided for the rollback';
+    end if;
+
+    -- the temporary tables are dropped at commit, they only exist here if a
+    -- rollback already ran in the current transaction
+    if to_regclass('pg_temp.rollback_state') is not null then
+        drop table pg_temp.rollback_state;
+        drop table pg_temp.rollback_plan;
+    end if;
+    execute format(
+        'create temporary table rollback_state on commit drop as
+         with events as (
+             select "id", "event", "type", "uuid", "data", "timestamp"
+               from sourcing.eventstore
+              where %s "uuid" is not null
+                and "event" in (''create'', ''update'', ''delete'')
+         ), lifecycle as (
+             select "uuid",
+                    max("id") filter (where "event" = ''create'') as created_id,
+                    max("id") filter (where "event" = ''delete'') as deleted_id
+               from events
+           group by "uuid"
+         )
+         select events."type",
+                events."uuid",
+                jsonb_build_object(''created_on'', min(events."timestamp"),
+                                   ''updated_on'', max(events."timestamp"))
+                || sourcing.jsonb_merge(events."data" order by events."id") as "data"
+           from events
+           join lifecycle on lifecycle."uuid" = events."uuid"
+          where lifecycle.created_id > coalesce(lifecycle.deleted_id, 0)
+            and events."id" >= lifecycle.created_id
+       group by events."type", events."uuid"',
+        q1
+    );
+
+    create temporary table rollback_plan (
+        "table_name" text,
+        "depth"      integer,
+        "deleted"    bigint,
+        "inserted"   bigint,
+        "updated"    bigint
+    ) on commit drop;
+
+    for tbl in (
+        select entity_tables.table_name::text as name, entity_tables.depth
+          from sourcing.entity_tables()
+      order by entity_tables.depth, entity_tables.table_name
+    )
+    loop
+        pk := tbl.name || '_id';
+        insert_columns := '';
+        insert_values := '';
+        for col in (
+            select attribute.attname as col_name,
+                   pg_get_expr(def.adbin, def.adrelid) as col_default
+              from pg_attribute as attribute
+         left join pg_attrdef as def
+                on def.adrelid = attribute.attrelid and def.adnum = attribute.attnum
+             where attribute.attrelid = format('public.%I', tbl.name)::regclass
+               and attribute.attnum > 0
+               and not attribute.attisdropped
+          order by attribute.attnum
+        )
+        loop
+            insert_columns := insert_columns || format(', %I', col.col_name);
+            insert_values := insert_values
+                || format(', case when s.data ? %L then (s.r).%I else %s end',
+                          col.col_name, col.col_name, coalesce(col.col_default, 'null'));
+        end loop;
+
+        if to_regclass(format('pg_temp.%I', 'rollback_' || tbl.name)) is not null then
+            execute format('drop table pg_temp.%I', 'rollback_' || tbl.name);
+        end if;
+        execute format(
+            'create temporary table %I (like public.%I) on commit drop',
+            'rollback_' || tbl.name, tbl.name
+        );
+        execute format(
+            'insert into pg_temp.%1$I (%2$s)
+             select %3$s
+               from (
+                 select state.data, jsonb_populate_record(null::public.%4$I, state.data) as r
+                   from (
+                     select rollback_state.data || jsonb_build_object(%5$L, rollback_state.uuid) as data
+                       from pg_temp.rollback_state
+                      where rollback_state.type = %4$L
+                   ) as state
+               ) as s',
+            'rollback_' || tbl.name, right(insert_columns, -2), right(insert_values, -2),
+            tbl.name, pk
+        );
+
+        execute format(
+            'insert into pg_temp.rollback_plan
+             select %1$L, %2$s,
+                    count(*) filter (where target.%3$I is null),
+                    count(*) filter (where current.%3$I is null),
+                    count(*) filter (where current.%3$I is not null
+                                       and target.%3$I is not null
+                                       and to_jsonb(current) <> to_jsonb(target))
+               from public.%1$I as current
+          full join pg_temp.%4$I as target on target.%3$I = current.%3$I',
+            tbl.name, tbl.depth, pk, 'rollback_' || tbl.name
+        );
+    end loop;
+
+    if dry_run then
+        return query
+            select rollback_plan.table_name, rollback_plan.deleted,
+                   rollback_plan.inserted, rollback_plan.updated
+              from pg_temp.rollback_plan
+          order by rollback_plan.depth, rollback_plan.table_name;
+        return;
+    end if;
+
+    -- a table is rebuilt when it changes or when it references a rebuilt table
+    for plan in (
+        select * from pg_temp.rollback_plan order by rollback_plan.depth, rollback_plan.table_name
+    )
+    loop
+        if plan.deleted + plan.inserted + plan.updated > 0 or exists (
+            select
+              from pg_constraint
+             where pg_constraint.contype = 'f'
+               and pg_constraint.conrelid = format('public.%I', plan.table_name)::regclass
+               and pg_constraint.confrelid in (
+                   select format('public.%I', rebuilt_tables.name)::regclass
+                     from unnest(rebuilt) as rebuilt_tables(name)
+               )
+        ) then
+            rebuilt := rebuilt || plan.table_name;
+        end if;
+    end loop;
+
+    perform set_config('sourcing.skip_apply', 'on', true);
+    foreach rebuilt_table in array rebuilt
+    loop
+        execute format(
+            'insert into sourcing.eventstore
+                ("event", "type", "uuid", "data", "timestamp", "user_id", "alembic_version")
+             select compensation.event, %1$L, compensation.uuid, compensation.data, %2$L, %3$s, %4$L
+               from (
+                 select 0 as step, ''delete'' as event, current.%5$I as uuid, ''{}''::jsonb as data
+                   from public.%1$I as current
+              left join pg_temp.%6$I as target on target.%5$I = current.%5$I
+                  where target.%5$I is null or to_jsonb(current) <> to_jsonb(target)
+              union all
+                 select 1, ''create'', target.%5$I, to_jsonb(target) - %5$L
+                   from pg_temp.%6$I as target
+              left join public.%1$I as current on current.%5$I = target.%5$I
+                  where current.%5$I is null or to_jsonb(current) <> to_jsonb(target)
+               ) as compensation
+           order by compensation.step, compensation.uuid',
+            rebuilt_table, ts, user_id, versions, rebuilt_table || '_id',
+            'rollback_' || rebuilt_table
+        );
+    end loop;
+    perform set_config('sourcing.skip_apply', 'off', true);
+
+    total := coalesce(array_length(rebuilt, 1), 0);
+    if total > 0 then
+        execute (
+            select 'truncate ' || string_agg(format('public.%I', rebuilt_tables.name), ', ')
+              from unnest(rebuilt) as rebuilt_tables(name)
+        );
+    end if;
+
+    foreach rebuilt_table in array rebuilt
+    loop
+        step := step + 1;
+        execute format('insert into public.%I select * from pg_temp.%I',
+                       rebuilt_table, 'rollback_' || rebuilt_table);
+        raise notice 'rollback: table % rebuilt (%/%)', rebuilt_table, step, total;
+    end loop;
+
+    return query
+        select rollback_plan.table_name, rollback_plan.deleted,
+               rollback_plan.inserted, rollback_plan.updated
+          from pg_temp.rollback_plan
+      order by rollback_plan.depth, rollback_plan.table_name;
+end;
+$function$
+language plpgsql;
+
+
+--
+-- Trigger function that binds everything together
+--
+create or replace function sourcing."on_event"( )
+returns trigger as $function$
+declare
+    count INT := 1;
+    report jsonb;
+begin
+    if new.timestamp is null then
+        new.timestamp := now()::timestamp without time zone;
+    end if;
+
+    new.alembic_version := (select array_agg(version_num) from public.alembic_version);
+
+    case new.event
+    when 'create' then
+        if new.uuid is null then
+            new.uuid := uuid_generate_v4();
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_create_query(new));
+            count := 1;
+        end if;
+    when 'update' then
+        if new.uuid is null then
+            raise null_value_not_allowed using message='No uuid has been provided';
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_update_query(new));
+            get diagnostics count = ROW_COUNT;
+        end if;
+    when 'delete' then
+        if new.uuid is null then
+            raise null_value_not_allowed using message='No uuid have been provided';
+        end if;
+        count := sourcing.apply_event(new);
+        if count is null then
+            execute (select sourcing.on_delete_query(new));
+            get diagnostics count = ROW_COUNT;
+        end if;
+    when 'rollback-begin' then
+    when 'rollback-end' then
+    when 'rollback' then
+        select coalesce(jsonb_object_agg(tables.table_name,
+                                         jsonb_build_object('deleted', tables.deleted,
+                                                            'inserted', tables.inserted,
+                                                            'updated', tables.updated)),
+                        '{}'::jsonb)
+          into report
+          from sourcing.rollback_tables(new.data, new.timestamp, new.user_id) as tables
+         where tables.deleted + tables.inserted + tables.updated > 0;
+        new.data := new.data || jsonb_build_object('tables', report);
+        insert into sourcing.eventstore
+            ("event", "data", "timestamp", "user_id", "alembic_version")
+     values ('rollback-end', new.data, new.timestamp, new.user_id, new.alembic_version);
+        new.event := 'rollback-begin';
+    else
+        raise unique_violation using message = format('Invalid event type: %L', new.event);
+    end case;
+
+    if count = 0 then
+        raise no_data_found using message = format('No item matches the uuid %L', new.uuid);
+    end if;
+
+    return new;
+end;
+$function$
+language plpgsql;
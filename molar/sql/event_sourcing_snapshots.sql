@@ -0,0 +1,366 @@
+-- snapshot
+--
+-- copies of the public tables, as jsonb rows, tagged with the id of the last
+-- event applied to them. Reconstructing the state at a point in time starts
+-- from the latest snapshot preceding it and only folds the events after it.
+create table if not exists sourcing.snapshot (
+    "snapshot_id"   bigserial                   primary key,
+    "event_id"      bigint                      not null,
+    "max_timestamp" timestamp without time zone,
+    "row_count"     bigint                      not null default 0,
+    "created_on"    timestamp without time zone not null default now()::timestamp without time zone,
+    "user_id"       bigint                      not null
+);
+
+alter table sourcing.snapshot
+  add constraint snapshot_user_id foreign key (user_id) references "user".user (user_id);
+
+create table if not exists sourcing.snapshot_row (
+    "snapshot_id" bigint not null references sourcing.snapshot (snapshot_id) on delete cascade,
+    "type"        text   not null,
+    "uuid"        uuid   not null,
+    "data"        jsonb  not null,
+    primary key ( "snapshot_id", "uuid" )
+);
+
+
+create or replace function sourcing.create_snapshot(user_id bigint)
+returns bigint as $function$
+declare
+    new_snapshot_id bigint;
+    last_event_id bigint;
+    last_timestamp timestamp without time zone;
+    tbl record;
+    pk text;
+    n_rows bigint;
+    total bigint := 0;
+begin
+    -- no event can be applied while the tables are copied
+    lock table sourcing.eventstore in share mode;
+
+    select max("id"), max("timestamp")
+      into last_event_id, last_timestamp
+      from sourcing.eventstore;
+
+    insert into sourcing.snapshot ("event_id", "max_timestamp", "user_id")
+         values (coalesce(last_event_id, 0), last_timestamp, user_id)
+      returning snapshot.snapshot_id into new_snapshot_id;
+
+    for tbl in (select entity_tables.table_name from sourcing.entity_tables())
+    loop
+        pk := tbl.table_name || '_id';
+        execute format(
+            'insert into sourcing.snapshot_row ("snapshot_id", "type", "uuid", "data")
+             select %s, %L, t.%I, to_jsonb(t) - %L from public.%I as t',
+            new_snapshot_id, tbl.table_name, pk, pk, tbl.table_name
+        );
+        get diagnostics n_rows = ROW_COUNT;
+        total := total + n_rows;
+    end loop;
+
+    update sourcing.snapshot
+       set row_count = total
+     where snapshot.snapshot_id = new_snapshot_id;
+    return new_snapshot_id;
+end;
+$function$
+language plpgsql;
+
+
+-- prune_snapshots
+--
+-- deletes the snapshots created before `before` and/or all but the `keep`
+-- most recent ones.
+create or replace function sourcing.prune_snapshots(
+    before timestamp without time zone default null,
+    keep integer default null
+)
+returns setof bigint as $function$
+begin
+    if before is null and keep is null then
+        raise invalid_parameter_value using message = 'No criterion were provided for the pruning';
+    end if;
+
+    return query
+        delete from sourcing.snapshot
+         where (before is null or snapshot.created_on < before)
+           and (keep is null or snapshot.snapshot_id not in (
+                   select latest.snapshot_id
+                     from sourcing.snapshot as latest
+                 order by latest.event_id desc
+                    limit keep
+               ))
+     returning snapshot.snapshot_id;
+end;
+$function$
+language plpgsql;
+
+
+-- reconstruct
+--
+-- computes the state of the entities (of `types`, or all of them) described
+-- by the events matching `criteria` ({"before": ..., "after": ...}). When the
+-- criteria only has an upper bound, the fold starts from the latest snapshot
+-- whose events all precede it.
+create or replace function sourcing.reconstruct(criteria jsonb, types text[] default null)
+returns table ("type" text, "uuid" uuid, "data" jsonb) as $function$
+declare
+    q1 text := '';
+    base_snapshot_id bigint;
+    base_event_id bigint;
+begin
+    if (criteria ? 'before') then
+        q1 = format('"timestamp" < %L ::timestamp without time zone and ',
+                    criteria->>'before');
+    end if;
+    if (criteria ? 'after') then
+        q1 = q1 || format('"timestamp" > %L ::timestamp without time zone and ',
+                          criteria->>'after');
+    end if;
+    if q1 = '' then
+        raise invalid_parameter_value using message = 'No criterion were provided for the rollback';
+    end if;
+
+    if not (criteria ? 'after') then
+        select snapshot.snapshot_id, snapshot.event_id
+          into base_snapshot_id, base_event_id
+          from sourcing.snapshot
+         where snapshot.max_timestamp < (criteria->>'before')::timestamp without time zone
+            or snapshot.max_timestamp is null
+      order by snapshot.event_id desc
+         limit 1;
+    end if;
+
+    return query execute format(
+        'with events as (
+             select "id", "event", "type"::text, "uuid", "data", "timestamp"
+               from sourcing.eventstore
+              where %1$s "uuid" is not null
+                and "event" in (''create'', ''update'', ''delete'')
+                and "id" > %2$s
+                and (%3$L::text[] is null or "type" = any(%3$L::text[]))
+          union all
+             select %2$s, ''snapshot'', "type", "uuid", "data", null
+               from sourcing.snapshot_row
+              where "snapshot_id" = %4$L
+                and (%3$L::text[] is null or "type" = any(%3$L::text[]))
+         ), lifecycle as (
+             select "uuid",
+                    max("id") filter (where "event" in (''create'', ''snapshot'')) as created_id,
+                    max("id") filter (where "event" = ''delete'') as deleted_id
+               from events
+           group by "uuid"
+         )
+         select events."type",
+                events."uuid",
+                sourcing.jsonb_merge(
+                    case events."event"
+                    when ''create'' then jsonb_build_object(''created_on'', events."timestamp",
+                                                            ''updated_on'', events."timestamp")
+                                         || events."data"
+                    when ''update'' then jsonb_build_object(''updated_on'', events."timestamp")
+                                         || events."data"
+                    else events."data"
+                    end
+                    order by events."id"
+                )
+           from events
+           join lifecycle on lifecycle."uuid" = events."uuid"
+          where lifecycle.created_id > coalesce(lifecycle.deleted_id, 0)
+            and events."id" >= lifecycle.created_id
+       group by events."type", events."uuid"',
+        q1, coalesce(base_event_id, 0), types, base_snapshot_id
+    );
+end;
+$function$
+language plpgsql;
+
+
+-- rollback_tables
+--
+-- brings the public tables back to the state described by the events matching
+-- `criteria` ({"before": ..., "after": ...}). The target state of every entity
+-- is computed by sourcing.reconstruct, compared to the current
+-- rows, and only the tables that differ (and the tables referencing them) are
+-- truncated and rebuilt, in foreign key order. The eventstore receives one
+-- delete and/or create event per entity that changed, instead of a replay of
+-- the whole history. With `dry_run`, only the number of affected rows is
+-- returned.
+create or replace function sourcing.rollback_tables(
+    criteria jsonb,
+    ts timestamp without time zone,
+    user_id bigint,
+    dry_run boolean default false
+)
+returns table ("table_name" text, "deleted" bigint, "inserted" bigint, "updated" bigint) as $function$
+declare
+    tbl record;
+    col record;
+    pk text;
+    insert_columns text;
+    insert_values text;
+    plan record;
+    rebuilt text[] := '{}';
+    rebuilt_table text;
+    total integer;
+    step integer := 0;
+    versions text[] := (select array_agg(version_num) from public.alembic_version);
+begin
+    -- the temporary tables are dropped at commit, they only exist here if a
+    -- rollback already ran in the current transaction
+    if to_regclass('pg_temp.rollback_state') is not null then
+        drop table pg_temp.rollback_state;
+        drop table pg_temp.rollback_plan;
+    end if;
+
+    create temporary table rollback_state on commit drop as
+    select * from sourcing.reconstruct(criteria);
+
+    create temporary table rollback_plan (
+        "table_name" text,
+        "depth"      integer,
+        "deleted"    bigint,
+        "inserted"   bigint,
+        "updated"    bigint
+    ) on commit drop;
+
+    for tbl in (
+        select entity_tables.table_name::text as name, entity_tables.depth
+          from sourcing.entity_tables()
+      order by entity_tables.depth, entity_tables.table_name
+    )
+    loop
+        pk := tbl.name || '_id';
+        insert_columns := '';
+        insert_values := '';
+        for col in (
+            select attribute.attname as col_name,
+                   pg_get_expr(def.adbin, def.adrelid) as col_default
+              from pg_attribute as attribute
+         left join pg_attrdef as def
+                on def.adrelid = attribute.attrelid and def.adnum = attribute.attnum
+             where attribute.attrelid = format('public.%I', tbl.name)::regclass
+               and attribute.attnum > 0
+               and not attribute.attisdropped
+          order by attribute.attnum
+        )
+        loop
+            insert_columns := insert_columns || format(', %I', col.col_name);
+            insert_values := insert_values
+                || format(', case when s.data ? %L then (s.r).%I else %s end',
+                          col.col_name, col.col_name, coalesce(col.col_default, 'null'));
+        end loop;
+
+        if to_regclass(format('pg_temp.%I', 'rollback_' || tbl.name)) is not null then
+            execute format('drop table pg_temp.%I', 'rollback_' || tbl.name);
+        end if;
+        execute format(
+            'create temporary table %I (like public.%I) on commit drop',
+            'rollback_' || tbl.name, tbl.name
+        );
+        execute format(
+            'insert into pg_temp.%1$I (%2$s)
+             select %3$s
+               from (
+                 select state.data, jsonb_populate_record(null::public.%4$I, state.data) as r
+                   from (
+                     select rollback_state.data || jsonb_build_object(%5$L, rollback_state.uuid) as data
+                       from pg_temp.rollback_state
+                      where rollback_state.type = %4$L
+                   ) as state
+               ) as s',
+            'rollback_' || tbl.name, right(insert_columns, -2), right(insert_values, -2),
+            tbl.name, pk
+        );
+
+        execute format(
+            'insert into pg_temp.rollback_plan
+             select %1$L, %2$s,
+                    count(*) filter (where target.%3$I is null),
+                    count(*) filter (where current.%3$I is null),
+                    count(*) filter (where current.%3$I is not null
+                                       and target.%3$I is not null
+                                       and to_jsonb(current) <> to_jsonb(target))
+               from public.%1$I as current
+          full join pg_temp.%4$I as target on target.%3$I = current.%3$I',
+            tbl.name, tbl.depth, pk, 'rollback_' || tbl.name
+        );
+    end loop;
+
+    if dry_run then
+        return query
+            select rollback_plan.table_name, rollback_plan.deleted,
+                   rollback_plan.inserted, rollback_plan.updated
+              from pg_temp.rollback_plan
+          order by rollback_plan.depth, rollback_plan.table_name;
+        return;
+    end if;
+
+    -- a table is rebuilt when it changes or when it references a rebuilt table
+    for plan in (
+        select * from pg_temp.rollback_plan order by rollback_plan.depth, rollback_plan.table_name
+    )
+    loop
+        if plan.deleted + plan.inserted + plan.updated > 0 or exists (
+            select
+              from pg_constraint
+             where pg_constraint.contype = 'f'
+               and pg_constraint.conrelid = format('public.%I', plan.table_name)::regclass
+               and pg_constraint.confrelid in (
+                   select format('public.%I', rebuilt_tables.name)::regclass
+                     from unnest(rebuilt) as rebuilt_tables(name)
+               )
+        ) then
+            rebuilt := rebuilt || plan.table_name;
+        end if;
+    end loop;
+
+    perform set_config('sourcing.skip_apply', 'on', true);
+    foreach rebuilt_table in array rebuilt
+    loop
+        execute format(
+            'insert into sourcing.eventstore
+                ("event", "type", "uuid", "data", "timestamp", "user_id", "alembic_version")
+             select compensation.event, %1$L, compensation.uuid, compensation.data, %2$L, %3$s, %4$L
+               from (
+                 select 0 as step, ''delete'' as event, current.%5$I as uuid, ''{}''::jsonb as data
+                   from public.%1$I as current
+              left join pg_temp.%6$I as target on target.%5$I = current.%5$I
+                  where target.%5$I is null or to_jsonb(current) <> to_jsonb(target)
+              union all
+                 select 1, ''create'', target.%5$I, to_jsonb(target) - %5$L
+                   from pg_temp.%6$I as target
+              left join public.%1$I as current on current.%5$I = target.%5$I
+                  where current.%5$I is null or to_jsonb(current) <> to_jsonb(target)
+               ) as compensation
+           order by compensation.step, compensation.uuid',
+            rebuilt_table, ts, user_id, versions, rebuilt_table || '_id',
+            'rollback_' || rebuilt_table
+        );
+    end loop;
+    perform set_config('sourcing.skip_apply', 'off', true);
+
+    total := coalesce(array_length(rebuilt, 1), 0);
+    if total > 0 then
+        execute (
+            select 'truncate ' || string_agg(format('public.%I', rebuilt_tables.name), ', ')
+              from unnest(rebuilt) as rebuilt_tables(name)
+        );
+    end if;
+
+    foreach rebuilt_table in array rebuilt
+    loop
+        step := step + 1;
+        execute format('insert into public.%I select * from pg_temp.%I',
+                       rebuilt_table, 'rollback_' || rebuilt_table);
+        raise notice 'rollback: table % rebuilt (%/%)', rebuilt_table, step, total;
+    end loop;
+
+    return query
+        select rollback_plan.table_name, rollback_plan.deleted,
+               rollback_plan.inserted, rollback_plan.updated
+          from pg_temp.rollback_plan
+      order by rollback_plan.depth, rollback_plan.table_name;
+end;
+$function$
+language plpgsql;
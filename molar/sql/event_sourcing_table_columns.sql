@@ -0,0 +1,185 @@
+-- table_columns
+--
+-- copy of the information_schema.columns rows of the public tables, used by
+-- the trigger functions instead of querying the catalog for every event.
+create table if not exists sourcing.table_columns (
+    "table_name"               name    not null,
+    "column_name"              name    not null,
+    "data_type"                text    not null,
+    "udt_name"                 name,
+    "udt_schema"               name,
+    "character_maximum_length" integer,
+    "ordinal_position"         integer not null,
+    primary key ( "table_name", "column_name" )
+);
+
+
+create or replace function sourcing.refresh_table_columns()
+returns void as $function$
+begin
+    delete from sourcing.table_columns;
+    insert into sourcing.table_columns
+        ("table_name", "column_name", "data_type", "udt_name", "udt_schema",
+         "character_maximum_length", "ordinal_position")
+    select columns.table_name,
+           columns.column_name,
+           columns.data_type,
+           columns.udt_name,
+           columns.udt_schema,
+           columns.character_maximum_length,
+           columns.ordinal_position
+      from information_schema.columns
+     where table_schema = 'public';
+end;
+$function$
+language plpgsql;
+
+
+create or replace function sourcing.on_ddl_refresh_table_columns()
+returns event_trigger as $function$
+begin
+    perform sourcing.refresh_table_columns();
+end;
+$function$
+language plpgsql;
+
+
+-- keeps table_columns in sync with the catalog, whether the schema is changed
+-- through an alembic migration or not
+drop event trigger if exists sourcing_refresh_table_columns;
+create event trigger sourcing_refresh_table_columns
+    on ddl_command_end
+    when tag in ('CREATE TABLE', 'CREATE TABLE AS', 'SELECT INTO', 'ALTER TABLE',
+                 'DROP TABLE', 'CREATE TYPE', 'ALTER TYPE', 'DROP TYPE',
+                 'CREATE DOMAIN', 'ALTER DOMAIN', 'DROP DOMAIN')
+    execute procedure sourcing.on_ddl_refresh_table_columns();
+
+
+select sourcing.refresh_table_columns();
+
+
+-- on_create_query
+--
+-- builds an insert query from a record
+create or replace function sourcing.on_create_query(new record)
+returns text as $query_txt$
+declare
+    q1 text := '';
+    q2 text := '';
+    rec record;
+begin
+    for rec in (
+        select table_columns.column_name as col_name,
+                 table_columns.data_type as col_type,
+                  table_columns.udt_name as udt_name,
+                table_columns.udt_schema as udt_schema,
+                table_columns.character_maximum_length as max_length
+          from sourcing.table_columns
+         where table_name = new.type
+      order by ordinal_position
+    )
+    loop
+        continue when rec.col_name = format('%s_id', rec.col_type);
+        if new.data ? rec.col_name = true then
+            q1 = q1 || format(', %I', rec.col_name);
+            case rec.col_type
+            when 'USER-DEFINED' then
+                q2 = q2 || format(', cast( %L as %I.%I )',
+                      new.data->>rec.col_name, rec.udt_schema, rec.udt_name);
+            when 'ARRAY' then
+                -- the current schema has only array of float8
+                q2 = q2 || format(', cast( %L as float8[])',
+                                  (select array_agg(arr::text)
+                                     from jsonb_array_elements((new.data->>rec.col_name)::jsonb) arr)::text);
+            when 'integer' then
+                q2 = q2 || format(', cast( %L as numeric )::integer',
+                                  new.data->>rec.col_name);
+            when 'character varying' then
+                q2 = q2 || format(', cast( %L as character varying(%s))',
+                                  new.data->>rec.col_name,
+                                  rec.max_length);
+            else
+                q2 = q2 || format(', cast( %L as %s )',
+                                  new.data->>rec.col_name,
+                                  rec.col_type);
+            end case;
+        else
+           if rec.col_name = 'created_on' or rec.col_name = 'updated_on' then
+                q1 = q1 || format(', %I', rec.col_name);
+                q2 = q2 || format(', cast( %L as timestamp without time zone )', new.timestamp);
+            end if;
+        end if;
+    end loop;
+
+    return format('insert into public.%I ("%s_id" %s) values (%L %s) returning "%s_id"',
+                  new.type, new.type, q1, new.uuid, q2, new.type);
+end;
+$query_txt$
+language plpgsql;
+
+
+create or replace function sourcing.on_update_query(new record)
+returns text as $query_txt$
+declare
+    q1 text := '';
+    rec record;
+begin
+    if new.uuid is null then
+        raise null_value_not_allowed using message='No uuid has been provided';
+    end if;
+    for rec in (
+        select table_columns.column_name as col_name,
+                 table_columns.data_type as col_type,
+                  table_columns.udt_name as udt_name,
+                table_columns.udt_schema as udt_schema,
+                table_columns.character_maximum_length as max_length
+          from sourcing.table_columns
+         where table_name = new.type
+      order by ordinal_position
+    )
+    loop
+        continue when rec.col_name = format('%s_id', rec.col_type);
+        if new.data ? rec.col_name = true then
+            case
+            when rec.col_type = 'user-defined' then
+                q1 = q1 || format(', %I cast( %L as %I.%I )',
+                                  rec.col_name,
+                                  new.data->>rec.col_name,
+                                  rec.udt_schema,
+                                  rec.udt_name);
+            when rec.col_type = 'jsonb' then
+                -- Does an aggreagation of the two jsonb. Last key wins.
+                q1 = q1 || format(', %I = ( select %I from public.%I
+                                             where %I.%s_id=%L ) || cast( %L as jsonb )',
+                                    rec.col_name, rec.col_name, new.type, new.type,
+                                    new.type, new.uuid, new.data->>rec.col_name);
+            when rec.col_type = 'ARRAY' then
+                q1 = q1 || format(', %I = cast( %L as float8[] )',
+                                  rec.col_name,
+                                  (select array_agg(arr::text)
+                                     from jsonb_array_elements((new.data->>rec.col_name)::jsonb) arr)::text);
+            when rec.col_type = 'integer' then
+                q1 = q1 || format(', %I = cast( %L as numeric )::integer',
+                                  rec.col_name,
+                                  new.data->>rec.col_name);
+            when rec.col_type = 'character varying' then
+                q1 = q1 || format(', %I = cast( %L as character varying(%s) )',
+                                  rec.col_name,
+                                  new.data->>rec.col_name,
+                                  rec.max_length);
+            else
+                q1 = q1 || format(', %I = cast( %L as %s )',
+                                  rec.col_name, new.data->>rec.col_name, rec.col_type);
+            end case;
+        else
+            if rec.col_name = 'updated_on' then
+                q1 = q1 || format(', updated_on = cast( %L as timestamp without time zone )',
+                                  new.timestamp);
+            end if;
+        end if;
+    end loop;
+    return format('update public.%I set %s where "%s_id" = %L',
+                  new.type, right(q1, -2), new.type, new.uuid);
+end;
+$query_txt$
+language plpgsql;
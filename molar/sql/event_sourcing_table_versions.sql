@@ -0,0 +1,45 @@
+-- table_version
+--
+-- version of each public table, bumped in the transaction of every event
+-- touching it. Query results are cached under these versions: a cached result
+-- is stale as soon as the version of one of the tables it reads has changed.
+create table if not exists sourcing.table_version (
+    "table_name" name   primary key,
+    "version"    bigint not null default 0
+);
+
+
+create or replace function sourcing.on_events_bump_table_version()
+returns trigger as $function$
+begin
+    -- rollbacks may revert the events of every table
+    if exists (select 1 from new_events where new_events.event like 'rollback%') then
+        insert into sourcing.table_version as versions ("table_name", "version")
+        select entity_tables.table_name, 1
+          from sourcing.entity_tables()
+      order by entity_tables.table_name
+        on conflict ("table_name") do update set "version" = versions.version + 1;
+        return null;
+    end if;
+
+    -- the rows are locked in the same order by all the transactions
+    insert into sourcing.table_version as versions ("table_name", "version")
+    select distinct new_events.type, 1
+      from new_events
+     where new_events.type is not null
+  order by 1
+    on conflict ("table_name") do update set "version" = versions.version + 1;
+    return null;
+end;
+$function$
+language plpgsql;
+
+
+-- once per statement, so a batch of events bumps each table only once
+drop trigger if exists on_events_bump_table_version on sourcing.eventstore;
+create trigger on_events_bump_table_version
+    after insert
+    on sourcing.eventstore
+    referencing new table as new_events
+    for each statement
+        execute procedure sourcing.on_events_bump_table_version();
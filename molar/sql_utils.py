@@ -1,4 +1,5 @@
 # external
+import pkg_resources
 from sqlalchemy import text
 import sqlalchemy as sa
 
@@ -52,3 +53,19 @@ def grant_access_right(connection, user):
             f"schema public to {user};"
         )
     )
+
+
+def read_sql_file(filename):
+    return open(pkg_resources.resource_filename("molar", f"sql/{filename}"), "r").read()
+
+
+def read_sql_function(filename, function_name):
+    """
+    Extracts the `create or replace function` statement of `function_name`
+    from one of the sql files shipped with molar. This is used by the migrations
+    to restore a previous version of a function on downgrade.
+    """
+    sql = read_sql_file(filename)
+    start = sql.index(f"create or replace function {function_name}(")
+    end = sql.index("language plpgsql;", start) + len("language plpgsql;")
+    return sql[start:end]
@@ -37,7 +37,7 @@ def new_database_headers(client, molar_main_headers):
             "superuser_email": "test@firstuser.com",
             "superuser_password": "asdf",
             "database_name": "test_database",
-            "alembic_revisions": ["compchem@head"],
+            "alembic_revisions": ["compchem@head", "eventstore@head"],
         },
     )
     assert out.status_code == 200
@@ -5,7 +5,7 @@ class TestAlembic:
 
     def test_alembic_downgrade(self, client, new_database_headers):
         out = client.post(
-            "/api/v1/alembic/downgrade?database_name=test_database&revision=-1",
+            "/api/v1/alembic/downgrade?database_name=test_database&revision=eventstore@-1",
             headers=new_database_headers,
         )
         assert out.status_code == 200
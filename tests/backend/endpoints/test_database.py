@@ -6,7 +6,7 @@ def test_database_creation_request(client):
             "superuser_email": "test@firstuser.com",
             "superuser_password": "asdf",
             "database_name": "test_database_endpoints",
-            "alembic_revisions": ["compchem@head"],
+            "alembic_revisions": ["compchem@head", "eventstore@head"],
         },
     )
     assert out.status_code == 200
@@ -62,3 +62,11 @@ def test_remove_database(client, molar_main_headers):
     assert out.status_code == 200
     out = client.delete("/api/v1/database/asdf", headers=molar_main_headers)
     assert out.status_code == 404
+
+
+def test_get_database_registry_stats(client, molar_main_headers):
+    out = client.get("/api/v1/database/registry", headers=molar_main_headers)
+    assert out.status_code == 200
+    stats = out.json()
+    assert "main" in stats["databases"]
+    assert stats["size"] == len(stats["databases"])
@@ -1,5 +1,11 @@
 # std
+import csv
 from datetime import datetime
+import io
+import json
+
+# external
+import sqlalchemy
 
 
 class TestEventStore:
@@ -80,3 +86,351 @@ class TestEventStore:
         events = out.json()
         assert events[0]["alembic_version"] is not None
         assert events[0]["user_id"] is not None
+
+    def test_bulk_eventstore(self, client, new_database_headers):
+        out = client.post(
+            "/api/v1/eventstore/test_database/bulk",
+            headers=new_database_headers,
+            json=[
+                {"type": "molecule", "data": {"smiles": "bulk1"}},
+                {"type": "molecule", "data": {"smiles": "bulk2"}},
+            ],
+        )
+        assert out.status_code == 200
+        uuids = out.json()["uuids"]
+        assert len(uuids) == 2
+
+        out = client.get(
+            "/api/v1/eventstore/test_database", headers=new_database_headers
+        )
+        n_events = len(out.json())
+
+        # The second event fails, the whole batch should be rolled back
+        out = client.post(
+            "/api/v1/eventstore/test_database/bulk",
+            headers=new_database_headers,
+            json=[
+                {
+                    "type": "molecule",
+                    "event": "update",
+                    "uuid": uuids[0],
+                    "data": {"smiles": "bulk3"},
+                },
+                {
+                    "type": "molecule",
+                    "event": "delete",
+                    "uuid": "91912ca4-cf33-428b-baf0-dfe89ef2dbda",
+                },
+            ],
+        )
+        assert out.status_code == 404
+        out = client.get(
+            "/api/v1/eventstore/test_database", headers=new_database_headers
+        )
+        assert len(out.json()) == n_events
+
+        # Rollback events cannot be sent in bulk
+        out = client.post(
+            "/api/v1/eventstore/test_database/bulk",
+            headers=new_database_headers,
+            json=[{"event": "rollback", "data": {}}],
+        )
+        assert out.status_code == 422
+
+    def test_copy_eventstore(self, client, new_database_headers):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["molecule", json.dumps({"smiles": "copy1"})])
+        writer.writerow(["molecule", json.dumps({"smiles": "copy2"})])
+        out = client.post(
+            "/api/v1/eventstore/test_database/copy",
+            headers={**new_database_headers, "Content-Type": "text/csv"},
+            data=buffer.getvalue(),
+        )
+        assert out.status_code == 200
+        assert out.json()["count"] == 2
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "filters": {"type": "molecule.smiles", "op": "==", "value": "copy2"},
+            },
+        )
+        assert out.status_code == 200
+        assert len(out.json()) == 1
+
+        out = client.post(
+            "/api/v1/eventstore/test_database/copy",
+            headers={**new_database_headers, "Content-Type": "text/csv"},
+            data='idontexist,"{}"\n',
+        )
+        assert out.status_code == 404
+
+    def test_copy_eventstore_defaults(self, client, new_database_headers):
+        # molar
+        from molar.backend import database
+
+        engine = database.test_database.engine
+        with engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text(
+                    "alter table molecule add column source text not null "
+                    "default 'copy'"
+                )
+            )
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["molecule", json.dumps({"smiles": "default1"})])
+        writer.writerow(
+            ["molecule", json.dumps({"smiles": "default2", "source": "given"})]
+        )
+        out = client.post(
+            "/api/v1/eventstore/test_database/copy",
+            headers={**new_database_headers, "Content-Type": "text/csv"},
+            data=buffer.getvalue(),
+        )
+        assert out.status_code == 200
+        assert out.json()["count"] == 2
+
+        with engine.begin() as connection:
+            sources = dict(
+                connection.execute(
+                    sqlalchemy.text(
+                        "select smiles, source from molecule "
+                        "where smiles in ('default1', 'default2')"
+                    )
+                ).all()
+            )
+            connection.execute(
+                sqlalchemy.text("alter table molecule drop column source")
+            )
+        assert sources == {"default1": "copy", "default2": "given"}
+
+    def test_paginate_eventstore(self, client, new_database_headers, monkeypatch):
+        out = client.get(
+            "/api/v1/eventstore/test_database", headers=new_database_headers
+        )
+        events = out.json()
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"limit": 2},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        page = out.json()
+        assert [e["id"] for e in page] == [e["id"] for e in events[:2]]
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"after_id": page[-1]["id"], "limit": 2},
+            headers=new_database_headers,
+        )
+        assert [e["id"] for e in out.json()] == [e["id"] for e in events[2:4]]
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"type": "molecule", "event": "create"},
+            headers=new_database_headers,
+        )
+        assert all(e["event"] == "create" for e in out.json())
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"before": str(datetime(1980, 1, 1))},
+            headers=new_database_headers,
+        )
+        assert out.json() == []
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"stream": True},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert out.headers["content-type"] == "application/x-ndjson"
+        lines = [json.loads(line) for line in out.text.splitlines()]
+        assert [e["id"] for e in lines] == [e["id"] for e in events]
+
+        # molar
+        from molar.backend.core.config import settings
+
+        monkeypatch.setattr(settings, "EVENTSTORE_PAGE_SIZE", 2)
+        monkeypatch.setattr(settings, "EVENTSTORE_MAX_PAGE_SIZE", 3)
+        out = client.get(
+            "/api/v1/eventstore/test_database", headers=new_database_headers
+        )
+        assert [e["id"] for e in out.json()] == [e["id"] for e in events[:2]]
+
+        # the full pages point to the next one, until the listing is exhausted
+        ids = []
+        params = {}
+        while True:
+            out = client.get(
+                "/api/v1/eventstore/test_database",
+                params=params,
+                headers=new_database_headers,
+            )
+            ids += [e["id"] for e in out.json()]
+            if "X-Molar-After-Id" not in out.headers:
+                break
+            params["after_id"] = out.headers["X-Molar-After-Id"]
+        assert ids == [e["id"] for e in events]
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"limit": 4},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 400
+
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            params={"limit": 4, "stream": True},
+            headers=new_database_headers,
+        )
+        assert len(out.text.splitlines()) == 4
+
+    def test_eventstore_partitions(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/eventstore/test_database/partitions",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        partitions = out.json()
+        assert partitions[0]["name"] == "eventstore_default"
+        n_events = sum(p["count"] for p in partitions)
+        out = client.get(
+            "/api/v1/eventstore/test_database", headers=new_database_headers
+        )
+        assert n_events == len(out.json())
+
+        out = client.post(
+            "/api/v1/eventstore/test_database/partitions",
+            params={"months_ahead": 6},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert len(out.json()) == 3
+
+        out = client.patch(
+            "/api/v1/eventstore/test_database/partitions/archive",
+            params={"before": str(datetime(1980, 1, 1))},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert out.json() == []
+
+    def test_history_eventstore(self, client, new_database_headers):
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "history1"}},
+        )
+        uuid = out.json()["uuid"]
+        client.patch(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "history2"}, "uuid": uuid},
+        )
+        out = client.get(
+            f"/api/v1/eventstore/test_database/history/{uuid}",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert [e["event"] for e in out.json()] == ["create", "update"]
+
+        out = client.get(
+            "/api/v1/eventstore/test_database/history/"
+            "91912ca4-cf33-428b-baf0-dfe89ef2dbda",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 404
+
+    def test_rollback_plan_eventstore(self, client, new_database_headers):
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "rollback1"}},
+        )
+        assert out.status_code == 200
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={"types": "molecule", "limit": 1000},
+        )
+        n_molecules = len(out.json())
+
+        out = client.get(
+            "/api/v1/eventstore/rollback/test_database",
+            params={"before": str(datetime(1980, 1, 1))},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        plan = {row["table_name"]: row for row in out.json()}
+        assert plan["molecule"]["deleted"] == n_molecules
+        assert plan["molecule"]["inserted"] == 0
+
+        out = client.patch(
+            "/api/v1/eventstore/rollback/test_database",
+            params={"before": str(datetime(1980, 1, 1))},
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert out.json()["data"]["tables"]["molecule"]["deleted"] == n_molecules
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={"types": "molecule"},
+        )
+        assert out.json() == []
+
+    def test_snapshots_eventstore(self, client, new_database_headers):
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "snapshot1"}},
+        )
+        out = client.post(
+            "/api/v1/eventstore/test_database/snapshots",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        snapshot = out.json()
+        assert snapshot["row_count"] >= 1
+
+        out = client.get(
+            "/api/v1/eventstore/test_database/snapshots",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 200
+        assert out.json()[0]["snapshot_id"] == snapshot["snapshot_id"]
+
+        # the rollback starts from the snapshot
+        out = client.get(
+            "/api/v1/eventstore/rollback/test_database",
+            params={"before": str(datetime(2100, 1, 1))},
+            headers=new_database_headers,
+        )
+        plan = {row["table_name"]: row for row in out.json()}
+        assert plan["molecule"] == {
+            "table_name": "molecule",
+            "deleted": 0,
+            "inserted": 0,
+            "updated": 0,
+        }
+
+        out = client.delete(
+            "/api/v1/eventstore/test_database/snapshots",
+            headers=new_database_headers,
+        )
+        assert out.status_code == 400
+        out = client.delete(
+            "/api/v1/eventstore/test_database/snapshots",
+            params={"keep": 0},
+            headers=new_database_headers,
+        )
+        assert out.json() == [snapshot["snapshot_id"]]
@@ -1,3 +1,6 @@
+# std
+import json
+
 # external
 import pytest
 
@@ -333,3 +336,760 @@ class TestQuery:
             json=datum,
             params={"explain_analyze": True},
         )
+
+    def test_columnar_query(self, client, new_database_headers):
+        query = {
+            "types": ["molecule.smiles", "molecule.metadata.test", "molecule_type.name"],
+            "joins": {"type": "molecule_type", "join_type": "outer"},
+            "order_by": {"type": "molecule.smiles"},
+        }
+        out = client.get(
+            "/api/v1/query/test_database", headers=new_database_headers, json=query
+        )
+        assert out.status_code == 200
+        records = out.json()
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"columnar": True},
+            json=query,
+        )
+        assert out.status_code == 200
+        columns = out.json()
+        assert list(columns.keys()) == list(records[0].keys())
+        assert columns["molecule.smiles"] == ["abc", "def"]
+        assert columns["molecule_type.name"] == [None, "test_type"]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={"types": "molecule.smiles", "order_by": {"type": "molecule.smiles"}},
+        )
+        assert out.json() == [{"smiles": "abc"}, {"smiles": "def"}]
+
+    def test_projection(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "projections": {"type": "molecule", "include": ["smiles"]},
+                "order_by": {"type": "molecule.smiles"},
+            },
+        )
+        assert out.status_code == 200
+        assert [set(record.keys()) for record in out.json()] == [
+            {"molecule_id", "smiles"}
+        ] * 2
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": ["conformer", "molecule"],
+                "joins": {"type": "molecule"},
+                "projections": {"type": "molecule", "exclude": ["created_on"]},
+            },
+        )
+        assert out.status_code == 200
+        record = out.json()[0]
+        assert "molecule.created_on" not in record
+        assert "molecule.metadata" in record
+        assert "conformer.x" in record
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"defer_large": True},
+            json={
+                "types": ["conformer", "molecule"],
+                "joins": {"type": "molecule"},
+                "projections": {"type": "molecule", "include": ["metadata"]},
+            },
+        )
+        assert out.status_code == 200
+        record = out.json()[0]
+        assert "conformer.x" not in record
+        assert "conformer.metadata" not in record
+        assert "conformer.created_on" in record
+        assert set(k for k in record if k.startswith("molecule.")) == {
+            "molecule.molecule_id",
+            "molecule.metadata",
+        }
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "projections": {"type": "molecule", "include": ["mass"]},
+            },
+        )
+        assert out.status_code == 400
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "projections": {"type": "conformer", "exclude": ["x"]},
+            },
+        )
+        assert out.status_code == 400
+
+    def test_arrow_query(self, client, new_database_headers):
+        pyarrow = pytest.importorskip("pyarrow")
+        # external
+        import pyarrow.parquet
+
+        query = {
+            "types": ["conformer", "molecule.smiles"],
+            "joins": {"type": "molecule"},
+        }
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={
+                **new_database_headers,
+                "Accept": "application/vnd.apache.arrow.stream",
+            },
+            json=query,
+        )
+        assert out.status_code == 200
+        assert out.headers["content-type"] == "application/vnd.apache.arrow.stream"
+        table = pyarrow.ipc.open_stream(out.content).read_all()
+        assert table.num_rows == 1
+        assert table.column("conformer.x").type == pyarrow.list_(pyarrow.float64())
+        assert table.column("conformer.x").to_pylist() == [[0.0]]
+        assert table.column("molecule.smiles").to_pylist() == ["abc"]
+
+        records = client.get(
+            "/api/v1/query/test_database", headers=new_database_headers, json=query
+        ).json()
+        assert table.column("conformer.conformer_id").to_pylist() == [
+            records[0]["conformer.conformer_id"]
+        ]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={
+                **new_database_headers,
+                "Accept": "application/vnd.apache.parquet",
+            },
+            json=query,
+        )
+        assert out.status_code == 200
+        table = pyarrow.parquet.read_table(pyarrow.BufferReader(out.content))
+        assert table.column("molecule.smiles").to_pylist() == ["abc"]
+
+    def test_stream_query(self, client, new_database_headers):
+        query = {
+            "types": ["molecule.smiles", "molecule_type.name"],
+            "joins": {"type": "molecule_type", "join_type": "outer"},
+            "order_by": {"type": "molecule.smiles"},
+        }
+        records = client.get(
+            "/api/v1/query/test_database", headers=new_database_headers, json=query
+        ).json()
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"stream": True},
+            json=query,
+        )
+        assert out.status_code == 200
+        assert out.headers["content-type"] == "application/x-ndjson"
+        assert [json.loads(line) for line in out.text.splitlines()] == records
+
+        pyarrow = pytest.importorskip("pyarrow")
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={
+                **new_database_headers,
+                "Accept": "application/vnd.apache.arrow.stream",
+            },
+            params={"stream": True},
+            json=query,
+        )
+        assert out.status_code == 200
+        table = pyarrow.ipc.open_stream(out.content).read_all()
+        assert table.to_pylist() == records
+
+    def test_stream_whole_result(self, client, new_database_headers):
+        uuids = []
+        for i in range(12):
+            out = client.post(
+                "/api/v1/eventstore/test_database",
+                headers=new_database_headers,
+                json={"type": "molecule", "data": {"smiles": f"streamed-{i}"}},
+            )
+            assert out.status_code == 200
+            uuids.append(out.json()["uuid"])
+        count = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            json={"types": "molecule"},
+        ).json()["count"]
+        assert count > 10
+
+        # without a limit, the whole result is streamed
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"stream": True},
+            json={"types": "molecule.smiles"},
+        )
+        assert out.status_code == 200
+        assert len(out.text.splitlines()) == count
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={"types": "molecule.smiles"},
+        )
+        assert len(out.json()) == 10
+
+        for uuid in uuids:
+            out = client.delete(
+                "/api/v1/eventstore/test_database",
+                headers=new_database_headers,
+                json={"type": "molecule", "uuid": uuid},
+            )
+            assert out.status_code == 200
+
+    def test_stream_own_session(self, client, new_database_headers, monkeypatch):
+        # molar
+        from molar.backend import database
+
+        # the streamed rows are read from a session opened by the generator of
+        # the response, not from the one of the request
+        handler = database.test_database
+        read_session = handler.read_session
+        opened = []
+
+        def _read_session(lsn=None):
+            opened.append(lsn)
+            return read_session(lsn)
+
+        monkeypatch.setattr(handler, "read_session", _read_session)
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"stream": True},
+            json={"types": "molecule.smiles"},
+        )
+        assert out.status_code == 200
+        out = client.get(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            params={"stream": True},
+        )
+        assert out.status_code == 200
+        assert opened == [None, None]
+        assert handler.active_sessions == 0
+
+    def test_keyset_pagination(self, client, new_database_headers):
+        for order_by in [
+            {"type": "molecule.smiles"},
+            [
+                {"type": "molecule.created_on", "order": "desc"},
+                {"type": "molecule.smiles", "order": "asc"},
+            ],
+        ]:
+            query = {
+                "types": ["molecule.smiles", "molecule_type.name"],
+                "joins": {"type": "molecule_type", "join_type": "outer"},
+                "filters": {"type": "molecule.smiles", "op": "!=", "value": "xyz"},
+                "order_by": order_by,
+            }
+            out = client.get(
+                "/api/v1/query/test_database",
+                headers=new_database_headers,
+                params={"limit": 100},
+                json=query,
+            )
+            expected = out.json()
+            assert len(expected) == 2
+
+            pages, params = [], {"limit": 1, "keyset": True}
+            while True:
+                out = client.get(
+                    "/api/v1/query/test_database",
+                    headers=new_database_headers,
+                    params=params,
+                    json=query,
+                )
+                assert out.status_code == 200
+                pages.extend(out.json())
+                if "X-Molar-Cursor" not in out.headers:
+                    break
+                params["cursor"] = out.headers["X-Molar-Cursor"]
+            assert pages == expected
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            params={"limit": 1, "cursor": "bm90IGEgY3Vyc29y"},
+            json={"types": "molecule"},
+        )
+        assert out.status_code == 400
+
+    def test_aggregates(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule_type.name",
+                "aggregates": [
+                    {"function": "count", "type": "molecule", "alias": "n"},
+                    {"function": "array_agg", "type": "molecule.smiles"},
+                ],
+                "joins": {"type": "molecule_type", "join_type": "outer"},
+                "group_by": "molecule_type.name",
+                "order_by": {"type": "molecule_type.name"},
+            },
+        )
+        assert out.status_code == 200
+        assert out.json() == [
+            {
+                "molecule_type.name": "test_type",
+                "n": 1,
+                "array_agg(molecule.smiles)": ["def"],
+            },
+            {"molecule_type.name": None, "n": 1, "array_agg(molecule.smiles)": ["abc"]},
+        ]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": [],
+                "aggregates": [
+                    {"function": "max", "type": "molecule.smiles", "alias": "last"},
+                    {"function": "avg", "type": "molecule"},
+                ],
+            },
+        )
+        assert out.status_code == 400
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": [],
+                "aggregates": {"function": "max", "type": "molecule.smiles"},
+            },
+        )
+        assert out.status_code == 200
+        assert out.json() == [{"max(molecule.smiles)": "def"}]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule.smiles",
+                "aggregates": [
+                    {"function": "count", "type": "conformer.conformer_id", "alias": "n"},
+                    {
+                        "function": "percentile",
+                        "type": "conformer.metadata.energy",
+                        "percentile": 0.5,
+                    },
+                ],
+                "joins": {"type": "conformer", "join_type": "outer"},
+                "group_by": "molecule.smiles",
+                "having": {"type": "n", "op": ">", "value": 0},
+            },
+        )
+        assert out.status_code == 200
+        assert out.json() == [
+            {
+                "molecule.smiles": "abc",
+                "n": 1,
+                "percentile(conformer.metadata.energy)": None,
+            }
+        ]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "aggregates": {"function": "percentile", "type": "molecule.smiles"},
+            },
+        )
+        assert out.status_code == 422
+
+    def test_count(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            json={"types": "molecule", "filters": {"type": "idontexist.name"}},
+        )
+        assert out.status_code == 400
+
+        out = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            json={"types": "molecule"},
+        )
+        assert out.status_code == 200
+        assert out.json() == {"count": 2, "estimate": False}
+
+        out = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "joins": {"type": "molecule_type"},
+                "filters": {
+                    "type": "molecule_type.name",
+                    "op": "in",
+                    "value": ["test_type"],
+                },
+            },
+        )
+        assert out.json()["count"] == 1
+
+        out = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            params={"estimate": True},
+            json={
+                "types": "molecule",
+                "filters": {
+                    "type": "molecule.smiles",
+                    "op": "not_in",
+                    "value": ["x", "y"],
+                },
+            },
+        )
+        assert out.status_code == 200
+        assert out.json()["estimate"] is True
+        assert out.json()["count"] >= 1
+
+    def test_query_cache(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/query/cache/test_database", headers=new_database_headers
+        )
+        assert out.status_code == 200
+        before = out.json()
+
+        for smiles in ["abc", "def", "abc"]:
+            out = client.get(
+                "/api/v1/query/test_database",
+                headers=new_database_headers,
+                json={
+                    "types": ["molecule.smiles", "molecule_type.name"],
+                    "joins": {"type": "molecule_type", "join_type": "outer"},
+                    "filters": {
+                        "op": "or",
+                        "filters": [
+                            {"type": "molecule.smiles", "op": "==", "value": smiles},
+                            {"type": "molecule.smiles", "op": "==", "value": None},
+                        ],
+                    },
+                },
+            )
+            assert out.status_code == 200
+            assert [r["molecule.smiles"] for r in out.json()] == [smiles]
+
+        out = client.get(
+            "/api/v1/query/cache/test_database", headers=new_database_headers
+        )
+        after = out.json()
+        assert after["misses"] == before["misses"] + 1
+        assert after["hits"] == before["hits"] + 2
+        assert after["size"] == before["size"] + 1
+
+    def test_result_cache(self, client, new_database_headers, monkeypatch):
+        # molar
+        from molar.backend import database
+        from molar.backend.database.query import ResultCache
+
+        result_cache = ResultCache(16)
+        monkeypatch.setattr(database.test_database, "result_cache", result_cache)
+
+        query = {
+            "types": ["molecule_type.name"],
+            "order_by": {"type": "molecule_type.name"},
+        }
+        out = client.get(
+            "/api/v1/query/test_database", headers=new_database_headers, json=query
+        )
+        assert out.status_code == 200
+        etag = out.headers["ETag"]
+        names = [r["name"] for r in out.json()]
+
+        out = client.get(
+            "/api/v1/query/test_database", headers=new_database_headers, json=query
+        )
+        assert out.headers["ETag"] == etag
+        assert [r["name"] for r in out.json()] == names
+        assert result_cache.stats()["hits"] == 1
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "If-None-Match": etag},
+            json=query,
+        )
+        assert out.status_code == 304
+
+        # an event on another table doesn't invalidate the result
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "cached"}},
+        )
+        assert out.status_code == 200
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "If-None-Match": etag},
+            json=query,
+        )
+        assert out.status_code == 304
+
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule_type", "data": {"name": "zzz_cached"}},
+        )
+        assert out.status_code == 200
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "If-None-Match": etag},
+            json=query,
+        )
+        assert out.status_code == 200
+        assert out.headers["ETag"] != etag
+        assert [r["name"] for r in out.json()] == names + ["zzz_cached"]
+
+    def test_async_query(self, client, new_database_headers, monkeypatch):
+        pytest.importorskip("asyncpg")
+        # external
+        from fastapi import FastAPI
+        from fastapi.testclient import TestClient
+
+        # molar
+        from molar.backend import database
+        from molar.backend.api.api_v1.endpoints import eventstore
+        from molar.backend.api.api_v1.endpoints import query as query_endpoints
+        from molar.backend.core.config import settings
+
+        # the handler is opened again, with an async engine
+        monkeypatch.setattr(settings, "DATABASE_ASYNC", True)
+        database.close_database("test_database")
+        app = FastAPI()
+        app.include_router(eventstore.async_router, prefix="/api/v1/eventstore")
+        app.include_router(query_endpoints.async_router, prefix="/api/v1/query")
+
+        queries = [
+            {
+                "types": ["molecule.smiles", "molecule_type.name"],
+                "joins": {"type": "molecule_type", "join_type": "outer"},
+                "order_by": {"type": "molecule.smiles"},
+            },
+            {"types": "molecule_type", "order_by": {"type": "molecule_type.name"}},
+        ]
+        results = [
+            client.get(
+                "/api/v1/query/test_database", headers=new_database_headers, json=query
+            ).json()
+            for query in queries
+        ]
+        count = client.get(
+            "/api/v1/query/test_database/count",
+            headers=new_database_headers,
+            json={"types": "molecule"},
+        ).json()
+
+        # requests share the event loop of the client, like the asyncpg pool
+        with TestClient(app) as async_client:
+            for query, records in zip(queries, results):
+                out = async_client.get(
+                    "/api/v1/query/test_database",
+                    headers=new_database_headers,
+                    json=query,
+                )
+                assert out.status_code == 200
+                assert out.json() == records
+
+                out = async_client.get(
+                    "/api/v1/query/test_database",
+                    headers=new_database_headers,
+                    params={"stream": True},
+                    json=query,
+                )
+                assert out.status_code == 200
+                lines = out.text.splitlines()
+                assert [json.loads(line) for line in lines] == records
+
+            # the cursor holds a timestamp and a uuid, bound as such by asyncpg
+            query = {
+                "types": "molecule",
+                "order_by": {"type": "molecule.created_on", "order": "desc"},
+            }
+            records = client.get(
+                "/api/v1/query/test_database", headers=new_database_headers, json=query
+            ).json()
+            pages, params = [], {"limit": 1, "keyset": True}
+            while True:
+                out = async_client.get(
+                    "/api/v1/query/test_database",
+                    headers=new_database_headers,
+                    params=params,
+                    json=query,
+                )
+                assert out.status_code == 200
+                pages.extend(out.json())
+                if "X-Molar-Cursor" not in out.headers:
+                    break
+                params["cursor"] = out.headers["X-Molar-Cursor"]
+            assert pages == records
+
+            for estimate in [False, True]:
+                out = async_client.get(
+                    "/api/v1/query/test_database/count",
+                    headers=new_database_headers,
+                    params={"estimate": estimate},
+                    json={"types": "molecule"},
+                )
+                assert out.status_code == 200
+                assert out.json()["estimate"] == estimate
+                if not estimate:
+                    assert out.json() == count
+
+            out = async_client.post(
+                "/api/v1/eventstore/test_database",
+                headers=new_database_headers,
+                json={"type": "molecule", "data": {"smiles": "async"}},
+            )
+            assert out.status_code == 200
+            event = out.json()
+            out = async_client.get(
+                "/api/v1/eventstore/test_database",
+                headers=new_database_headers,
+                params={"after_id": event["id"] - 1},
+            )
+            assert out.json() == [event]
+            out = async_client.get(
+                "/api/v1/eventstore/test_database",
+                headers=new_database_headers,
+                params={"after_id": event["id"] - 1, "stream": True},
+            )
+            assert [json.loads(line) for line in out.text.splitlines()] == [event]
+
+            async_client.portal.call(database.test_database.async_engine.dispose)
+        database.close_database("test_database")
+
+    def test_read_replicas(self, client, new_database_headers, monkeypatch):
+        # molar
+        from molar.backend import database
+        from molar.backend.database.database_handler import (
+            create_database_engine,
+            engine_options,
+        )
+        from molar.backend.database.replicas import ReplicaSet
+
+        # the server stands in for a replica of itself
+        engine = create_database_engine(
+            database.database_uri("test_database"), engine_options("test_database")
+        )
+        replicas = ReplicaSet([engine], max_lag=5, check_interval=1)
+        monkeypatch.setattr(database.test_database, "replicas", replicas)
+
+        out = client.post(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={"type": "molecule", "data": {"smiles": "replicated"}},
+        )
+        assert out.status_code == 200
+        lsn = out.headers["X-Molar-LSN"]
+
+        query = {
+            "types": "molecule.smiles",
+            "filters": {"type": "molecule.smiles", "op": "==", "value": "replicated"},
+        }
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "X-Molar-LSN": lsn},
+            json=query,
+        )
+        assert out.status_code == 200
+        assert out.json() == [{"smiles": "replicated"}]
+        assert replicas.fallbacks == 0
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "X-Molar-LSN": "FFFFFFFF/0"},
+            json=query,
+        )
+        assert out.status_code == 200
+        assert replicas.fallbacks == 1
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers={**new_database_headers, "X-Molar-LSN": "latest"},
+            json=query,
+        )
+        assert out.status_code == 400
+        replicas.dispose()
+
+    def test_as_of_query(self, client, new_database_headers):
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "filters": {"type": "molecule.smiles", "op": "==", "value": "def"},
+            },
+        )
+        molecule = out.json()[0]
+        out = client.patch(
+            "/api/v1/eventstore/test_database",
+            headers=new_database_headers,
+            json={
+                "type": "molecule",
+                "data": {"smiles": "ghi"},
+                "uuid": molecule["molecule_id"],
+            },
+        )
+        assert out.status_code == 200
+        as_of = out.json()["timestamp"]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            params={"as_of": as_of},
+            headers=new_database_headers,
+            json={
+                "types": ["molecule.smiles", "molecule_type.name"],
+                "joins": {"type": "molecule_type"},
+            },
+        )
+        assert out.status_code == 200
+        assert out.json() == [
+            {
+                "molecule.smiles": "def",
+                "molecule_type.name": "test_type",
+            }
+        ]
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            params={"as_of": "1980-01-01T00:00:00"},
+            headers=new_database_headers,
+            json={"types": "molecule"},
+        )
+        assert out.status_code == 200
+        assert out.json() == []
+
+        out = client.get(
+            "/api/v1/query/test_database",
+            headers=new_database_headers,
+            json={
+                "types": "molecule",
+                "filters": {"type": "molecule.smiles", "op": "==", "value": "ghi"},
+            },
+        )
+        assert len(out.json()) == 1
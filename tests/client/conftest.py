@@ -32,7 +32,9 @@ def new_database_client():
 
 @pytest.fixture(scope="class")
 def new_database(client):
-    out = client.database_creation_request("new_database", ["compchem@head"])
+    out = client.database_creation_request(
+        "new_database", ["compchem@head", "eventstore@head"]
+    )
     assert out["msg"] == "Database request created"
     out = client.approve_database("new_database")
     df = client.get_database_requests()
@@ -27,7 +27,9 @@ class TestClientDatabase:
         assert len(requests) == 0
 
     def test_database_creation_request(self, client):
-        client.database_creation_request("new_database", ["compchem@head"])
+        client.database_creation_request(
+            "new_database", ["compchem@head", "eventstore@head"]
+        )
         df = client.get_database_requests()
         assert len(df) == 1
 
@@ -44,7 +46,7 @@ class TestClientDatabase:
         with pytest.raises(MolarBackendError):
             client.remove_database_request("new_database")
 
-        client.database_creation_request("test", ["compchem@head"])
+        client.database_creation_request("test", ["compchem@head", "eventstore@head"])
         client.remove_database_request("test")
 
     def test_database_removed(self, client, new_database_client):